@@ -1,9 +1,26 @@
 from flask import Flask
+import click
 from flask_login import LoginManager
 from flask_bcrypt import Bcrypt
+import datetime
 import os
+import time
 
-from .models import db, User, create_tables
+from .models import db, User, ActivityType, create_tables
+from .cache_utils import get_cached_user_data, cache_user_data, bump_model_version, flush_model_versions
+from .fragment_cache import fragment_cache, FragmentCacheExtension
+from .query_log import SlowQueryStore
+from .attendance_stats import rebuild_attendance_summary
+from .attendance_bitmaps import rebuild_attendance_bitmaps
+from .analytics import export_analytics
+from .backup import (
+    backup_database, create_snapshot, restore_backup, verify_backup, refresh_reporting_snapshot, reporting_database
+)
+from .archive import archive_records
+from .notification_utils import purge_read_notifications
+from .scheduler import run_due_jobs
+from .maintenance import database_report, run_maintenance, enable_incremental_vacuum
+from .student_import import import_students, error_report_writer
 from config import Config
 
 
@@ -17,6 +34,19 @@ def create_app(config_class=Config):
 
     login_manager.init_app(app)
     bcrypt.init_app(app)
+    fragment_cache.configure(
+        app.config['FRAGMENT_CACHE_SIZE'],
+        store_path=app.config['FRAGMENT_CACHE_DB'],
+        ttl=app.config['FRAGMENT_CACHE_TTL']
+    )
+    app.jinja_env.add_extension(FragmentCacheExtension)
+    if app.config['SLOW_QUERY_LOG_DB']:
+        db.log_slow_queries(SlowQueryStore(app.config['SLOW_QUERY_LOG_DB']), app.config['SLOW_QUERY_THRESHOLD_MS'])
+
+    # Display labels of the activity types, read once instead of per request.
+    with db.connection_context():
+        if db.table_exists(ActivityType._meta.table_name):
+            ActivityType.load()
 
     @app.before_request
     def before_request():
@@ -27,6 +57,7 @@ def create_app(config_class=Config):
     def teardown_db(exc):
         if not db.is_closed():
             db.close()
+        flush_model_versions()
 
     @app.cli.command('init_db')
     def init_db_command():
@@ -48,12 +79,183 @@ def create_app(config_class=Config):
                 else:
                     print("Admin user already exists.")
 
+    @app.cli.command('rebuild_attendance_stats')
+    def rebuild_attendance_stats_command():
+        create_tables()
+        with db:
+            rows = rebuild_attendance_summary()
+            bitmaps = rebuild_attendance_bitmaps()
+        bump_model_version('Attendance')
+        print(f"Attendance summary rebuilt: {rows} rows.")
+        print(f"Attendance bitmaps rebuilt: {bitmaps} student school years.")
+
+    @app.cli.command('export_analytics')
+    @click.argument('output_dir')
+    @click.option('--since', type=click.DateTime(formats=['%Y-%m-%d']), help='Primeira data (AAAA-MM-DD).')
+    @click.option('--until', type=click.DateTime(formats=['%Y-%m-%d']), help='Última data (AAAA-MM-DD).')
+    def export_analytics_command(output_dir, since, until):
+        with db:
+            with reporting_database() as database:
+                paths = export_analytics(output_dir, since and since.date(), until and until.date(), database)
+        for path in paths:
+            print(f"Written {path}")
+
+    @app.cli.command('archive_records')
+    @click.option('--before', type=click.DateTime(formats=['%Y-%m-%d']),
+                  help='Arquiva registros anteriores a esta data (padrão: início do ano letivo).')
+    def archive_records_command(before):
+        create_tables()
+        # No surrounding transaction: each batch commits on its own.
+        with db.connection_context():
+            boundary, moved = archive_records(before and before.date())
+        for model_name, count in moved.items():
+            print(f"{model_name}: {count} records archived.")
+        print(f"Records before {boundary.isoformat()} are now in {app.config['ARCHIVE_DATABASE']}.")
+
+    @app.cli.command('import_students')
+    @click.argument('csv_path', type=click.Path(exists=True, dir_okay=False))
+    @click.option('--pedagogue', help='E-mail do pedagogo responsável pelos alunos novos.')
+    @click.option('--errors', 'errors_path', type=click.Path(dir_okay=False),
+                  help='Grava as linhas rejeitadas neste arquivo CSV.')
+    @click.option('--encoding', default='utf-8-sig', show_default=True, help='Codificação do arquivo.')
+    def import_students_command(csv_path, pedagogue, errors_path, encoding):
+        create_tables()
+        report = open(errors_path, 'w', newline='', encoding='utf-8') if errors_path else None
+        try:
+            if report:
+                on_error = error_report_writer(report)
+            else:
+                on_error = lambda error: print(f"Line {error.line} ({error.matricula or '-'}): {error.message}")
+            # No surrounding transaction: each batch commits on its own.
+            with db.connection_context(), open(csv_path, newline='', encoding=encoding) as source:
+                pedagogue_id = None
+                if pedagogue:
+                    user = User.get_or_none(User.email == pedagogue)
+                    if user is None:
+                        raise click.BadParameter(f"No user with e-mail {pedagogue}.", param_hint='--pedagogue')
+                    pedagogue_id = user.id
+                result = import_students(source, pedagogue_id, on_error=on_error)
+        except ValueError as e:
+            raise click.ClickException(str(e))
+        finally:
+            if report:
+                report.close()
+        print(f"{result['inserted']} students added, {result['updated']} updated, {result['errors']} rows rejected.")
+
+    @app.cli.command('backup_db')
+    @click.option('--dir', 'directory', type=click.Path(file_okay=False), help='Pasta de destino (padrão: BACKUP_DIR).')
+    @click.option('--pages', type=int, help='Páginas copiadas por etapa.')
+    def backup_db_command(directory, pages):
+        # No surrounding transaction: the copy only locks the source while a
+        # step runs.
+        with db.connection_context():
+            paths = backup_database(directory, pages)
+        for path in paths:
+            print(f"Written {path}")
+
+    @app.cli.command('snapshot_db')
+    @click.option('--dir', 'directory', type=click.Path(file_okay=False), help='Pasta de destino (padrão: BACKUP_DIR).')
+    @click.option('--keep', type=int, help='Quantos snapshots manter (padrão: SNAPSHOT_KEEP).')
+    def snapshot_db_command(directory, keep):
+        try:
+            with db.connection_context():
+                paths = create_snapshot(directory, keep)
+        except ValueError as e:
+            raise click.ClickException(str(e))
+        for path in paths:
+            print(f"Written {path}")
+
+    @app.cli.command('verify_backup')
+    @click.argument('path', type=click.Path(exists=True, dir_okay=False))
+    def verify_backup_command(path):
+        try:
+            results = verify_backup(path)
+        except ValueError as e:
+            raise click.ClickException(str(e))
+        for source, problems in results.items():
+            print(f"{source}: {'; '.join(problems) if problems else 'ok'}")
+        if any(results.values()):
+            raise click.ClickException("Verification failed.")
+
+    @app.cli.command('restore_db')
+    @click.argument('path', type=click.Path(exists=True, dir_okay=False))
+    @click.confirmation_option(prompt='Substituir o banco de dados atual por esta cópia?')
+    def restore_db_command(path):
+        try:
+            with db.connection_context():
+                previous = restore_backup(path)
+        except ValueError as e:
+            raise click.ClickException(str(e))
+        create_tables()
+        print(f"Restored {path}. The previous database was saved to {', '.join(previous)}.")
+
+    @app.cli.command('refresh_reporting_snapshot')
+    def refresh_reporting_snapshot_command():
+        with db.connection_context():
+            paths = refresh_reporting_snapshot()
+        for path in paths:
+            print(f"Written {path}")
+
+    @app.cli.command('maintain_db')
+    @click.option('--report', 'report_only', is_flag=True, help='Só mostra o relatório de espaço, sem manutenção.')
+    @click.option('--vacuum-pages', type=int, help='Máximo de páginas livres devolvidas ao disco.')
+    @click.option('--convert', is_flag=True,
+                  help='Passa bancos existentes para auto_vacuum incremental (VACUUM completo, bloqueia o banco).')
+    @click.option('--objects', type=int, default=10, show_default=True, help='Tabelas e índices listados por banco.')
+    def maintain_db_command(report_only, vacuum_pages, convert, objects):
+        # No surrounding transaction: every maintenance step commits on its own.
+        with db.connection_context():
+            if convert:
+                for schema in enable_incremental_vacuum():
+                    print(f"{schema}: auto_vacuum set to incremental.")
+            if not report_only:
+                for schema, result in run_maintenance(vacuum_pages).items():
+                    print(f"{schema}: statistics updated, {result['freed_pages']} pages freed, "
+                          f"{result['free_pages']} free pages left.")
+            report = database_report()
+        for entry in report:
+            print(f"{entry['schema']}: {entry['size'] / 1024:.0f} KB, {entry['pages']} pages of {entry['page_size']} bytes, "
+                  f"{entry['free_pages']} free ({entry['free_ratio']:.1%}), auto_vacuum={entry['auto_vacuum']}")
+            for item in (entry['objects'] or [])[:objects]:
+                print(f"  {item['type']:<6} {item['name']:<40} {item['pages']:>7} pages {item['size'] / 1024:>9.0f} KB "
+                      f"{item['unused_ratio']:>6.1%} unused")
+
+    @app.cli.command('purge_notifications')
+    @click.option('--days', type=int, help='Remove notificações lidas mais antigas que N dias.')
+    def purge_notifications_command(days):
+        with db:
+            purged = purge_read_notifications(days)
+        print(f"{purged} read notifications purged.")
+
+    @app.cli.command('run_scheduler')
+    @click.option('--once', is_flag=True, help='Executa as tarefas pendentes uma vez e sai.')
+    @click.option('--interval', type=int, help='Segundos entre execuções.')
+    def run_scheduler_command(once, interval):
+        create_tables()
+        interval = interval or app.config['SCHEDULER_INTERVAL']
+        while True:
+            # Each job runs its own transactions.
+            with db.connection_context():
+                results = run_due_jobs()
+            print(f"{datetime.datetime.now():%Y-%m-%d %H:%M:%S} {results}")
+            if once:
+                break
+            time.sleep(interval)
+
     @login_manager.user_loader
     def load_user(user_id):
+        user_id = int(user_id)
+        data = get_cached_user_data(user_id)
+        if data is not None:
+            user = User(__no_default__=1, **data)
+            user._dirty.clear()
+            return user
         try:
-            return User.get(User.id == int(user_id))
+            user = User.get(User.id == user_id)
         except User.DoesNotExist:
             return None
+        cache_user_data(user_id, user.__data__)
+        return user
 
     from app import routes
     @app.context_processor
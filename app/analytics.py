@@ -0,0 +1,195 @@
+import csv
+import os
+
+import numpy as np
+from peewee import fn
+
+from app.models import AttendanceSummary, Student, User, DailyReport, GeneralReport, Observation
+from app.archive import sources
+from config import Config
+
+
+RATE_BIN_COUNT = 10
+GROUP_FIELDS = {
+    'course': Student.course,
+    'grade': Student.grade,
+}
+
+
+def _on(database, query):
+    # Reports can be read from the read-only snapshot (see
+    # app.backup.reporting_database) instead of the live database.
+    return query.bind(database) if database is not None else query
+
+
+def _columns(query, count):
+    # One round trip per table; rows are transposed into columns right away so
+    # the rest of the work happens on arrays.
+    columns = list(zip(*query.tuples()))
+    if not columns:
+        return [np.array([]) for _ in range(count)]
+    return [np.asarray(column) for column in columns]
+
+
+def _date_filter(query, field, since, until):
+    if since:
+        query = query.where(field >= since)
+    if until:
+        query = query.where(field <= until)
+    return query
+
+
+def attendance_rate_distribution(group_by='course', since=None, until=None, database=None):
+    group_field = GROUP_FIELDS[group_by]
+
+    summary_query = _date_filter(
+        AttendanceSummary
+        .select(
+            AttendanceSummary.student,
+            AttendanceSummary.present,
+            AttendanceSummary.present + AttendanceSummary.absent + AttendanceSummary.justified_absent
+        )
+        .where(AttendanceSummary.period_type == 'month'),
+        AttendanceSummary.period_start, since and since.replace(day=1), until
+    )
+    student_ids, present, total = _columns(_on(database, summary_query), 3)
+    student_query = Student.select(Student.id, fn.COALESCE(group_field, '')).order_by(Student.id)
+    known_ids, labels = _columns(_on(database, student_query), 2)
+    if not len(student_ids) or not len(known_ids):
+        return []
+
+    students, student_index = np.unique(student_ids.astype(np.int64), return_inverse=True)
+    present = np.bincount(student_index, weights=present.astype(np.float64))
+    total = np.bincount(student_index, weights=total.astype(np.float64))
+
+    position = np.clip(np.searchsorted(known_ids, students), 0, len(known_ids) - 1)
+    keep = (known_ids[position] == students) & (total > 0)
+    rates = present[keep] / total[keep]
+    groups, group_index = np.unique(labels[position[keep]].astype(str), return_inverse=True)
+
+    bins = np.minimum((rates * RATE_BIN_COUNT).astype(np.int64), RATE_BIN_COUNT - 1)
+    histogram = np.bincount(
+        group_index * RATE_BIN_COUNT + bins, minlength=len(groups) * RATE_BIN_COUNT
+    ).reshape(len(groups), RATE_BIN_COUNT)
+    student_counts = np.bincount(group_index, minlength=len(groups))
+    mean_rates = np.bincount(group_index, weights=rates, minlength=len(groups)) / student_counts
+
+    order = np.lexsort((rates, group_index))
+    bounds = np.searchsorted(group_index[order], np.arange(len(groups) + 1))
+    sorted_rates = rates[order]
+
+    result = []
+    for i, group in enumerate(groups.tolist()):
+        group_rates = sorted_rates[bounds[i]:bounds[i + 1]]
+        q1, median, q3 = np.percentile(group_rates, [25, 50, 75])
+        result.append({
+            'group': group or None,
+            'students': int(student_counts[i]),
+            'mean_rate': round(float(mean_rates[i]), 4),
+            'q1_rate': round(float(q1), 4),
+            'median_rate': round(float(median), 4),
+            'q3_rate': round(float(q3), 4),
+            'histogram': histogram[i].tolist(),
+        })
+    return result
+
+
+def activity_type_frequency(since=None, until=None, database=None):
+    # activity_type is an integer id, counted in SQL on the
+    # (activity_type, date) index.
+    counts_by_key = {}
+    for model in sources(DailyReport, since):
+        query = (_date_filter(model.select(model.activity_type, fn.COUNT(model.id)), model.date, since, until)
+                 .group_by(model.activity_type))
+        for key, count in _on(database, query).tuples():
+            counts_by_key[key] = counts_by_key.get(key, 0) + count
+    total = sum(counts_by_key.values())
+
+    result = []
+    for key, label in Config.DAILY_LOG_ACTIVITY_CHOICES:
+        count = counts_by_key.pop(key, 0)
+        result.append({
+            'activity_type': key,
+            'label': label,
+            'count': count,
+            'share': round(count / total, 4) if total else 0.0,
+        })
+    # Keys no longer present in DAILY_LOG_ACTIVITY_CHOICES.
+    for key, count in sorted(counts_by_key.items()):
+        result.append({'activity_type': key, 'label': None, 'count': count, 'share': round(count / total, 4)})
+    return result
+
+
+WORKLOAD_SOURCES = (
+    ('daily_reports', DailyReport),
+    ('general_reports', GeneralReport),
+    ('observations', Observation),
+)
+
+
+def pedagogue_workload(since=None, until=None, database=None):
+    pedagogue_ids, months, source_indexes = [], [], []
+    for source_index, (_, hot_model) in enumerate(WORKLOAD_SOURCES):
+        for model in sources(hot_model, since):
+            query = _date_filter(model.select(model.pedagogue, model.date), model.date, since, until)
+            ids, dates = _columns(_on(database, query), 2)
+            pedagogue_ids.append(ids.astype(np.int64))
+            months.append(dates.astype('datetime64[D]').astype('datetime64[M]').astype(np.int64))
+            source_indexes.append(np.full(len(ids), source_index, dtype=np.int64))
+
+    pedagogue_ids = np.concatenate(pedagogue_ids)
+    if not len(pedagogue_ids):
+        return []
+    months = np.concatenate(months)
+    source_indexes = np.concatenate(source_indexes)
+
+    keys, key_index = np.unique(np.stack([pedagogue_ids, months], axis=1), axis=0, return_inverse=True)
+    key_index = key_index.reshape(-1)
+    counts = np.bincount(
+        key_index * len(WORKLOAD_SOURCES) + source_indexes, minlength=len(keys) * len(WORKLOAD_SOURCES)
+    ).reshape(len(keys), len(WORKLOAD_SOURCES))
+
+    names = dict(_on(database, User.select(User.id, User.name)).tuples())
+    month_labels = keys[:, 1].astype('datetime64[M]').astype(str)
+    result = []
+    for (pedagogue_id, _), month, row in zip(keys.tolist(), month_labels.tolist(), counts.tolist()):
+        entry = {'pedagogue_id': pedagogue_id, 'pedagogue_name': names.get(pedagogue_id), 'month': month}
+        entry.update({name: count for (name, _), count in zip(WORKLOAD_SOURCES, row)})
+        entry['total'] = sum(row)
+        result.append(entry)
+    return result
+
+
+def _write_csv(path, rows, fieldnames):
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.DictWriter(f, fieldnames=fieldnames)
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+def export_analytics(output_dir, since=None, until=None, database=None):
+    os.makedirs(output_dir, exist_ok=True)
+    written = []
+
+    rate_fields = ['group', 'students', 'mean_rate', 'q1_rate', 'median_rate', 'q3_rate']
+    bin_fields = [f'rate_{i * 10}_{(i + 1) * 10}' for i in range(RATE_BIN_COUNT)]
+    for group_by in GROUP_FIELDS:
+        rows = []
+        for row in attendance_rate_distribution(group_by, since, until, database):
+            histogram = row.pop('histogram')
+            row.update(zip(bin_fields, histogram))
+            rows.append(row)
+        path = os.path.join(output_dir, f'attendance_rates_by_{group_by}.csv')
+        _write_csv(path, rows, rate_fields + bin_fields)
+        written.append(path)
+
+    path = os.path.join(output_dir, 'activity_types.csv')
+    _write_csv(path, activity_type_frequency(since, until, database), ['activity_type', 'label', 'count', 'share'])
+    written.append(path)
+
+    path = os.path.join(output_dir, 'pedagogue_workload.csv')
+    workload_fields = ['pedagogue_id', 'pedagogue_name', 'month'] + [name for name, _ in WORKLOAD_SOURCES] + ['total']
+    _write_csv(path, pedagogue_workload(since, until, database), workload_fields)
+    written.append(path)
+
+    return written
@@ -0,0 +1,131 @@
+import datetime
+
+from peewee import fn
+
+from app.models import (
+    db, VersionedModel, Student, Attendance, DailyReport, Notification, Observation,
+    ArchivedAttendance, ArchivedDailyReport, ArchivedNotification, ArchivedObservation, ArchiveRun
+)
+from app.cache_utils import bump_model_version
+from app.projections import archived_attendance_rows, archived_daily_report_rows
+from app.scoping import scoped
+from config import Config
+
+
+# hot model -> (archive model, column compared with the boundary)
+ARCHIVED_MODELS = {
+    Attendance: (ArchivedAttendance, Attendance.date),
+    DailyReport: (ArchivedDailyReport, DailyReport.date),
+    Notification: (ArchivedNotification, Notification.timestamp),
+    Observation: (ArchivedObservation, Observation.date),
+}
+
+
+def school_year_start(today=None, years_back=0):
+    today = today or datetime.date.today()
+    year = today.year if today.month >= Config.SCHOOL_YEAR_START_MONTH else today.year - 1
+    return datetime.date(year - years_back, Config.SCHOOL_YEAR_START_MONTH, 1)
+
+
+def default_archive_boundary(today=None):
+    return school_year_start(today, years_back=Config.ARCHIVE_KEEP_SCHOOL_YEARS - 1)
+
+
+def archive_boundary():
+    # Everything archived so far is dated before this day.
+    return ArchiveRun.select(fn.MAX(ArchiveRun.boundary)).scalar()
+
+
+def reaches_archive(since, boundary=None):
+    boundary = boundary or archive_boundary()
+    return boundary is not None and (since is None or since < boundary)
+
+
+def is_archived(date):
+    # Rows dated before the boundary live in the archive and are read-only:
+    # writing one to the live table would record the day twice.
+    return date is not None and reaches_archive(date)
+
+
+def sources(model, since=None):
+    # The hot model, plus its archive when the requested range goes back
+    # past the archive boundary.
+    if model in ARCHIVED_MODELS and reaches_archive(since):
+        return [model, ARCHIVED_MODELS[model][0]]
+    return [model]
+
+
+def _change_owners(model, rows):
+    # VersionedModel.change_owner_id for a batch: rows owned through their
+    # student are resolved with one query.
+    if 'student' not in model.owner_fields:
+        return [row['pedagogue'] for row in rows]
+    owners = dict(Student.select(Student.id, Student.pedagogue)
+                  .where(Student.id.in_({row['student'] for row in rows})).tuples())
+    return [owners.get(row['student']) for row in rows]
+
+
+def _archive_model(model, boundary, batch_size):
+    archive_model, field = ARCHIVED_MODELS[model]
+    if isinstance(boundary, datetime.date) and field is Notification.timestamp:
+        boundary = datetime.datetime.combine(boundary, datetime.time())
+    moved = 0
+    while True:
+        with db.atomic():
+            rows = list(model.select().where(field < boundary).order_by(model.id).limit(batch_size).dicts())
+            if not rows:
+                break
+            archive_model.insert_many(rows).execute()
+            model.delete().where(model.id.in_([row['id'] for row in rows])).execute()
+            # The rows left the live table: sync replicas and the change
+            # feed see them as deleted.
+            if issubclass(model, VersionedModel):
+                owners = _change_owners(model, rows)
+                model.log_changes([(row['id'], 'delete', owner) for row, owner in zip(rows, owners)],
+                                  datetime.datetime.now())
+        moved += len(rows)
+    return moved
+
+
+def archive_records(boundary=None, batch_size=None):
+    # Rows are moved in batches, each batch copied, deleted and logged in
+    # its own transaction, so callers must not wrap this in one. The attendance summaries are left as they are, so the
+    # statistics keep counting archived attendance.
+    boundary = boundary or default_archive_boundary()
+    batch_size = batch_size or Config.ARCHIVE_BATCH_SIZE
+    previous = archive_boundary()
+    if previous is not None and previous > boundary:
+        boundary = previous
+
+    moved = {}
+    for model in ARCHIVED_MODELS:
+        moved[model.__name__] = _archive_model(model, boundary, batch_size)
+        if moved[model.__name__]:
+            bump_model_version(model.__name__)
+    ArchiveRun.create(boundary=boundary, moved=sum(moved.values()))
+    return boundary, moved
+
+
+def archived_daily_reports(user, date, student_id=None, activity_type=None, shift=None):
+    query = scoped(ArchivedDailyReport.select(), ArchivedDailyReport, user).where(ArchivedDailyReport.date == date)
+    if student_id:
+        query = query.where(ArchivedDailyReport.student == student_id)
+    if activity_type:
+        query = query.where(ArchivedDailyReport.activity_type == activity_type)
+    if shift:
+        query = query.where(ArchivedDailyReport.shift.includes(shift))
+    return list(archived_daily_report_rows(query.order_by(ArchivedDailyReport.id)))
+
+
+def archived_attendance(user, date):
+    query = scoped(ArchivedAttendance.select(), ArchivedAttendance, user).where(ArchivedAttendance.date == date)
+    return list(archived_attendance_rows(query.order_by(ArchivedAttendance.id)))
+
+
+def archived_notifications(user_id, date):
+    start = datetime.datetime.combine(date, datetime.time())
+    return list(ArchivedNotification.select().where(
+        (ArchivedNotification.recipient == user_id) &
+        (ArchivedNotification.timestamp >= start) &
+        (ArchivedNotification.timestamp < start + datetime.timedelta(days=1))
+    ).order_by(ArchivedNotification.timestamp.desc()))
@@ -0,0 +1,160 @@
+import calendar
+import datetime
+
+import numpy as np
+from peewee import JOIN
+
+from app.models import db, ATTENDANCE_STATUSES, Attendance, ArchivedAttendance, AttendanceBitmap, Student
+from app.scoping import student_scope
+from config import Config
+
+
+SLOT_SHIFTS = np.array([0, 2, 4, 6], dtype=np.uint8)
+STATUS_NAMES = {code: status for status, code in ATTENDANCE_STATUSES.items()}
+
+
+def school_year_bounds(school_year):
+    start = datetime.date(school_year, Config.SCHOOL_YEAR_START_MONTH, 1)
+    return start, datetime.date(school_year + 1, Config.SCHOOL_YEAR_START_MONTH, 1)
+
+
+def pack(codes):
+    slots = np.asarray(codes, dtype=np.uint8).reshape(-1, 4) << SLOT_SHIFTS
+    return np.bitwise_or.reduce(slots, axis=1).astype(np.uint8).tobytes()
+
+
+def unpack(blobs):
+    # One row of day codes per bitmap, all of them decoded at once.
+    packed = np.frombuffer(b''.join(blobs), dtype=np.uint8).reshape(len(blobs), AttendanceBitmap.SIZE)
+    return ((packed[:, :, None] >> SLOT_SHIFTS) & 3).reshape(len(blobs), AttendanceBitmap.DAYS)
+
+
+def rebuild_attendance_bitmaps():
+    # Archived attendance is part of the school years it belongs to, so the
+    # bitmaps are rebuilt from both tables. Records of the same day are read
+    # in id order, as the latest one is kept.
+    bitmaps = {}
+    for model in (ArchivedAttendance, Attendance):
+        query = (model
+                 .select(model.student, model.date, model.status)
+                 .order_by(model.id)
+                 .tuples())
+        for student_id, date, status in query.iterator():
+            school_year, index = AttendanceBitmap.locate(date)
+            codes = bitmaps.get((student_id, school_year))
+            if codes is None:
+                codes = bitmaps[(student_id, school_year)] = np.zeros(AttendanceBitmap.DAYS, dtype=np.uint8)
+            codes[index] = ATTENDANCE_STATUSES[status]
+    rows = [(student_id, school_year, pack(codes)) for (student_id, school_year), codes in bitmaps.items()]
+    with db.atomic():
+        AttendanceBitmap.delete().execute()
+        for start in range(0, len(rows), 500):
+            AttendanceBitmap.insert_many(
+                rows[start:start + 500],
+                fields=[AttendanceBitmap.student, AttendanceBitmap.school_year, AttendanceBitmap.days]
+            ).execute()
+    return len(rows)
+
+
+def _counts(codes):
+    return {status: (codes == code).sum(axis=-1) for status, code in ATTENDANCE_STATUSES.items()}
+
+
+def streaks(codes, status='present'):
+    # Runs over the days that have a record, so weekends and holidays do not
+    # break a streak. The current streak is the run ending on the last
+    # recorded day.
+    recorded = codes[codes != 0]
+    hits = np.concatenate(([0], recorded == ATTENDANCE_STATUSES[status], [0])).astype(np.int8)
+    edges = np.flatnonzero(np.diff(hits))
+    runs = edges[1::2] - edges[::2]
+    if not len(runs):
+        return {'current': 0, 'longest': 0}
+    return {'current': int(runs[-1]) if hits[-2] else 0, 'longest': int(runs.max())}
+
+
+def student_year(student_id, school_year):
+    start, end = school_year_bounds(school_year)
+    days = AttendanceBitmap.select(AttendanceBitmap.days).where(
+        (AttendanceBitmap.student == student_id) & (AttendanceBitmap.school_year == school_year)
+    ).scalar()
+    codes = unpack([days or bytes(AttendanceBitmap.SIZE)])[0][:(end - start).days]
+    return {
+        'school_year': school_year,
+        'start': start.isoformat(),
+        'end': (end - datetime.timedelta(days=1)).isoformat(),
+        'statuses': STATUS_NAMES,
+        'days': codes.tolist(),
+        'counts': {status: int(count) for status, count in _counts(codes).items()},
+        'present_streak': streaks(codes, 'present'),
+        'absent_streak': streaks(codes, 'absent'),
+    }
+
+
+def _scoped_bitmaps(user, school_year, grade=None):
+    # Every student in scope, with an empty bitmap for those without records
+    # in the school year.
+    query = (Student
+             .select(Student.id, Student.name, Student.grade, AttendanceBitmap.days)
+             .join(AttendanceBitmap, join_type=JOIN.LEFT_OUTER, on=(
+                 (AttendanceBitmap.student == Student.id) & (AttendanceBitmap.school_year == school_year)))
+             .order_by(Student.grade, Student.name))
+    scope = student_scope(user)
+    if scope is not None:
+        query = query.where(Student.pedagogue == scope)
+    if grade:
+        query = query.where(Student.grade == grade)
+    rows = list(query.tuples())
+    empty = bytes(AttendanceBitmap.SIZE)
+    return rows, unpack([days or empty for *_, days in rows])
+
+
+def month_grid(user, year, month, grade=None):
+    first = datetime.date(year, month, 1)
+    school_year, offset = AttendanceBitmap.locate(first)
+    length = calendar.monthrange(year, month)[1]
+    rows, codes = _scoped_bitmaps(user, school_year, grade)
+    codes = codes[:, offset:offset + length]
+    counts = _counts(codes)
+    return {
+        'month': first.strftime('%Y-%m'),
+        'dates': [(first + datetime.timedelta(days=day)).isoformat() for day in range(length)],
+        'statuses': STATUS_NAMES,
+        'students': [
+            {
+                'student_id': student_id,
+                'student_name': name,
+                'grade': student_grade,
+                'days': codes[index].tolist(),
+                **{status: int(values[index]) for status, values in counts.items()},
+            }
+            for index, (student_id, name, student_grade, _) in enumerate(rows)
+        ],
+    }
+
+
+def absence_counts(user, since, until, grade=None, min_absences=1):
+    # Absences (justified or not) per student between since and until, both
+    # included, summed over the school years the range touches.
+    totals = {}
+    students = {}
+    school_year = AttendanceBitmap.locate(since)[0]
+    while school_year_bounds(school_year)[0] <= until:
+        start, end = school_year_bounds(school_year)
+        first = (max(since, start) - start).days
+        last = (min(until, end - datetime.timedelta(days=1)) - start).days
+        rows, codes = _scoped_bitmaps(user, school_year, grade)
+        counts = _counts(codes[:, first:last + 1])
+        for index, (student_id, name, student_grade, _) in enumerate(rows):
+            students[student_id] = (name, student_grade)
+            total = totals.setdefault(student_id, dict.fromkeys(ATTENDANCE_STATUSES, 0))
+            for status, values in counts.items():
+                total[status] += int(values[index])
+        school_year += 1
+    result = [
+        dict(student_id=student_id, student_name=students[student_id][0], grade=students[student_id][1], **total)
+        for student_id, total in totals.items()
+        if total['absent'] + total['justified_absent'] >= min_absences
+    ]
+    result.sort(key=lambda row: (-row['absent'] - row['justified_absent'], row['student_name']))
+    return result
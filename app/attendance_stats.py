@@ -0,0 +1,117 @@
+import datetime
+
+from peewee import fn, Select, Value
+
+from app.models import db, ATTENDANCE_STATUSES, Attendance, ArchivedAttendance, AttendanceSummary, Student
+from app.scoping import scoped
+
+
+PERIOD_TYPES = ('week', 'month')
+
+
+def _period_start_expression(period_type, date_field):
+    # SQLite equivalents of AttendanceSummary.period_starts.
+    if period_type == 'week':
+        return fn.date(date_field, '-6 days', 'weekday 1')
+    return fn.date(date_field, 'start of month')
+
+
+def rebuild_attendance_summary():
+    # Archived attendance still counts: the summaries are rebuilt from both
+    # the hot table and the archive.
+    records = (
+        Attendance.select(Attendance.student.alias('student_id'), Attendance.date, Attendance.status)
+        + ArchivedAttendance.select(ArchivedAttendance.student, ArchivedAttendance.date, ArchivedAttendance.status)
+    ).alias('records')
+    with db.atomic():
+        AttendanceSummary.delete().execute()
+        for period_type in PERIOD_TYPES:
+            period_start = _period_start_expression(period_type, records.c.date)
+            query = (
+                Select([records], [
+                    records.c.student_id,
+                    Value(period_type),
+                    period_start,
+                    fn.SUM(records.c.status == ATTENDANCE_STATUSES['present']),
+                    fn.SUM(records.c.status == ATTENDANCE_STATUSES['absent']),
+                    fn.SUM(records.c.status == ATTENDANCE_STATUSES['justified_absent']),
+                ])
+                .group_by(records.c.student_id, period_start)
+            )
+            AttendanceSummary.insert_from(query, [
+                AttendanceSummary.student,
+                AttendanceSummary.period_type,
+                AttendanceSummary.period_start,
+                AttendanceSummary.present,
+                AttendanceSummary.absent,
+                AttendanceSummary.justified_absent,
+            ]).execute()
+    return AttendanceSummary.select().count()
+
+
+def default_since(period_type, periods, today=None):
+    today = today or datetime.date.today()
+    current = AttendanceSummary.period_starts(today)[period_type]
+    if period_type == 'week':
+        return current - datetime.timedelta(weeks=periods - 1)
+    month_index = current.year * 12 + current.month - 1 - (periods - 1)
+    return datetime.date(month_index // 12, month_index % 12 + 1, 1)
+
+
+def _rate(present, absent, justified_absent):
+    total = present + absent + justified_absent
+    return round(present / total, 4) if total else None
+
+
+def _summary_query(user, period_type, since, *group_fields):
+    present = fn.SUM(AttendanceSummary.present).alias('present')
+    absent = fn.SUM(AttendanceSummary.absent).alias('absent')
+    justified_absent = fn.SUM(AttendanceSummary.justified_absent).alias('justified_absent')
+    query = (
+        AttendanceSummary
+        .select(*group_fields, AttendanceSummary.period_start, present, absent, justified_absent)
+        .join(Student, on=(AttendanceSummary.student == Student.id))
+        .where(
+            (AttendanceSummary.period_type == period_type) &
+            (AttendanceSummary.period_start >= since)
+        )
+        .group_by(*group_fields, AttendanceSummary.period_start)
+        .order_by(*group_fields, AttendanceSummary.period_start)
+    )
+    # Joined with Student, so the student scope applies as is.
+    return scoped(query, Student, user)
+
+
+def grade_attendance_stats(user, period_type, since):
+    query = _summary_query(user, period_type, since, Student.grade)
+    return [
+        {
+            'grade': grade,
+            'period_start': period_start.isoformat(),
+            'present': present,
+            'absent': absent,
+            'justified_absent': justified_absent,
+            'rate': _rate(present, absent, justified_absent),
+        }
+        for grade, period_start, present, absent, justified_absent in query.tuples()
+    ]
+
+
+def student_attendance_stats(user, period_type, since, grade=None, student_id=None):
+    query = _summary_query(user, period_type, since, Student.id, Student.name)
+    if grade:
+        query = query.where(Student.grade == grade)
+    if student_id:
+        query = query.where(AttendanceSummary.student == student_id)
+    return [
+        {
+            'student_id': sid,
+            'student_name': name,
+            'period_start': period_start.isoformat(),
+            'present': present,
+            'absent': absent,
+            'justified_absent': justified_absent,
+            'rate': _rate(present, absent, justified_absent),
+        }
+        for sid, name, period_start, present, absent, justified_absent in query.tuples()
+    ]
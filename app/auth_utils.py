@@ -0,0 +1,106 @@
+import threading
+import time
+from collections import deque
+
+from config import Config
+
+
+class SlidingWindowCounter:
+    def __init__(self, window, max_keys=10000):
+        self.window = window
+        self.max_keys = max_keys
+        self._hits = {}
+        self._lock = threading.Lock()
+
+    def _prune(self, hits, now):
+        while hits and hits[0] <= now - self.window:
+            hits.popleft()
+
+    def count(self, key):
+        now = time.monotonic()
+        with self._lock:
+            hits = self._hits.get(key)
+            if not hits:
+                return 0
+            self._prune(hits, now)
+            if not hits:
+                del self._hits[key]
+            return len(hits)
+
+    def retry_after(self, key):
+        now = time.monotonic()
+        with self._lock:
+            hits = self._hits.get(key)
+            if not hits:
+                return 0
+            return max(0, int(hits[0] + self.window - now) + 1)
+
+    def hit(self, key):
+        now = time.monotonic()
+        with self._lock:
+            if key not in self._hits and len(self._hits) >= self.max_keys:
+                self._evict_expired(now)
+            hits = self._hits.setdefault(key, deque())
+            self._prune(hits, now)
+            hits.append(now)
+
+    def reset(self, key):
+        with self._lock:
+            self._hits.pop(key, None)
+
+    def _evict_expired(self, now):
+        for key in list(self._hits):
+            hits = self._hits[key]
+            self._prune(hits, now)
+            if not hits:
+                del self._hits[key]
+        # Still full: drop the keys that were inserted first.
+        while len(self._hits) >= self.max_keys:
+            del self._hits[next(iter(self._hits))]
+
+
+_failed_logins = SlidingWindowCounter(Config.LOGIN_THROTTLE_WINDOW)
+
+
+def _ip_key(remote_addr):
+    return f'ip:{remote_addr}'
+
+
+def _account_key(user, identifier):
+    # One counter per account whichever identifier was typed (email or
+    # username); unknown identifiers are counted as typed, case-folded.
+    if user is not None:
+        return f'account:{user.id}'
+    return f'account:{identifier.strip().lower()}'
+
+
+def login_retry_after(remote_addr, user, identifier):
+    # Checked before any password hash is computed, so throttled attempts
+    # cost no bcrypt work.
+    keys = []
+    if _failed_logins.count(_ip_key(remote_addr)) >= Config.LOGIN_MAX_FAILURES_PER_IP:
+        keys.append(_ip_key(remote_addr))
+    if _failed_logins.count(_account_key(user, identifier)) >= Config.LOGIN_MAX_FAILURES_PER_ACCOUNT:
+        keys.append(_account_key(user, identifier))
+    return max((_failed_logins.retry_after(key) for key in keys), default=0)
+
+
+def record_failed_login(remote_addr, user, identifier):
+    _failed_logins.hit(_ip_key(remote_addr))
+    _failed_logins.hit(_account_key(user, identifier))
+
+
+def record_successful_login(user):
+    _failed_logins.reset(_account_key(user, None))
+
+
+def password_hash_rounds(password_hash):
+    # bcrypt hashes look like $2b$<rounds>$<salt+digest>.
+    try:
+        return int(password_hash.split('$')[2])
+    except (IndexError, ValueError):
+        return None
+
+
+def password_needs_rehash(password_hash, rounds):
+    return password_hash_rounds(password_hash) != rounds
@@ -0,0 +1,114 @@
+import bisect
+import datetime
+import operator
+from functools import reduce
+
+from app.models import Event
+from app.recurrence import MAX_EVENT_DURATION, MAX_WINDOW, Occurrence, expand, occurrence_starts
+from config import Config
+
+
+def busy_occurrences(window_start, window_end, pedagogue_id=None, student_id=None, exclude_event_id=None):
+    # Events of the pedagogue and/or the student overlapping the window.
+    # Each side of the OR is a range scan on its (owner, start_time,
+    # end_time) index, bounded below by the longest an event can last.
+    owners = []
+    if pedagogue_id:
+        owners.append(Event.pedagogue == pedagogue_id)
+    if student_id:
+        owners.append(Event.student == student_id)
+    if not owners:
+        return []
+    interval = (
+        (Event.start_time >= window_start - MAX_EVENT_DURATION) &
+        (Event.start_time < window_end) &
+        (Event.end_time > window_start)
+    )
+    single = Event.select().where(
+        Event.recurrence.is_null() & reduce(operator.or_, [owner & interval for owner in owners])
+    )
+    series = Event.select().where(reduce(operator.or_, owners))
+    if exclude_event_id:
+        single = single.where(Event.id != exclude_event_id)
+        series = series.where(Event.id != exclude_event_id)
+
+    occurrences = [
+        Occurrence(event, None, event.start_time, event.end_time, event.title, event.description)
+        for event in single
+    ]
+    occurrences += [
+        occurrence for occurrence in expand(series, window_start, window_end)
+        if occurrence.end_time > window_start
+    ]
+    return sorted(occurrences, key=lambda occurrence: occurrence.start_time)
+
+
+def _conflicts(starts, duration, pedagogue_id, student_id, exclude_event_id):
+    # starts is sorted and every interval has the same length, so the one
+    # starting last before an occurrence ends is also the one ending last.
+    if not starts:
+        return []
+    busy = busy_occurrences(starts[0], starts[-1] + duration, pedagogue_id, student_id, exclude_event_id)
+    conflicts = []
+    for occurrence in busy:
+        index = bisect.bisect_left(starts, occurrence.end_time)
+        if index and starts[index - 1] + duration > occurrence.start_time:
+            conflicts.append(occurrence)
+    return conflicts
+
+
+def interval_conflicts(start, end, pedagogue_id=None, student_id=None, exclude_event_id=None):
+    return _conflicts([start], end - start, pedagogue_id, student_id, exclude_event_id)
+
+
+def event_conflicts(event):
+    # For a recurring event every occurrence is checked, up to the end of
+    # the series or a year from its start.
+    if event.recurrence:
+        starts = list(occurrence_starts(event, event.start_time, event.start_time + MAX_WINDOW))
+    else:
+        starts = [event.start_time]
+    return _conflicts(starts, event.end_time - event.start_time, event.pedagogue_id, event.student_id, event.id)
+
+
+def describe_conflicts(conflicts, limit=3):
+    described = []
+    for occurrence in conflicts[:limit]:
+        end_format = '%H:%M' if occurrence.end_time.date() == occurrence.start_time.date() else '%d/%m %H:%M'
+        described.append(
+            f'"{occurrence.title}" ({occurrence.start_time:%d/%m %H:%M} - {occurrence.end_time.strftime(end_format)})'
+        )
+    more = len(conflicts) - limit
+    return 'Conflito de horário com ' + ', '.join(described) + (f' e mais {more}' if more > 0 else '') + '.'
+
+
+def free_slots(start_date, end_date, duration, pedagogue_id=None, student_id=None):
+    # Gaps of at least `duration` between the busy intervals, inside the
+    # working hours of each weekday from start_date to end_date.
+    day_start = datetime.time(Config.WORKDAY_START_HOUR)
+    day_end = datetime.time(Config.WORKDAY_END_HOUR)
+    busy = [
+        (occurrence.start_time, occurrence.end_time)
+        for occurrence in busy_occurrences(
+            datetime.datetime.combine(start_date, day_start), datetime.datetime.combine(end_date, day_end),
+            pedagogue_id, student_id
+        )
+    ]
+    slots = []
+    date = start_date
+    while date <= end_date:
+        if date.weekday() < 5:
+            cursor = datetime.datetime.combine(date, day_start)
+            closing = datetime.datetime.combine(date, day_end)
+            for busy_start, busy_end in busy:
+                if busy_end <= cursor:
+                    continue
+                if busy_start >= closing:
+                    break
+                if busy_start - cursor >= duration:
+                    slots.append((cursor, busy_start))
+                cursor = max(cursor, busy_end)
+            if closing - cursor >= duration:
+                slots.append((cursor, closing))
+        date += datetime.timedelta(days=1)
+    return slots
@@ -0,0 +1,232 @@
+import datetime
+import gzip
+import os
+import re
+import shutil
+import sqlite3
+import tempfile
+from contextlib import contextmanager
+
+from peewee import SqliteDatabase
+
+from app.models import db, ARCHIVE_SCHEMA, MODELS, User, Student
+from app.cache_utils import bump_model_version, invalidate_user, invalidate_student_choices
+from config import Config
+
+
+# Schema on the app's connection -> file name prefix of its copies. A backup
+# or snapshot is one file per schema, all named with the same stamp.
+SCHEMAS = (('main', 'clai'), (ARCHIVE_SCHEMA, 'clai_archive'))
+SNAPSHOT_SUFFIX = '.db.gz'
+BACKUP_NAME = re.compile(r'^(clai|clai_archive)-(\d{8}-\d{6})(\.db|\.db\.gz)$')
+REQUIRED_TABLES = {'main': (User._meta.table_name, Student._meta.table_name), ARCHIVE_SCHEMA: ()}
+
+
+def _stamp():
+    return datetime.datetime.now().strftime('%Y%m%d-%H%M%S')
+
+
+def _schema_path(schema):
+    return os.path.abspath(db.database if schema == 'main' else Config.ARCHIVE_DATABASE)
+
+
+class BackupRestarted(Exception):
+    pass
+
+
+def _copy(schema, path, pages=None):
+    # A full copy through SQLite's online backup API, made a few pages at a
+    # time: the source is only locked while a step runs, so the app keeps
+    # writing during the copy. A write from another connection restarts the
+    # copy from the first page; after BACKUP_MAX_RESTARTS restarts the copy
+    # is made with VACUUM INTO instead, one read transaction that writers
+    # wait for but that cannot be restarted. Must run outside a transaction.
+    copied = 0
+    restarts = 0
+
+    def progress(status, remaining, total):
+        nonlocal copied, restarts
+        if total - remaining < copied:
+            restarts += 1
+            if restarts > Config.BACKUP_MAX_RESTARTS:
+                raise BackupRestarted(schema)
+        copied = total - remaining
+
+    target = sqlite3.connect(path)
+    try:
+        db.connection().backup(target, pages=pages or Config.BACKUP_PAGES_PER_STEP, progress=progress, name=schema,
+                               sleep=Config.BACKUP_STEP_SLEEP)
+    except BackupRestarted:
+        target.close()
+        os.remove(path)
+        db.execute_sql(f'VACUUM "{schema}" INTO ?', (path,))
+    finally:
+        target.close()
+
+
+def verify_database(path, schema='main'):
+    conn = sqlite3.connect(f'file:{path}?mode=ro', uri=True)
+    try:
+        problems = [message for message, in conn.execute('PRAGMA integrity_check') if message != 'ok']
+        tables = {name for name, in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+        problems += [f'missing table {table}' for table in REQUIRED_TABLES[schema] if table not in tables]
+    except sqlite3.DatabaseError as e:
+        problems = [str(e)]
+    finally:
+        conn.close()
+    return problems
+
+
+def backup_database(directory=None, pages=None):
+    directory = directory or Config.BACKUP_DIR
+    os.makedirs(directory, exist_ok=True)
+    stamp = _stamp()
+    written = []
+    for schema, prefix in SCHEMAS:
+        path = os.path.join(directory, f'{prefix}-{stamp}.db')
+        _copy(schema, path, pages)
+        written.append(path)
+    return written
+
+
+def create_snapshot(directory=None, keep=None):
+    # A backup copy that passed the integrity check, gzipped. Only the
+    # newest `keep` snapshots are kept.
+    directory = directory or Config.BACKUP_DIR
+    os.makedirs(directory, exist_ok=True)
+    stamp = _stamp()
+    written = []
+    for schema, prefix in SCHEMAS:
+        path = os.path.join(directory, f'{prefix}-{stamp}{SNAPSHOT_SUFFIX}')
+        copy_path = os.path.join(directory, f'.{prefix}-{stamp}.db')
+        try:
+            _copy(schema, copy_path)
+            problems = verify_database(copy_path, schema)
+            if problems:
+                raise ValueError(f'Copy of {schema} failed verification: ' + '; '.join(problems[:5]))
+            with open(copy_path, 'rb') as source, gzip.open(path + '.tmp', 'wb') as target:
+                shutil.copyfileobj(source, target, 1 << 20)
+            os.replace(path + '.tmp', path)
+        finally:
+            for leftover in (copy_path, path + '.tmp'):
+                if os.path.exists(leftover):
+                    os.remove(leftover)
+        written.append(path)
+    prune_snapshots(directory, keep)
+    return written
+
+
+def prune_snapshots(directory=None, keep=None):
+    directory = directory or Config.BACKUP_DIR
+    keep = Config.SNAPSHOT_KEEP if keep is None else keep
+    stamps = {}
+    for name in os.listdir(directory):
+        match = BACKUP_NAME.match(name)
+        if match and match.group(3) == SNAPSHOT_SUFFIX:
+            stamps.setdefault(match.group(2), []).append(name)
+    removed = []
+    for stamp in sorted(stamps, reverse=True)[keep:]:
+        for name in stamps[stamp]:
+            os.remove(os.path.join(directory, name))
+            removed.append(name)
+    return removed
+
+
+def backup_files(path):
+    # All the files of the backup or snapshot `path` belongs to, by schema.
+    directory, name = os.path.split(os.path.abspath(path))
+    match = BACKUP_NAME.match(name)
+    if not match:
+        raise ValueError(f'{name} is not a backup or snapshot file.')
+    _, stamp, suffix = match.groups()
+    files = {}
+    for schema, prefix in SCHEMAS:
+        candidate = os.path.join(directory, f'{prefix}-{stamp}{suffix}')
+        if os.path.exists(candidate):
+            files[schema] = candidate
+    if 'main' not in files:
+        raise ValueError(f'The main database file of {stamp} was not found.')
+    return files
+
+
+def _unpack(files, work):
+    sources = {}
+    for schema, source in files.items():
+        if source.endswith(SNAPSHOT_SUFFIX):
+            plain = os.path.join(work, f'{schema}.db')
+            with gzip.open(source, 'rb') as compressed, open(plain, 'wb') as target:
+                shutil.copyfileobj(compressed, target, 1 << 20)
+            source = plain
+        sources[schema] = source
+    return sources
+
+
+def verify_backup(path):
+    # Problems found in each file of a backup or snapshot, by file.
+    files = backup_files(path)
+    with tempfile.TemporaryDirectory(dir=os.path.dirname(files['main'])) as work:
+        sources = _unpack(files, work)
+        return {files[schema]: verify_database(source, schema) for schema, source in sources.items()}
+
+
+def restore_backup(path):
+    # Every file is decompressed and checked before anything is written.
+    # The current database is backed up, then each file is copied over its
+    # live counterpart through the backup API, which takes the write lock:
+    # open connections see the restored data on their next read.
+    files = backup_files(path)
+    with tempfile.TemporaryDirectory(dir=os.path.dirname(_schema_path('main'))) as work:
+        sources = _unpack(files, work)
+        for schema, source in sources.items():
+            problems = verify_database(source, schema)
+            if problems:
+                raise ValueError(f'{os.path.basename(files[schema])} failed verification: ' + '; '.join(problems[:5]))
+
+        previous = backup_database()
+        for schema, source in sources.items():
+            source_conn = sqlite3.connect(source)
+            target = sqlite3.connect(_schema_path(schema))
+            try:
+                source_conn.backup(target)
+            finally:
+                target.close()
+                source_conn.close()
+
+    for schema in sources:
+        problems = [message for message, in db.execute_sql(f'PRAGMA "{schema}".quick_check') if message != 'ok']
+        if problems:
+            raise ValueError(f'Restored {schema} database failed verification: ' + '; '.join(problems[:5]))
+    for model in MODELS:
+        bump_model_version(model.__name__)
+    invalidate_user(None)
+    invalidate_student_choices()
+    return previous
+
+
+def refresh_reporting_snapshot():
+    # The copy read by reporting_database. Each file is replaced at once, so
+    # a reader that still has the previous copy open keeps a consistent view.
+    os.makedirs(Config.REPORTING_SNAPSHOT_DIR, exist_ok=True)
+    written = []
+    for schema, prefix in SCHEMAS:
+        path = os.path.join(Config.REPORTING_SNAPSHOT_DIR, f'{prefix}.db')
+        _copy(schema, path + '.tmp')
+        os.replace(path + '.tmp', path)
+        written.append(path)
+    return written
+
+
+@contextmanager
+def reporting_database():
+    # A read-only connection to the reporting snapshot for heavy report
+    # queries, so they never hold a lock on the live database. None (read
+    # the live database) when the snapshot mode is off or there is no
+    # snapshot yet.
+    paths = [os.path.join(Config.REPORTING_SNAPSHOT_DIR, f'{prefix}.db') for _, prefix in SCHEMAS]
+    if not Config.REPORTING_USE_SNAPSHOT or not all(os.path.exists(path) for path in paths):
+        yield None
+        return
+    database = SqliteDatabase(f'file:{paths[0]}?mode=ro', uri=True)
+    database.attach(f'file:{paths[1]}?mode=ro', ARCHIVE_SCHEMA)
+    with database.connection_context():
+        yield database
@@ -0,0 +1,149 @@
+import os
+import threading
+import time
+
+from flask import g, has_app_context
+
+from config import Config
+
+
+class TTLCache:
+    def __init__(self, ttl, maxsize=1024):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._data = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._data[key]
+                return None
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            if key not in self._data and len(self._data) >= self.maxsize:
+                # Dicts keep insertion order, so the first key is the oldest entry.
+                del self._data[next(iter(self._data))]
+            self._data[key] = (time.monotonic() + self.ttl, value)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+def read_stamp(path):
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (st.st_ino, st.st_mtime_ns)
+
+
+def touch_stamp(path):
+    # Replacing the file (instead of updating it in place) gives it a new
+    # inode, so two touches within the same mtime tick are still told apart.
+    tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}'
+    with open(tmp_path, 'w') as f:
+        f.write(str(time.time_ns()))
+    os.replace(tmp_path, path)
+
+
+class StampedTTLCache(TTLCache):
+    # Per-process cache whose invalidations are shared between worker
+    # processes: invalidating replaces a stamp file next to the database, and
+    # every process drops its entries on the next read once it sees a new stamp.
+    def __init__(self, ttl, stamp_path, maxsize=1024):
+        super().__init__(ttl, maxsize=maxsize)
+        self.stamp_path = stamp_path
+        self._stamp_seen = None
+
+    def get(self, key):
+        stamp = read_stamp(self.stamp_path)
+        if stamp != self._stamp_seen:
+            self.clear()
+            self._stamp_seen = stamp
+        return super().get(key)
+
+    def invalidate(self, key=None):
+        if key is None:
+            self.clear()
+        else:
+            self.delete(key)
+        try:
+            touch_stamp(self.stamp_path)
+        except OSError as e:
+            print(f"Error updating cache stamp {self.stamp_path}: {e}")
+            self.clear()
+
+
+_user_cache = StampedTTLCache(Config.USER_CACHE_TTL, Config.USER_CACHE_STAMP)
+_student_choices_cache = StampedTTLCache(Config.STUDENT_CHOICES_CACHE_TTL, Config.STUDENT_CACHE_STAMP)
+
+
+def get_cached_user_data(user_id):
+    return _user_cache.get(user_id)
+
+
+def cache_user_data(user_id, data):
+    _user_cache.set(user_id, dict(data))
+
+
+def invalidate_user(user_id):
+    _user_cache.invalidate(user_id)
+
+
+def get_cached_student_choices(scope):
+    return _student_choices_cache.get(scope)
+
+
+def cache_student_choices(scope, choices):
+    _student_choices_cache.set(scope, choices)
+
+
+def invalidate_student_choices():
+    _student_choices_cache.invalidate()
+    if has_app_context():
+        g.pop('scoped_student_ids', None)
+
+
+# Version counters for the models whose rows end up in cached fragments.
+# A model's version is the identity of its stamp file, so bumping it in one
+# worker is seen by all the others.
+def _model_stamp_path(model_name):
+    return os.path.join(Config.MODEL_VERSION_DIR, f'{model_name}.stamp')
+
+
+def model_versions(model_names):
+    return tuple(read_stamp(_model_stamp_path(name)) for name in model_names)
+
+
+def _touch_model_stamp(model_name):
+    try:
+        os.makedirs(Config.MODEL_VERSION_DIR, exist_ok=True)
+        touch_stamp(_model_stamp_path(model_name))
+    except OSError as e:
+        print(f"Error bumping version of {model_name}: {e}")
+
+
+def bump_model_version(model_name):
+    _touch_model_stamp(model_name)
+    # The write may still be inside an open transaction. Bump again when the
+    # request ends, so a fragment rendered from the old rows between the first
+    # bump and the commit cannot keep a live key.
+    if has_app_context():
+        g.setdefault('bumped_models', set()).add(model_name)
+
+
+def flush_model_versions():
+    for model_name in g.pop('bumped_models', ()):
+        _touch_model_stamp(model_name)
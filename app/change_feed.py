@@ -0,0 +1,39 @@
+import datetime
+
+from app.models import ChangeLog
+
+
+def parse_since(value):
+    # `since` is either the id of the last change the client has seen or an
+    # ISO timestamp. Returns (since_id, since_time), or None if invalid.
+    if not value:
+        return 0, None
+    if value.isdigit():
+        return int(value), None
+    try:
+        return 0, datetime.datetime.fromisoformat(value)
+    except ValueError:
+        return None
+
+
+def changes_since(user, since_id=0, since_time=None, limit=500):
+    query = (ChangeLog
+             .select(ChangeLog.id, ChangeLog.model, ChangeLog.row_id, ChangeLog.operation, ChangeLog.timestamp)
+             .where(ChangeLog.id > since_id))
+    if since_time is not None:
+        query = query.where(ChangeLog.timestamp > since_time)
+    if user.role != 'admin':
+        query = query.where(ChangeLog.owner == user.id)
+
+    rows = list(query.order_by(ChangeLog.id).limit(limit + 1).namedtuples())
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    changes = [{
+        'id': row.id,
+        'model': row.model,
+        'row_id': row.row_id,
+        'operation': row.operation,
+        'timestamp': row.timestamp.isoformat(),
+    } for row in rows]
+    next_since = rows[-1].id if rows else since_id
+    return changes, next_since, has_more
@@ -1,13 +1,24 @@
 from flask_wtf import FlaskForm
 from wtforms import (
-    StringField, PasswordField, SubmitField, BooleanField, SelectField,
-    TextAreaField, SelectMultipleField, DateField, DateTimeLocalField
+    Form, StringField, PasswordField, SubmitField, BooleanField, SelectField,
+    TextAreaField, SelectMultipleField, DateField, DateTimeLocalField, IntegerField, FieldList, FormField
 )
-from wtforms.validators import DataRequired, Length, Email, EqualTo, ValidationError, Regexp, Optional
-from flask_wtf.file import FileField, FileAllowed
+from wtforms.widgets import HiddenInput
+from wtforms.validators import DataRequired, Length, Email, EqualTo, ValidationError, Regexp, Optional, NumberRange
+from flask_wtf.file import FileField, FileAllowed, FileRequired
 from flask_login import current_user
-from app.models import User, Student
+from app.models import User, Student, SHIFTS
+from app.cache_utils import get_cached_student_choices, cache_student_choices
+from app.scoping import student_scope, scoped_students_query
+from app.archive import is_archived
 from config import Config
+import datetime
+import email_validator
+
+
+MATRICULA_PATTERN = r'^(2019|20[2-3][0-9])\d{8}$'
+ARCHIVED_ATTENDANCE_MESSAGE = 'A frequência desta data já foi arquivada e não pode ser alterada.'
+
 
 def validate_cpf_number(cpf_raw):
     cpf = ''.join(filter(str.isdigit, cpf_raw))
@@ -35,6 +46,57 @@ def validate_cpf_number(cpf_raw):
 
     return True
 
+
+def validate_email_address(email):
+    # Same check as the Email() validator of the forms.
+    try:
+        email_validator.validate_email(email, check_deliverability=False, allow_smtputf8=True, allow_empty_local=False)
+    except email_validator.EmailNotValidError:
+        return False
+    return True
+
+
+def get_student_choices(user):
+    scope = student_scope(user)
+    choices = get_cached_student_choices(scope)
+    if choices is None:
+        choices = list(
+            scoped_students_query(user, Student.id, Student.name).order_by(Student.name).tuples()
+        )
+        cache_student_choices(scope, choices)
+    return choices
+
+
+def event_interval_error(start_time, end_time):
+    if start_time is None or end_time is None:
+        return 'Data/hora inválida.'
+    if end_time <= start_time:
+        return 'O fim do evento deve ser posterior ao início.'
+    if end_time - start_time > datetime.timedelta(days=Config.EVENT_MAX_DURATION_DAYS):
+        return f'Um evento pode durar no máximo {Config.EVENT_MAX_DURATION_DAYS} dias.'
+    return None
+
+
+class StudentChoicesMixin:
+    # Rosters larger than STUDENT_TYPEAHEAD_THRESHOLD are not embedded in the
+    # page: only the selected student is rendered and the rest is searched
+    # through main.search_students.
+    def setup_student_choices(self, empty_choice=None):
+        choices = get_student_choices(current_user)
+        self.student_typeahead = len(choices) > Config.STUDENT_TYPEAHEAD_THRESHOLD
+        if self.student_typeahead:
+            self.student_id.validate_choice = False
+            choices = [choice for choice in choices if choice[0] == self.student_id.data]
+        self.student_id.choices = ([empty_choice] if empty_choice else []) + choices
+
+    def validate_student_id(self, field):
+        if not self.student_typeahead or not field.data:
+            return
+        in_scope = scoped_students_query(current_user, Student.id).where(Student.id == field.data).exists()
+        if not in_scope:
+            raise ValidationError('Aluno inválido.')
+
+
 class LoginForm(FlaskForm):
     login_id = StringField('Email ou CPF', validators=[
         DataRequired(message='Por favor, insira seu email ou CPF.')
@@ -56,7 +118,7 @@ class StudentForm(FlaskForm):
     
     matricula = StringField('Matrícula', validators=[
         DataRequired(), 
-        Regexp(r'^(2019|20[2-3][0-9])\d{8}$', message='Matrícula inválida. Deve ter 12 dígitos e iniciar com o ano.')
+        Regexp(MATRICULA_PATTERN, message='Matrícula inválida. Deve ter 12 dígitos e iniciar com o ano.')
     ], render_kw={"placeholder": "Ex: 202412345678"})
     
     dob = DateField('Data de Nascimento', format='%Y-%m-%d', validators=[DataRequired()], render_kw={"placeholder": "Use o seletor ou digite AAAA-MM-DD"})
@@ -89,6 +151,18 @@ class StudentForm(FlaskForm):
             raise ValidationError('CPF do Responsável inválido.')
 
 
+class StudentImportForm(FlaskForm):
+    csv_file = FileField('Arquivo CSV', validators=[
+        FileRequired(message='Selecione um arquivo.'),
+        FileAllowed(['csv'], 'Apenas arquivos CSV!')
+    ])
+    encoding = SelectField('Codificação', choices=[
+        ('utf-8-sig', 'UTF-8'), ('cp1252', 'Windows-1252 (Excel)')
+    ], default='utf-8-sig')
+    pedagogue_id = SelectField('Pedagogo dos alunos novos', coerce=int, default=0)
+    submit = SubmitField('Importar Alunos')
+
+
 class UserForm(FlaskForm):
     name = StringField('Nome Completo', validators=[DataRequired(), Length(min=2, max=100)], render_kw={"placeholder": "Nome completo do usuário"})
     
@@ -181,17 +255,25 @@ class AdminSetPasswordForm(FlaskForm):
 
 
 
+class AnnouncementForm(FlaskForm):
+    audience = SelectField('Destinatários', choices=[
+        ('all', 'Todos os profissionais'), ('pedagogue', 'Pedagogos(as)'), ('admin', 'Administradores(as)')
+    ], validators=[DataRequired()])
+    message = TextAreaField('Mensagem', validators=[DataRequired(), Length(max=1000)], render_kw={"placeholder": "Texto do aviso"})
+    link = StringField('Link (Opcional)', validators=[Optional(), Length(max=255)], render_kw={"placeholder": "/calendar"})
+    submit = SubmitField('Enviar Aviso')
+
+
 class ObservationForm(FlaskForm):
     observation_text = TextAreaField('Observação', validators=[DataRequired(), Length(min=10)], render_kw={"placeholder": "Descreva a observação com detalhes..."})
     justification = TextAreaField('Justificativa (para edições)', validators=[Optional(), Length(max=500)], render_kw={"placeholder": "Se estiver editando, justifique a alteração..."})
     submit = SubmitField('Salvar Observação')
 
 
-class DailyReportForm(FlaskForm):
-    student_id = SelectField('Aluno', coerce=int, validators=[DataRequired()])
+class BaseDailyReportForm(FlaskForm):
     date = DateField('Data', format='%Y-%m-%d', validators=[DataRequired()], render_kw={"placeholder": "Selecione a data"})
     professional_role = SelectField('Papel do Profissional', choices=[('Psicopedagoga', 'Psicopedagoga'), ('Audiodescritor', 'Audiodescritor'), ('Cuidador(a)', 'Cuidador(a)'), ('Coordenador(a)', 'Coordenador(a)')], validators=[DataRequired()])
-    shift = SelectMultipleField('Turno', choices=[('Manhã', 'Manhã'), ('Tarde', 'Tarde'), ('Integral', 'Integral'), ('Noite', 'Noite')], validators=[DataRequired()])
+    shift = SelectMultipleField('Turno', choices=[(shift, shift) for shift in SHIFTS], validators=[DataRequired()])
     activity_type = SelectField('Tipo de Atendimento', choices=[], validators=[DataRequired()])
     difficulties = TextAreaField('Dificuldades encontradas no dia', render_kw={"rows": 4, "placeholder": "Descreva as dificuldades observadas..."}, validators=[Optional(), Length(max=1000)])
     actions_taken = TextAreaField('Medidas tomadas', render_kw={"rows": 4, "placeholder": "Quais ações foram realizadas para auxiliar?"}, validators=[Optional(), Length(max=1000)])
@@ -200,12 +282,38 @@ class DailyReportForm(FlaskForm):
     submit = SubmitField('Salvar')
 
     def __init__(self, *args, **kwargs):
-        super(DailyReportForm, self).__init__(*args, **kwargs)
-        self.student_id.choices = [(s.id, s.name) for s in Student.select(Student.id, Student.name).order_by(Student.name)]
+        super(BaseDailyReportForm, self).__init__(*args, **kwargs)
         self.activity_type.choices = Config.DAILY_LOG_ACTIVITY_CHOICES
 
 
-class GeneralReportForm(FlaskForm):
+class DailyReportForm(StudentChoicesMixin, BaseDailyReportForm):
+    student_id = SelectField('Aluno', coerce=int, validators=[DataRequired()])
+
+    def __init__(self, *args, **kwargs):
+        super(DailyReportForm, self).__init__(*args, **kwargs)
+        self.setup_student_choices()
+
+
+class StudentReportOverrideForm(Form):
+    # Fields of one student's report in a group entry; empty ones take the
+    # shared value.
+    student_id = IntegerField(widget=HiddenInput())
+    difficulties = TextAreaField('Dificuldades encontradas no dia', render_kw={"rows": 2}, validators=[Optional(), Length(max=1000)])
+    actions_taken = TextAreaField('Medidas tomadas', render_kw={"rows": 2}, validators=[Optional(), Length(max=1000)])
+    observations = TextAreaField('Observações', render_kw={"rows": 2})
+
+
+class GroupDailyReportForm(BaseDailyReportForm):
+    student_ids = SelectMultipleField('Alunos', coerce=int, validators=[DataRequired(message='Selecione ao menos um aluno.')])
+    link_session = BooleanField('Registrar como uma única sessão em grupo', default=True)
+    overrides = FieldList(FormField(StudentReportOverrideForm))
+
+    def __init__(self, *args, **kwargs):
+        super(GroupDailyReportForm, self).__init__(*args, **kwargs)
+        self.student_ids.choices = get_student_choices(current_user)
+
+
+class GeneralReportForm(StudentChoicesMixin, FlaskForm):
     student_id = SelectField('Aluno', coerce=int, validators=[DataRequired()])
     date = DateField('Data', format='%Y-%m-%d', validators=[DataRequired()], render_kw={"placeholder": "Selecione a data"})
     location = StringField('Local', validators=[Optional(), Length(max=100)], render_kw={"placeholder": "Ex: Sala de aula, pátio, sala de recursos"})
@@ -222,23 +330,58 @@ class GeneralReportForm(FlaskForm):
 
     def __init__(self, *args, **kwargs):
         super(GeneralReportForm, self).__init__(*args, **kwargs)
-        self.student_id.choices = [(s.id, s.name) for s in Student.select(Student.id, Student.name).order_by(Student.name)]
+        self.setup_student_choices()
 
 
-class EventForm(FlaskForm):
+class EventForm(StudentChoicesMixin, FlaskForm):
     title = StringField('Título', validators=[DataRequired(), Length(min=5, max=100)], render_kw={"placeholder": "Ex: Reunião Pedagógica com a família"})
     description = TextAreaField('Descrição', validators=[Optional(), Length(max=500)], render_kw={"placeholder": "Detalhes sobre o evento (opcional)"})
     start_time = DateTimeLocalField('Início', format='%Y-%m-%dT%H:%M', validators=[DataRequired()], render_kw={"placeholder": "YYYY-MM-DDTHH:MM"})
     end_time = DateTimeLocalField('Fim', format='%Y-%m-%dT%H:%M', validators=[DataRequired()], render_kw={"placeholder": "YYYY-MM-DDTHH:MM"})
     student_id = SelectField('Aluno (opcional)', coerce=int, choices=[(0, 'Nenhum')], default=0)
+    recurrence = SelectField('Repetição', choices=[
+        ('', 'Não se repete'), ('daily', 'Diariamente'), ('weekly', 'Semanalmente'), ('monthly', 'Mensalmente')
+    ], default='')
+    recurrence_interval = IntegerField('Intervalo', validators=[Optional(), NumberRange(min=1, max=99)], default=1,
+                                       description='Ex: 2 com repetição semanal para a cada duas semanas.')
+    recurrence_weekdays = SelectMultipleField('Dias da semana', coerce=int, choices=[
+        (0, 'Segunda'), (1, 'Terça'), (2, 'Quarta'), (3, 'Quinta'), (4, 'Sexta'), (5, 'Sábado'), (6, 'Domingo')
+    ], validators=[Optional()])
+    recurrence_until = DateField('Repetir até (opcional)', format='%Y-%m-%d', validators=[Optional()])
+    allow_conflicts = BooleanField('Salvar mesmo com conflito de horário')
     submit = SubmitField('Salvar Evento')
 
     def __init__(self, *args, **kwargs):
         super(EventForm, self).__init__(*args, **kwargs)
-        self.student_id.choices = [(0, 'Nenhum')] + [(s.id, s.name) for s in Student.select(Student.id, Student.name).order_by(Student.name)]
+        self.setup_student_choices(empty_choice=(0, 'Nenhum'))
+
+    def validate_end_time(self, field):
+        if self.start_time.data and field.data:
+            error = event_interval_error(self.start_time.data, field.data)
+            if error:
+                raise ValidationError(error)
+
+    def validate_recurrence_until(self, field):
+        if field.data and self.start_time.data and field.data < self.start_time.data.date():
+            raise ValidationError('A repetição deve terminar depois do início do evento.')
 
 
-class AttendanceForm(FlaskForm):
+class OccurrenceForm(FlaskForm):
+    title = StringField('Título', validators=[DataRequired(), Length(min=5, max=100)])
+    description = TextAreaField('Descrição', validators=[Optional(), Length(max=500)])
+    start_time = DateTimeLocalField('Início', format='%Y-%m-%dT%H:%M', validators=[DataRequired()])
+    end_time = DateTimeLocalField('Fim', format='%Y-%m-%dT%H:%M', validators=[DataRequired()])
+    allow_conflicts = BooleanField('Salvar mesmo com conflito de horário')
+    submit = SubmitField('Salvar Ocorrência')
+
+    def validate_end_time(self, field):
+        if self.start_time.data and field.data:
+            error = event_interval_error(self.start_time.data, field.data)
+            if error:
+                raise ValidationError(error)
+
+
+class AttendanceForm(StudentChoicesMixin, FlaskForm):
     student_id = SelectField('Aluno', coerce=int, validators=[DataRequired()])
     date = DateField('Data', format='%Y-%m-%d', validators=[DataRequired()], render_kw={"placeholder": "Selecione a data"})
     status = SelectField('Status', choices=[('present', 'Presente'), ('absent', 'Ausente'), ('justified_absent', 'Justificado')], validators=[DataRequired()])
@@ -246,4 +389,8 @@ class AttendanceForm(FlaskForm):
 
     def __init__(self, *args, **kwargs):
         super(AttendanceForm, self).__init__(*args, **kwargs)
-        self.student_id.choices = [(s.id, s.name) for s in Student.select(Student.id, Student.name).order_by(Student.name)]
+        self.setup_student_choices()
+
+    def validate_date(self, field):
+        if is_archived(field.data):
+            raise ValidationError(ARCHIVED_ATTENDANCE_MESSAGE)
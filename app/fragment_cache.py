@@ -0,0 +1,153 @@
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from flask_login import current_user
+from jinja2 import nodes
+from jinja2.ext import Extension
+from markupsafe import Markup
+
+from app.cache_utils import model_versions
+
+
+class LRUCache:
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            if key not in self._data:
+                return None
+            self._data.move_to_end(key)
+            return self._data[key]
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+class SqliteFragmentStore:
+    # Optional second level shared by all worker processes. It lives in its own
+    # database file so cache traffic never contends with clai.db writers.
+    PURGE_EVERY = 500
+
+    def __init__(self, path, ttl):
+        self.path = path
+        self.ttl = ttl
+        self._local = threading.local()
+        self._writes = 0
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=1)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS fragments '
+                '(key TEXT PRIMARY KEY, value TEXT NOT NULL, created_at REAL NOT NULL)'
+            )
+            self._local.conn = conn
+        return conn
+
+    def get(self, key):
+        try:
+            row = self._connection().execute(
+                'SELECT value FROM fragments WHERE key = ? AND created_at > ?',
+                (key, time.time() - self.ttl)
+            ).fetchone()
+        except sqlite3.Error as e:
+            print(f"Error reading fragment cache: {e}")
+            return None
+        return json.loads(row[0]) if row else None
+
+    def set(self, key, value):
+        try:
+            conn = self._connection()
+            with conn:
+                conn.execute(
+                    'INSERT OR REPLACE INTO fragments (key, value, created_at) VALUES (?, ?, ?)',
+                    (key, json.dumps(value), time.time())
+                )
+                self._writes += 1
+                if self._writes % self.PURGE_EVERY == 0:
+                    conn.execute('DELETE FROM fragments WHERE created_at <= ?', (time.time() - self.ttl,))
+        except sqlite3.Error as e:
+            print(f"Error writing fragment cache: {e}")
+
+
+class FragmentCache:
+    def __init__(self, maxsize=512):
+        self.local = LRUCache(maxsize)
+        self.store = None
+
+    def configure(self, maxsize, store_path=None, ttl=None):
+        self.local = LRUCache(maxsize)
+        self.store = SqliteFragmentStore(store_path, ttl) if store_path else None
+
+    def get(self, key):
+        value = self.local.get(key)
+        if value is None and self.store is not None:
+            value = self.store.get(key)
+            if value is not None:
+                self.local.set(key, value)
+        return value
+
+    def set(self, key, value):
+        self.local.set(key, value)
+        if self.store is not None:
+            self.store.set(key, value)
+
+
+fragment_cache = FragmentCache()
+
+
+def cache_scope():
+    if not current_user or not current_user.is_authenticated:
+        return 'anonymous'
+    if current_user.role == 'admin':
+        return 'admin'
+    return f'{current_user.role}:{current_user.id}'
+
+
+def make_key(name, models, vary=()):
+    # Keys never need explicit invalidation: a write to any of the models
+    # changes its version and therefore every key that depends on it.
+    return json.dumps([name, cache_scope(), list(models), model_versions(models), list(vary)], default=str)
+
+
+def cached(name, models, vary, compute):
+    key = make_key(name, models, vary)
+    value = fragment_cache.get(key)
+    if value is None:
+        value = compute()
+        fragment_cache.set(key, value)
+    return value
+
+
+class FragmentCacheExtension(Extension):
+    # {% cache 'name', ['Model', ...], vary1, vary2 %} ... {% endcache %}
+    tags = {'cache'}
+
+    def parse(self, parser):
+        lineno = next(parser.stream).lineno
+        args = [parser.parse_expression()]
+        while parser.stream.skip_if('comma'):
+            args.append(parser.parse_expression())
+        body = parser.parse_statements(['name:endcache'], drop_needle=True)
+        call = self.call_method('_render_cached', [nodes.List(args)])
+        return nodes.CallBlock(call, [], [], body).set_lineno(lineno)
+
+    def _render_cached(self, args, caller):
+        name, models, *vary = args
+        return Markup(cached(f'fragment:{name}', models, vary, lambda: str(caller())))
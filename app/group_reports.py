@@ -0,0 +1,47 @@
+import datetime
+
+from app.models import db, Student, DailyReport, GroupSession
+from app.cache_utils import bump_model_version
+
+
+OVERRIDABLE_FIELDS = ('difficulties', 'actions_taken', 'observations')
+
+
+def create_group_reports(pedagogue, student_ids, shared, overrides=None, link_session=True):
+    # One DailyReport per student, all written by a single INSERT in one
+    # transaction. `shared` holds the values common to the group and
+    # overrides[student_id] the fields filled in for just that student.
+    now = datetime.datetime.now()
+    overrides = overrides or {}
+    student_ids = list(dict.fromkeys(student_ids))
+    with db.atomic():
+        session = None
+        if link_session:
+            session = GroupSession.create(pedagogue=pedagogue, date=shared['date'],
+                                          activity_type=shared['activity_type'])
+        rows = [
+            dict(shared, **overrides.get(student_id, {}),
+                 student=student_id, pedagogue=pedagogue.id, session=session and session.id,
+                 created_at=now, updated_at=now)
+            for student_id in student_ids
+        ]
+        report_ids = [
+            report_id for report_id, in DailyReport.insert_many(rows).returning(DailyReport.id).tuples().execute()
+        ]
+        DailyReport.log_changes([(report_id, 'insert', pedagogue.id) for report_id in report_ids], now)
+    bump_model_version('DailyReport')
+    return session, report_ids
+
+
+def session_reports(model, report):
+    # The other reports of the report's group session, for its detail page.
+    # The archive keeps the session as a plain id.
+    session_id = report.session_id if model is DailyReport else report.session
+    if not session_id:
+        return []
+    return list(model
+                .select(model.id, model.student.alias('student_id'), Student.name.alias('student_name'))
+                .join(Student, on=(model.student == Student.id))
+                .where((model.session == session_id) & (model.id != report.id))
+                .order_by(Student.name)
+                .namedtuples())
@@ -0,0 +1,96 @@
+import hashlib
+import json
+import os
+from functools import wraps
+
+from flask import current_app, make_response, request, session
+from flask_login import current_user
+
+from app.cache_utils import model_versions
+
+
+_build_id = None
+
+
+def build_id():
+    # Rendered pages change with the templates and the code, so the newest
+    # modification time under the app package is part of every validator.
+    global _build_id
+    if _build_id is None:
+        latest = 0
+        for root, _, files in os.walk(current_app.root_path):
+            for name in files:
+                latest = max(latest, os.stat(os.path.join(root, name)).st_mtime_ns)
+        _build_id = latest
+    return _build_id
+
+
+def user_scope():
+    if not current_user.is_authenticated:
+        return None
+    return [current_user.id, current_user.role, current_user.name, current_user.profile_picture]
+
+
+def make_etag(parts):
+    payload = json.dumps([build_id(), user_scope(), parts], default=str, separators=(',', ':'))
+    return hashlib.sha1(payload.encode('utf-8')).hexdigest()
+
+
+def list_validators(*model_names):
+    return {'parts': [request.full_path, model_versions(model_names)]}
+
+
+def row_validators(model, row_id, *model_names):
+    row = model.select(model.updated_at).where(model.id == row_id).tuples().first()
+    if row is None:
+        return None
+    updated_at = row[0]
+    return {
+        'parts': [model.__name__, row_id, updated_at, request.full_path, model_versions(model_names)],
+        'last_modified': updated_at,
+    }
+
+
+def _not_modified(etag, last_modified):
+    if request.if_none_match:
+        return request.if_none_match.contains(etag)
+    if last_modified is not None and request.if_modified_since is not None:
+        return last_modified <= request.if_modified_since
+    return False
+
+
+def conditional_get(validators):
+    # validators(**view_args) returns {'parts': [...], 'last_modified': dt}
+    # built from cheap queries, or None to render without validators. When
+    # the client already holds the current version the view is not run.
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            # Pending flash messages are rendered into the page, so it cannot
+            # be answered from the client's copy.
+            if request.method != 'GET' or session.get('_flashes'):
+                return f(*args, **kwargs)
+            result = validators(**kwargs)
+            if result is None:
+                return f(*args, **kwargs)
+
+            etag = make_etag(result['parts'])
+            last_modified = result.get('last_modified')
+            if last_modified is not None:
+                last_modified = last_modified.replace(microsecond=0).astimezone()
+
+            if _not_modified(etag, last_modified):
+                response = current_app.response_class(status=304)
+            else:
+                response = make_response(f(*args, **kwargs))
+                if response.status_code != 200 or session.modified:
+                    return response
+
+            response.set_etag(etag)
+            if last_modified is not None:
+                response.last_modified = last_modified
+            response.cache_control.private = True
+            response.cache_control.no_cache = True
+            return response
+        return decorated_function
+    return decorator
@@ -0,0 +1,108 @@
+import time
+
+from peewee import OperationalError
+
+from app.models import db, ARCHIVE_SCHEMA
+from config import Config
+
+
+SCHEMAS = ('main', ARCHIVE_SCHEMA)
+AUTO_VACUUM_MODES = {0: 'none', 1: 'full', 2: 'incremental'}
+
+
+def _pragma(schema, name):
+    return db.execute_sql(f'PRAGMA "{schema}".{name}').fetchone()[0]
+
+
+def _object_sizes(schema):
+    # Pages and unused bytes of every table and index, from the dbstat
+    # virtual table; None when SQLite was built without it.
+    try:
+        rows = db.execute_sql(
+            f'SELECT s.name, m.type, m.tbl_name, s.pageno, s.pgsize, s.unused '
+            f'FROM dbstat(?, 1) AS s LEFT JOIN "{schema}".sqlite_master AS m ON m.name = s.name '
+            f'ORDER BY s.pgsize DESC, s.name',
+            (schema,)
+        ).fetchall()
+    except OperationalError:
+        return None
+    return [{
+        'name': name,
+        'type': object_type or 'table',
+        'table': table or name,
+        'pages': pages,
+        'size': size,
+        'unused_ratio': round(unused / size, 4) if size else 0.0,
+    } for name, object_type, table, pages, size, unused in rows]
+
+
+def database_report():
+    report = []
+    for schema in SCHEMAS:
+        page_size = _pragma(schema, 'page_size')
+        pages = _pragma(schema, 'page_count')
+        free_pages = _pragma(schema, 'freelist_count')
+        report.append({
+            'schema': schema,
+            'auto_vacuum': AUTO_VACUUM_MODES.get(_pragma(schema, 'auto_vacuum')),
+            'page_size': page_size,
+            'pages': pages,
+            'size': pages * page_size,
+            'free_pages': free_pages,
+            'free_ratio': round(free_pages / pages, 4) if pages else 0.0,
+            'objects': _object_sizes(schema),
+        })
+    return report
+
+
+def _incremental_vacuum(schema, max_pages=None):
+    # A few pages per transaction, so the write lock is only held for a
+    # moment at a time.
+    freed = 0
+    while max_pages is None or freed < max_pages:
+        free_pages = _pragma(schema, 'freelist_count')
+        step = min(free_pages, Config.MAINTENANCE_VACUUM_STEP,
+                   free_pages if max_pages is None else max_pages - freed)
+        if step <= 0:
+            break
+        # The pragma frees one page per step of its statement, and the
+        # sqlite3 module only steps a statement that returns no rows once;
+        # executescript runs it to the end.
+        db.connection().executescript(f'PRAGMA "{schema}".incremental_vacuum({step})')
+        step_freed = free_pages - _pragma(schema, 'freelist_count')
+        if step_freed <= 0:
+            break
+        freed += step_freed
+        time.sleep(Config.MAINTENANCE_STEP_SLEEP)
+    return freed
+
+
+def run_maintenance(vacuum_pages=None):
+    # ANALYZE reads at most analysis_limit rows per index, so refreshing the
+    # planner statistics stays quick on large tables; PRAGMA optimize then
+    # runs whatever else SQLite considers due. Free pages are returned to
+    # the file system only where auto_vacuum is incremental (see
+    # enable_incremental_vacuum).
+    results = {}
+    db.execute_sql(f'PRAGMA analysis_limit = {Config.MAINTENANCE_ANALYSIS_LIMIT}')
+    for schema in SCHEMAS:
+        db.execute_sql(f'ANALYZE "{schema}"')
+        db.execute_sql(f'PRAGMA "{schema}".optimize')
+        freed = 0
+        if _pragma(schema, 'auto_vacuum') == 2:
+            freed = _incremental_vacuum(schema, vacuum_pages)
+        results[schema] = {'freed_pages': freed, 'free_pages': _pragma(schema, 'freelist_count')}
+    return results
+
+
+def enable_incremental_vacuum():
+    # Switching an existing database takes a full VACUUM, which rewrites the
+    # whole file and locks it until done. New databases are created with it
+    # (see models.create_tables).
+    converted = []
+    for schema in SCHEMAS:
+        if _pragma(schema, 'auto_vacuum') != 2:
+            db.execute_sql(f'PRAGMA "{schema}".auto_vacuum = INCREMENTAL')
+            db.execute_sql(f'VACUUM "{schema}"')
+            converted.append(schema)
+    return converted
@@ -1,14 +1,218 @@
-from peewee import Model, CharField, DateField, ForeignKeyField, TextField, DateTimeField, SqliteDatabase, BooleanField
+from peewee import (
+    Model, CharField, DateField, ForeignKeyField, TextField, DateTimeField, BooleanField,
+    IntegerField, BlobField, DeferredForeignKey, Entity
+)
+from playhouse.migrate import SqliteMigrator, migrate
 from flask_login import UserMixin
+from app.cache_utils import invalidate_user, invalidate_student_choices, bump_model_version
+from app.query_log import SlowQueryDatabase
+from config import Config
 import datetime
+import zlib
 
 
-db = SqliteDatabase('clai.db')
+db = SlowQueryDatabase('clai.db')
+# Records from past school years are moved to a separate database file
+# (see app.archive), attached to every connection under this schema name.
+ARCHIVE_SCHEMA = 'archive'
+db.attach(Config.ARCHIVE_DATABASE, ARCHIVE_SCHEMA)
 
 class BaseModel(Model):
     class Meta:
         database = db
 
+# Attendance statuses and report shifts are stored as small integers:
+# statuses as a code, shifts as a bitmask (a report can cover several).
+ATTENDANCE_STATUSES = {'present': 1, 'absent': 2, 'justified_absent': 3}
+SHIFTS = ('Manhã', 'Tarde', 'Integral', 'Noite')
+SHIFT_BITS = {shift: 1 << index for index, shift in enumerate(SHIFTS)}
+
+class CodeField(IntegerField):
+    # One key of a fixed set, stored as its integer code. Code, queries and
+    # templates keep using the keys.
+    def __init__(self, codes, *args, **kwargs):
+        self.codes = codes
+        self.keys = {code: key for key, code in codes.items()}
+        super().__init__(*args, **kwargs)
+
+    def db_value(self, value):
+        if value is None or isinstance(value, int):
+            return value
+        if value not in self.codes:
+            raise ValueError(f'Unknown value for {self.name}: {value!r}')
+        return self.codes[value]
+
+    def python_value(self, value):
+        if value is None:
+            return None
+        return self.keys.get(int(value))
+
+class ShiftField(IntegerField):
+    # Bitmask of SHIFTS. Read as the shifts joined by ', ' ("Manhã, Tarde"),
+    # written from that string or a list of shifts.
+    def db_value(self, value):
+        if value is None or isinstance(value, int):
+            return value
+        if isinstance(value, str):
+            value = value.split(',')
+        bits = 0
+        for shift in value:
+            shift = shift.strip()
+            if shift not in SHIFT_BITS:
+                raise ValueError(f'Unknown shift: {shift!r}')
+            bits |= SHIFT_BITS[shift]
+        return bits
+
+    def python_value(self, value):
+        if value is None:
+            return None
+        return ', '.join(shift for shift in SHIFTS if int(value) & SHIFT_BITS[shift])
+
+    def includes(self, shift):
+        return self.bin_and(SHIFT_BITS[shift]) != 0
+
+class ActivityType(BaseModel):
+    # Lookup table of the daily report activities, kept in step with
+    # Config.DAILY_LOG_ACTIVITY_CHOICES by create_tables. Ids never change,
+    # so keys dropped from the config still resolve for old reports.
+    key = CharField(unique=True)
+    label = CharField(null=True)
+
+    _codes = {}
+    _keys = {}
+    _labels = {}
+
+    @classmethod
+    def load(cls):
+        rows = list(cls.select(cls.id, cls.key, cls.label).tuples())
+        cls._codes = {key: code for code, key, _ in rows}
+        cls._keys = {code: key for code, key, _ in rows}
+        cls._labels = {key: label for _, key, label in rows if label}
+
+    @classmethod
+    def code(cls, key):
+        if key not in cls._codes:
+            cls.load()
+        if key not in cls._codes:
+            raise ValueError(f'Unknown activity type: {key!r}')
+        return cls._codes[key]
+
+    @classmethod
+    def key_for(cls, code):
+        if code not in cls._keys:
+            cls.load()
+        return cls._keys.get(code)
+
+    @classmethod
+    def labels(cls):
+        if not cls._labels:
+            cls.load()
+        return cls._labels
+
+    @classmethod
+    def sync(cls, choices):
+        for key, label in choices:
+            (cls.insert(key=key, label=label)
+             .on_conflict(conflict_target=[cls.key], update={cls.label: label})
+             .execute())
+        cls.load()
+
+    class Meta:
+        table_name = 'activity_types'
+
+class ActivityTypeField(IntegerField):
+    # Id of an ActivityType; code, queries and templates keep using the key.
+    def db_value(self, value):
+        if value is None or isinstance(value, int):
+            return value
+        return ActivityType.code(value)
+
+    def python_value(self, value):
+        if value is None:
+            return None
+        return ActivityType.key_for(int(value))
+
+class ChangeLog(BaseModel):
+    # Append-only record of every write to a versioned model. The id is the
+    # position in the feed; owner is the pedagogue whose scope the row was in.
+    model = CharField()
+    row_id = IntegerField()
+    operation = CharField()
+    owner = IntegerField(null=True)
+    timestamp = DateTimeField(default=datetime.datetime.now)
+
+    class Meta:
+        table_name = 'change_log'
+        indexes = (
+            (('timestamp',), False),
+            (('owner', 'id'), False),
+        )
+
+class VersionedModel(BaseModel):
+    # Every write bumps the model's version, which is part of the key of any
+    # cached fragment rendered from it (see app.fragment_cache), stamps the
+    # row's timestamps and appends an entry to the change log.
+    created_at = DateTimeField(null=True)
+    updated_at = DateTimeField(null=True)
+
+    # Fields that decide change_owner_id. When one of them is changed the
+    # previous owner is told as well, so the row leaves their replica.
+    owner_fields = ('pedagogue',)
+
+    def change_owner_id(self):
+        return self.pedagogue_id
+
+    def log_change(self, operation, timestamp, owner=None):
+        ChangeLog.create(
+            model=type(self).__name__,
+            row_id=self.id,
+            operation=operation,
+            owner=self.change_owner_id() if owner is None else owner,
+            timestamp=timestamp
+        )
+
+    @classmethod
+    def log_changes(cls, changes, timestamp):
+        # Change log entries for rows written in bulk, which skip save():
+        # one (row_id, operation, owner) tuple per entry.
+        rows = [
+            {'model': cls.__name__, 'row_id': row_id, 'operation': operation, 'owner': owner, 'timestamp': timestamp}
+            for row_id, operation, owner in changes
+        ]
+        if rows:
+            ChangeLog.insert_many(rows).execute()
+
+    def save(self, *args, **kwargs):
+        now = datetime.datetime.now()
+        operation = 'insert' if self._pk is None or kwargs.get('force_insert') else 'update'
+        if operation == 'insert' and self.created_at is None:
+            self.created_at = now
+        self.updated_at = now
+        with db.atomic():
+            previous_owner = None
+            if operation == 'update' and any(name in self._dirty for name in self.owner_fields):
+                model = type(self)
+                previous = (model
+                            .select(*[getattr(model, name) for name in self.owner_fields])
+                            .where(model.id == self.id)
+                            .first())
+                previous_owner = previous.change_owner_id() if previous else None
+            result = super().save(*args, **kwargs)
+            if result:
+                self.log_change(operation, now)
+                if previous_owner is not None and previous_owner != self.change_owner_id():
+                    self.log_change(operation, now, owner=previous_owner)
+        bump_model_version(type(self).__name__)
+        return result
+
+    def delete_instance(self, *args, **kwargs):
+        with db.atomic():
+            result = super().delete_instance(*args, **kwargs)
+            if result:
+                self.log_change('delete', datetime.datetime.now())
+        bump_model_version(type(self).__name__)
+        return result
+
 class User(UserMixin, BaseModel):
     username = CharField(unique=True)
     email = CharField(unique=True)
@@ -20,10 +224,25 @@ class User(UserMixin, BaseModel):
     def get_id(self):
         return str(self.id)
 
+    def save(self, *args, **kwargs):
+        result = super().save(*args, **kwargs)
+        invalidate_user(self.id)
+        bump_model_version('User')
+        return result
+
+    def delete_instance(self, *args, **kwargs):
+        result = super().delete_instance(*args, **kwargs)
+        invalidate_user(self.id)
+        bump_model_version('User')
+        return result
+
     class Meta:
         table_name = 'users'
+        indexes = (
+            (('name',), False),
+        )
 
-class Student(BaseModel):
+class Student(VersionedModel):
     name = CharField()
     matricula = CharField(unique=True)
     dob = DateField()
@@ -40,44 +259,252 @@ class Student(BaseModel):
     student_picture = CharField(default='default_student.png')
     specific_needs_description = TextField(null=True)
 
+    def save(self, *args, **kwargs):
+        result = super().save(*args, **kwargs)
+        invalidate_student_choices()
+        return result
+
+    def delete_instance(self, *args, **kwargs):
+        result = super().delete_instance(*args, **kwargs)
+        invalidate_student_choices()
+        return result
+
     class Meta:
         table_name = 'students'
+        # Student lists are ordered by name, for everyone or per pedagogue,
+        # and the attendance sheet per grade.
+        indexes = (
+            (('name',), False),
+            (('pedagogue', 'name'), False),
+            (('grade', 'name'), False),
+            (('course',), False),
+        )
+
+def student_owner_id(student_id):
+    return Student.select(Student.pedagogue).where(Student.id == student_id).scalar()
 
-class Observation(BaseModel):
+class Observation(VersionedModel):
     student = ForeignKeyField(Student, backref='observations')
     pedagogue = ForeignKeyField(User, backref='made_observations')
     date = DateField(default=datetime.date.today)
     observation_text = TextField()
     justification = TextField(null=True)
 
+    owner_fields = ('student',)
+
+    def change_owner_id(self):
+        return student_owner_id(self.student_id)
+
     class Meta:
         table_name = 'observations'
+        indexes = (
+            (('student', 'date'), False),
+        )
 
-class Attendance(BaseModel):
+class Attendance(VersionedModel):
     student = ForeignKeyField(Student, backref='attendance_records')
     date = DateField(default=datetime.date.today)
-    status = CharField(default='present')
+    status = CodeField(ATTENDANCE_STATUSES, default='present')
+
+    owner_fields = ('student',)
+
+    def change_owner_id(self):
+        return student_owner_id(self.student_id)
+
+    def save(self, *args, **kwargs):
+        with db.atomic():
+            previous = None
+            if self.id is not None and not kwargs.get('force_insert'):
+                previous = (
+                    Attendance.select(Attendance.student, Attendance.date, Attendance.status)
+                    .where(Attendance.id == self.id)
+                    .tuples()
+                    .first()
+                )
+            result = super().save(*args, **kwargs)
+            if previous:
+                AttendanceSummary.apply(*previous, -1)
+                AttendanceBitmap.refresh_day(*previous[:2])
+            AttendanceSummary.apply(self.student_id, self.date, self.status, 1)
+            AttendanceBitmap.refresh_day(self.student_id, self.date)
+        return result
+
+    def delete_instance(self, *args, **kwargs):
+        with db.atomic():
+            result = super().delete_instance(*args, **kwargs)
+            AttendanceSummary.apply(self.student_id, self.date, self.status, -1)
+            AttendanceBitmap.refresh_day(self.student_id, self.date)
+        return result
 
     class Meta:
         table_name = 'attendance'
+        indexes = (
+            (('student', 'date'), False),
+            # The date list of a pedagogue walks this index and checks the
+            # student without reading the row.
+            (('date', 'student'), False),
+        )
 
-class Event(BaseModel):
+class AttendanceSummary(BaseModel):
+    # Per-student attendance counts for each week (starting on Monday) and
+    # each month, kept in step with the attendance table by Attendance.save
+    # and Attendance.delete_instance.
+    STATUS_COLUMNS = {
+        'present': 'present',
+        'absent': 'absent',
+        'justified_absent': 'justified_absent',
+    }
+
+    student = ForeignKeyField(Student, backref='attendance_summaries')
+    period_type = CharField()
+    period_start = DateField()
+    present = IntegerField(default=0)
+    absent = IntegerField(default=0)
+    justified_absent = IntegerField(default=0)
+
+    @staticmethod
+    def period_starts(date):
+        if isinstance(date, datetime.datetime):
+            date = date.date()
+        elif isinstance(date, str):
+            date = datetime.date.fromisoformat(date)
+        return {
+            'week': date - datetime.timedelta(days=date.weekday()),
+            'month': date.replace(day=1),
+        }
+
+    @classmethod
+    def apply(cls, student_id, date, status, delta):
+        column = cls.STATUS_COLUMNS.get(status)
+        if column is None or student_id is None or date is None:
+            return
+        field = getattr(cls, column)
+        for period_type, period_start in cls.period_starts(date).items():
+            (cls
+             .insert(student=student_id, period_type=period_type, period_start=period_start,
+                     **{column: max(delta, 0)})
+             .on_conflict(
+                 conflict_target=[cls.student, cls.period_type, cls.period_start],
+                 update={field: field + delta})
+             .execute())
+
+    class Meta:
+        table_name = 'attendance_summary'
+        indexes = (
+            (('student', 'period_type', 'period_start'), True),
+            (('period_type', 'period_start'), False),
+        )
+
+class AttendanceBitmap(BaseModel):
+    # A student's attendance over one school year, two bits per day counted
+    # from the first day of the school year: 0 for no record, otherwise the
+    # ATTENDANCE_STATUSES code. Kept in step with the attendance table by
+    # Attendance.save and Attendance.delete_instance.
+    DAYS = 368
+    SIZE = DAYS // 4
+
+    student = ForeignKeyField(Student, backref='attendance_bitmaps')
+    school_year = IntegerField()
+    days = BlobField()
+
+    @staticmethod
+    def locate(date):
+        # (school year, day index) of a date; the school year is named after
+        # the calendar year it starts in.
+        if isinstance(date, datetime.datetime):
+            date = date.date()
+        elif isinstance(date, str):
+            date = datetime.date.fromisoformat(date)
+        start_month = Config.SCHOOL_YEAR_START_MONTH
+        school_year = date.year if date.month >= start_month else date.year - 1
+        return school_year, (date - datetime.date(school_year, start_month, 1)).days
+
+    @classmethod
+    def refresh_day(cls, student_id, date):
+        # Several records may exist for a day; the latest one is shown.
+        if student_id is None or date is None:
+            return
+        status = (Attendance
+                  .select(Attendance.status)
+                  .where((Attendance.student == student_id) & (Attendance.date == date))
+                  .order_by(Attendance.id.desc())
+                  .scalar())
+        school_year, index = cls.locate(date)
+        condition = (cls.student == student_id) & (cls.school_year == school_year)
+        cls.insert(student=student_id, school_year=school_year, days=bytes(cls.SIZE)).on_conflict_ignore().execute()
+        days = bytearray(cls.select(cls.days).where(condition).scalar())
+        byte, slot = divmod(index, 4)
+        code = ATTENDANCE_STATUSES[status] if status else 0
+        days[byte] = days[byte] & ~(3 << slot * 2) | code << slot * 2
+        cls.update(days=bytes(days)).where(condition).execute()
+
+    class Meta:
+        table_name = 'attendance_bitmaps'
+        indexes = (
+            (('student', 'school_year'), True),
+            (('school_year',), False),
+        )
+
+class Event(VersionedModel):
     title = CharField()
     description = TextField(null=True)
     start_time = DateTimeField()
     end_time = DateTimeField()
     student = ForeignKeyField(Student, backref='events', null=True)
     pedagogue = ForeignKeyField(User, backref='events', null=True)
+    # A recurring event is stored once and expanded into its occurrences
+    # when read (see app.recurrence). start_time/end_time are the first one.
+    recurrence = CharField(null=True)
+    recurrence_interval = IntegerField(null=True)
+    recurrence_weekdays = CharField(null=True)
+    recurrence_until = DateField(null=True)
 
     class Meta:
         table_name = 'events'
+        indexes = (
+            (('student', 'start_time', 'end_time'), False),
+            (('pedagogue', 'start_time', 'end_time'), False),
+            (('start_time',), False),
+        )
+
+# Series only, so looking up the series active in a window reads neither
+# single events nor the whole history (see recurrence.active_series).
+Event.add_index(Event.index(Event.recurrence_until, Event.start_time, where=Event.recurrence.is_null(False)))
 
-class DailyReport(BaseModel):
+class EventException(BaseModel):
+    # One occurrence of a recurring event, cancelled or moved/edited.
+    event = ForeignKeyField(Event, backref='exceptions', on_delete='CASCADE')
+    original_start = DateTimeField()
+    cancelled = BooleanField(default=False)
+    title = CharField(null=True)
+    description = TextField(null=True)
+    start_time = DateTimeField(null=True)
+    end_time = DateTimeField(null=True)
+
+    class Meta:
+        table_name = 'event_exceptions'
+        indexes = (
+            (('event', 'original_start'), True),
+        )
+
+class GroupSession(BaseModel):
+    # One activity run with several students at once; each of them gets
+    # their own DailyReport, linked to the session.
+    pedagogue = ForeignKeyField(User, backref='group_sessions')
+    date = DateField()
+    activity_type = ActivityTypeField()
+    created_at = DateTimeField(default=datetime.datetime.now)
+
+    class Meta:
+        table_name = 'group_sessions'
+
+class DailyReport(VersionedModel):
     student = ForeignKeyField(Student, backref='daily_reports')
     pedagogue = ForeignKeyField(User, backref='daily_reports')
+    session = ForeignKeyField(GroupSession, backref='daily_reports', null=True, on_delete='SET NULL')
     date = DateField(default=datetime.date.today)
-    shift = CharField()
-    activity_type = CharField()
+    shift = ShiftField()
+    activity_type = ActivityTypeField()
     difficulties = TextField(null=True)
     actions_taken = TextField(null=True)
     participants = TextField(null=True)
@@ -86,8 +513,14 @@ class DailyReport(BaseModel):
 
     class Meta:
         table_name = 'daily_reports'
+        indexes = (
+            (('student', 'date'), False),
+            (('activity_type', 'date'), False),
+            (('pedagogue', 'date'), False),
+            (('date',), False),
+        )
 
-class GeneralReport(BaseModel):
+class GeneralReport(VersionedModel):
     student = ForeignKeyField(Student, backref='general_reports')
     pedagogue = ForeignKeyField(User, backref='general_reports')
     date = DateField(default=datetime.date.today)
@@ -104,6 +537,11 @@ class GeneralReport(BaseModel):
 
     class Meta:
         table_name = 'general_reports'
+        indexes = (
+            (('student', 'date'), False),
+            (('pedagogue', 'date'), False),
+            (('date',), False),
+        )
 
 class Notification(BaseModel):
     recipient = ForeignKeyField(User, backref='notifications')
@@ -114,9 +552,231 @@ class Notification(BaseModel):
 
     class Meta:
         table_name = 'notifications'
+        indexes = (
+            (('recipient', 'timestamp'), False),
+        )
+
+
+class SchedulerState(BaseModel):
+    # Progress of each scheduler job, so a job that runs twice (or in two
+    # processes) never repeats work.
+    job = CharField(primary_key=True)
+    last_run_at = DateTimeField(null=True)
+    covered_until = DateTimeField(null=True)
+    last_change_id = IntegerField(null=True)
+
+    class Meta:
+        table_name = 'scheduler_state'
+
+class CompressedTextField(BlobField):
+    def db_value(self, value):
+        if value is None:
+            return None
+        return zlib.compress(value.encode('utf-8'))
+
+    def python_value(self, value):
+        if value is None:
+            return None
+        return zlib.decompress(value).decode('utf-8')
+
+class ArchiveModel(BaseModel):
+    # Archived rows keep their ids. Their foreign keys have no constraints,
+    # since the referenced tables live in the main database.
+    archived_at = DateTimeField(default=datetime.datetime.now)
+
+    class Meta:
+        schema = ARCHIVE_SCHEMA
+
+class ArchivedObservation(ArchiveModel):
+    student = DeferredForeignKey('Student', backref='+', index=False)
+    pedagogue = DeferredForeignKey('User', backref='+')
+    date = DateField()
+    observation_text = CompressedTextField()
+    justification = CompressedTextField(null=True)
+    created_at = DateTimeField(null=True)
+    updated_at = DateTimeField(null=True)
+
+    class Meta:
+        table_name = 'observations'
+        indexes = (
+            (('student', 'date'), False),
+        )
+
+class ArchivedAttendance(ArchiveModel):
+    student = DeferredForeignKey('Student', backref='+', index=False)
+    date = DateField()
+    status = CodeField(ATTENDANCE_STATUSES)
+    created_at = DateTimeField(null=True)
+    updated_at = DateTimeField(null=True)
+
+    class Meta:
+        table_name = 'attendance'
+        indexes = (
+            (('student', 'date'), False),
+        )
+
+class ArchivedDailyReport(ArchiveModel):
+    student = DeferredForeignKey('Student', backref='+', index=False)
+    pedagogue = DeferredForeignKey('User', backref='+', index=False)
+    date = DateField()
+    shift = ShiftField()
+    activity_type = ActivityTypeField()
+    difficulties = CompressedTextField(null=True)
+    actions_taken = CompressedTextField(null=True)
+    participants = CompressedTextField(null=True)
+    observations = CompressedTextField(null=True)
+    professional_role = CharField(null=True)
+    session = IntegerField(null=True, column_name='session_id')
+    created_at = DateTimeField(null=True)
+    updated_at = DateTimeField(null=True)
+
+    class Meta:
+        table_name = 'daily_reports'
+        indexes = (
+            (('student', 'date'), False),
+            (('pedagogue', 'date'), False),
+        )
+
+class ArchivedNotification(ArchiveModel):
+    recipient = DeferredForeignKey('User', backref='+', index=False)
+    message = CompressedTextField()
+    link = CharField(null=True)
+    is_read = BooleanField(default=False)
+    timestamp = DateTimeField()
+
+    class Meta:
+        table_name = 'notifications'
+        indexes = (
+            (('recipient', 'timestamp'), False),
+        )
+
+class ArchiveRun(ArchiveModel):
+    boundary = DateField()
+    moved = IntegerField(default=0)
+
+    class Meta:
+        table_name = 'archive_runs'
+
+DeferredForeignKey.resolve(Student)
+DeferredForeignKey.resolve(User)
+
+
+MODELS = [
+    ChangeLog, ActivityType, User, Student, Observation, Attendance, AttendanceSummary, AttendanceBitmap,
+    Event, EventException, GroupSession,
+    DailyReport, GeneralReport, Notification, SchedulerState
+]
+
+ARCHIVE_MODELS = [ArchivedObservation, ArchivedAttendance, ArchivedDailyReport, ArchivedNotification, ArchiveRun]
+
+
+def add_missing_columns():
+    # Columns added to a model after its table was created (all of them
+    # nullable) are added to the existing table in place.
+    migrator = SqliteMigrator(db)
+    operations = []
+    for model in MODELS:
+        table_name = model._meta.table_name
+        if not db.table_exists(table_name):
+            continue
+        existing_columns = {column.name for column in db.get_columns(table_name)}
+        for field in model._meta.sorted_fields:
+            if field.column_name not in existing_columns:
+                operations.append(migrator.add_column(table_name, field.column_name, field))
+    if operations:
+        migrate(*operations)
+    return len(operations) + _add_missing_archive_columns()
+
+
+def _add_missing_archive_columns():
+    # SqliteMigrator cannot address an attached database, so the archive
+    # tables get a plain ALTER TABLE.
+    added = 0
+    for model in ARCHIVE_MODELS:
+        table_name = model._meta.table_name
+        if not db.table_exists(table_name, ARCHIVE_SCHEMA):
+            continue
+        existing_columns = {column.name for column in db.get_columns(table_name, ARCHIVE_SCHEMA)}
+        for field in model._meta.sorted_fields:
+            if field.column_name not in existing_columns:
+                ctx = db.get_sql_context()
+                ctx.literal('ALTER TABLE ').sql(Entity(ARCHIVE_SCHEMA, table_name)).literal(' ADD COLUMN ').sql(field.ddl(ctx))
+                db.execute_sql(*ctx.query())
+                added += 1
+    return added
+
+
+def _encoding_sql(field, column):
+    if isinstance(field, CodeField):
+        cases = ' '.join(f"WHEN '{key}' THEN {code}" for key, code in field.codes.items())
+        return f'CASE "{column}" {cases} END'
+    if isinstance(field, ShiftField):
+        return ' | '.join(
+            f"""(CASE WHEN instr("{column}", '{shift}') THEN {bit} ELSE 0 END)""" for shift, bit in SHIFT_BITS.items()
+        )
+    return f'(SELECT id FROM activity_types WHERE activity_types.key = "{column}")'
+
+
+def encode_coded_columns():
+    # Tables created before statuses, shifts and activities were coded hold
+    # their text values. Each such column is replaced in place by an
+    # INTEGER column with the codes (unknown activity keys are added to the
+    # lookup table first).
+    converted = 0
+    for model in MODELS + ARCHIVE_MODELS:
+        schema, table_name = model._meta.schema, model._meta.table_name
+        if not db.table_exists(table_name, schema):
+            continue
+        column_types = {column.name: column.data_type.upper() for column in db.get_columns(table_name, schema)}
+        for field in model._meta.sorted_fields:
+            if not isinstance(field, (CodeField, ShiftField, ActivityTypeField)):
+                continue
+            column = field.column_name
+            if column_types.get(column, 'INTEGER') == 'INTEGER':
+                continue
+            table = f'"{schema}"."{table_name}"' if schema else f'"{table_name}"'
+            encoded = f'{column}_code'
+            if isinstance(field, ActivityTypeField):
+                db.execute_sql(f'INSERT OR IGNORE INTO activity_types (key) '
+                               f'SELECT DISTINCT "{column}" FROM {table} WHERE "{column}" IS NOT NULL')
+            db.execute_sql(f'ALTER TABLE {table} ADD COLUMN "{encoded}" INTEGER')
+            db.execute_sql(f'UPDATE {table} SET "{encoded}" = {_encoding_sql(field, column)}')
+            db.execute_sql(f'ALTER TABLE {table} DROP COLUMN "{column}"')
+            db.execute_sql(f'ALTER TABLE {table} RENAME COLUMN "{encoded}" TO "{column}"')
+            converted += 1
+    if converted:
+        ActivityType.load()
+    return converted
+
+
+def _use_incremental_vacuum():
+    # auto_vacuum can only be chosen before a database file has its first
+    # table; afterwards it takes a full VACUUM (see app.maintenance).
+    for schema in ('main', ARCHIVE_SCHEMA):
+        if not db.get_tables(schema):
+            db.execute_sql(f'PRAGMA "{schema}".auto_vacuum = INCREMENTAL')
 
 
 def create_tables():
     with db:
-        db.create_tables([User, Student, Observation, Attendance, Event, DailyReport, GeneralReport, Notification])
+        _use_incremental_vacuum()
+        with db.atomic():
+            add_missing_columns()
+            db.create_tables([ActivityType])
+            ActivityType.sync(Config.DAILY_LOG_ACTIVITY_CHOICES)
+            # Before create_tables, which indexes the coded columns.
+            encode_coded_columns()
+        new_aggregates = [model for model in (AttendanceSummary, AttendanceBitmap) if not model.table_exists()]
+        db.create_tables(MODELS)
+        db.create_tables(ARCHIVE_MODELS)
+        # Added to a database that already has attendance, the aggregates
+        # would start empty and later deltas would apply to missing counts;
+        # they are filled from the recorded attendance, live and archived.
+        if new_aggregates:
+            from app.attendance_stats import rebuild_attendance_summary
+            from app.attendance_bitmaps import rebuild_attendance_bitmaps
+            if AttendanceSummary in new_aggregates:
+                rebuild_attendance_summary()
+            if AttendanceBitmap in new_aggregates:
+                rebuild_attendance_bitmaps()
 
@@ -1,23 +1,71 @@
-from app.models import Notification, User
-from peewee import DoesNotExist
+from app.models import Notification, User, Student
+from peewee import DoesNotExist, Value, fn
+from config import Config
 import datetime
 
-def create_notification(recipient_id, message, link=None):
-    try:
-        recipient = User.get(User.id == recipient_id)
-        Notification.create(
-            recipient=recipient,
-            message=message,
-            link=link,
-            timestamp=datetime.datetime.now()
+
+def _fan_out(recipients, message, link=None, dedup_window=None):
+    # One INSERT ... SELECT for every recipient of `recipients` (a query of
+    # user ids), skipping those who already got the same message and link
+    # within the dedup window.
+    now = datetime.datetime.now()
+    if dedup_window is None:
+        dedup_window = Config.NOTIFICATION_DEDUP_WINDOW
+    if dedup_window:
+        Previous = Notification.alias()
+        duplicate = Previous.select(Previous.id).where(
+            (Previous.recipient == User.id) &
+            (Previous.timestamp >= now - datetime.timedelta(seconds=dedup_window)) &
+            (Previous.message == message) &
+            (Previous.link.is_null() if link is None else Previous.link == link)
         )
-        return True
-    except DoesNotExist:
-        print(f"Error: Recipient with ID {recipient_id} not found.")
-        return False
+        recipients = recipients.where(~fn.EXISTS(duplicate))
+    query = recipients.select(User.id, Value(message), Value(link), Value(False), Value(now))
+    try:
+        return Notification.insert_from(query, [
+            Notification.recipient, Notification.message, Notification.link, Notification.is_read,
+            Notification.timestamp
+        ]).as_rowcount().execute()
     except Exception as e:
-        print(f"Error creating notification: {e}")
-        return False
+        print(f"Error creating notifications: {e}")
+        return 0
+
+def notify_users(user_ids, message, link=None, dedup_window=None):
+    user_ids = set(user_ids)
+    if not user_ids:
+        return 0
+    return _fan_out(User.select().where(User.id.in_(sorted(user_ids))), message, link, dedup_window)
+
+def notify_role(role, message, link=None, dedup_window=None):
+    return _fan_out(User.select().where(User.role == role), message, link, dedup_window)
+
+def notify_all_users(message, link=None, dedup_window=None):
+    return _fan_out(User.select(), message, link, dedup_window)
+
+def notify_student_pedagogues(student_ids, message, link=None, dedup_window=None):
+    student_ids = set(student_ids)
+    if not student_ids:
+        return 0
+    pedagogues = Student.select(Student.pedagogue).where(Student.id.in_(sorted(student_ids)))
+    return _fan_out(User.select().where(User.id.in_(pedagogues)), message, link, dedup_window)
+
+def create_notification(recipient_id, message, link=None):
+    return notify_users([recipient_id], message, link) > 0
+
+def purge_read_notifications(days=None, batch_size=1000):
+    # Deletes in batches so a large purge doesn't hold the write lock for long.
+    days = Config.NOTIFICATION_RETENTION_DAYS if days is None else days
+    cutoff = datetime.datetime.now() - datetime.timedelta(days=days)
+    purged = 0
+    while True:
+        batch = (Notification
+                 .select(Notification.id)
+                 .where((Notification.is_read == True) & (Notification.timestamp < cutoff))
+                 .limit(batch_size))
+        deleted = Notification.delete().where(Notification.id.in_(batch)).execute()
+        purged += deleted
+        if deleted < batch_size:
+            return purged
 
 def get_unread_notifications(user_id):
     try:
@@ -52,12 +100,9 @@ def mark_notification_as_read(notification_id):
 
 def mark_all_notifications_as_read(user_id):
     try:
-        notifications = Notification.select().where(
+        Notification.update(is_read=True).where(
             (Notification.recipient == user_id) & (Notification.is_read == False)
-        )
-        for notification in notifications:
-            notification.is_read = True
-            notification.save()
+        ).execute()
         return True
     except Exception as e:
         print(f"Error marking all notifications for user {user_id} as read: {e}")
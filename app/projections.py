@@ -0,0 +1,60 @@
+from peewee import JOIN
+
+from app.models import User, Student, Attendance, DailyReport, GeneralReport, ArchivedAttendance, ArchivedDailyReport
+
+
+# List pages only need a handful of columns of each row. These select just
+# those (with the names of related rows joined in) and return namedtuples,
+# instead of full model instances with every text column.
+
+def student_rows(query):
+    return query.select(
+        Student.id, Student.name, Student.matricula, Student.course, Student.responsible_cpf
+    ).namedtuples()
+
+
+def student_options(query):
+    return query.select(Student.id, Student.name).order_by(Student.name).namedtuples()
+
+
+def user_rows(query):
+    return query.select(User.id, User.name, User.username, User.email, User.role).namedtuples()
+
+
+def _attendance_rows(query, model):
+    return (query
+            .select(model.id, model.date, model.status,
+                    model.student.alias('student_id'), Student.name.alias('student_name'))
+            .join(Student, on=(model.student == Student.id))
+            .namedtuples())
+
+
+def attendance_rows(query):
+    return _attendance_rows(query, Attendance)
+
+
+def archived_attendance_rows(query):
+    return _attendance_rows(query, ArchivedAttendance)
+
+
+def _report_rows(query, model, *fields):
+    return (query
+            .select(model.id, model.date, *fields,
+                    model.student.alias('student_id'), Student.name.alias('student_name'),
+                    model.pedagogue.alias('pedagogue_id'), User.name.alias('pedagogue_name'))
+            .join(Student, on=(model.student == Student.id))
+            .switch(model)
+            .join(User, JOIN.LEFT_OUTER, on=(model.pedagogue == User.id))
+            .namedtuples())
+
+
+def general_report_rows(query):
+    return _report_rows(query, GeneralReport, GeneralReport.location)
+
+
+def daily_report_rows(query):
+    return _report_rows(query, DailyReport, DailyReport.shift, DailyReport.activity_type)
+
+
+def archived_daily_report_rows(query):
+    return _report_rows(query, ArchivedDailyReport, ArchivedDailyReport.shift, ArchivedDailyReport.activity_type)
@@ -0,0 +1,171 @@
+import json
+import os
+import re
+import sqlite3
+import sys
+import threading
+import time
+
+from flask import has_request_context, request
+from peewee import SqliteDatabase
+
+
+EXPLAINED_STATEMENTS = ('SELECT', 'WITH', 'INSERT', 'UPDATE', 'DELETE')
+FULL_SCAN = re.compile(r'^SCAN (\S+)$')
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+# Frames skipped when looking for the code that ran a statement.
+INFRASTRUCTURE_FILES = tuple(os.path.join(APP_DIR, name) for name in ('query_log.py', 'models.py', 'fragment_cache.py'))
+TABLE_ALIAS = re.compile(r'"(\w+)" AS "(\w+)"')
+
+
+def normalize_statement(sql):
+    # Statements that only differ in the length of an IN (...) list are
+    # counted together; the values themselves are always parameters.
+    sql = re.sub(r'\?(\s*,\s*\?)+', '?', sql)
+    return re.sub(r'\s+', ' ', sql).strip()
+
+
+def plan_flags(plan, sql=''):
+    # The plan names tables by their alias in the statement (peewee's "t1").
+    aliases = {alias: table for table, alias in TABLE_ALIAS.findall(sql)}
+    full_scans = sorted({aliases.get(match.group(1), match.group(1)) for match in map(FULL_SCAN.match, plan) if match})
+    temp_btree = any('USE TEMP B-TREE' in detail for detail in plan)
+    return full_scans, temp_btree
+
+
+def _caller():
+    # The innermost frame in the app's own code outside the models, so the
+    # log points at the view or helper that built the query.
+    frame = sys._getframe(2)
+    while frame is not None:
+        path = frame.f_code.co_filename
+        if path.startswith(APP_DIR) and path not in INFRASTRUCTURE_FILES:
+            return f'{os.path.relpath(path, os.path.dirname(APP_DIR))}:{frame.f_lineno} {frame.f_code.co_name}'
+        frame = frame.f_back
+    return None
+
+
+class SlowQueryStore:
+    # Slow statements aggregated by normalized statement, with the slowest
+    # sample of each. It lives in its own database file, like the fragment
+    # cache store, so logging never contends with clai.db. Bound parameters
+    # (password hashes, CPFs, contacts) are never stored: only the SQL text,
+    # where they are placeholders, and the plan.
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=1)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS slow_queries ('
+                'statement TEXT PRIMARY KEY, count INTEGER NOT NULL, total_ms REAL NOT NULL, max_ms REAL NOT NULL, '
+                'full_scans TEXT NOT NULL, temp_btree INTEGER NOT NULL, last_seen REAL NOT NULL, '
+                'sql TEXT NOT NULL, route TEXT, caller TEXT, plan TEXT)'
+            )
+            # Logs written before parameters were left out still hold them.
+            if 'params' in {row[1] for row in conn.execute('PRAGMA table_info(slow_queries)')}:
+                with conn:
+                    conn.execute('UPDATE slow_queries SET params = NULL WHERE params IS NOT NULL')
+            self._local.conn = conn
+        return conn
+
+    def record(self, sample):
+        try:
+            conn = self._connection()
+            with conn:
+                conn.execute(
+                    'INSERT INTO slow_queries (statement, count, total_ms, max_ms, full_scans, temp_btree, last_seen, '
+                    'sql, route, caller, plan) '
+                    'VALUES (:statement, 1, :ms, :ms, :full_scans, :temp_btree, :time, :sql, :route, :caller, :plan) '
+                    'ON CONFLICT (statement) DO UPDATE SET '
+                    'count = count + 1, total_ms = total_ms + excluded.total_ms, last_seen = excluded.last_seen, '
+                    'full_scans = excluded.full_scans, temp_btree = excluded.temp_btree, '
+                    'sql = CASE WHEN excluded.max_ms >= max_ms THEN excluded.sql ELSE sql END, '
+                    'route = CASE WHEN excluded.max_ms >= max_ms THEN excluded.route ELSE route END, '
+                    'caller = CASE WHEN excluded.max_ms >= max_ms THEN excluded.caller ELSE caller END, '
+                    'plan = CASE WHEN excluded.max_ms >= max_ms THEN excluded.plan ELSE plan END, '
+                    'max_ms = MAX(max_ms, excluded.max_ms)',
+                    sample
+                )
+        except sqlite3.Error as e:
+            print(f"Error writing slow query log: {e}")
+
+    def top(self, order_by='total_ms', limit=50):
+        if order_by not in ('total_ms', 'max_ms', 'count'):
+            order_by = 'total_ms'
+        try:
+            cursor = self._connection().execute(
+                f'SELECT statement, count, total_ms, max_ms, full_scans, temp_btree, last_seen, sql, route, '
+                f'caller, plan FROM slow_queries ORDER BY {order_by} DESC LIMIT ?', (limit,)
+            )
+            columns = [column for column, *_ in cursor.description]
+            rows = [dict(zip(columns, row)) for row in cursor]
+        except sqlite3.Error as e:
+            print(f"Error reading slow query log: {e}")
+            return []
+        for row in rows:
+            row['full_scans'] = json.loads(row['full_scans'])
+            row['plan'] = json.loads(row['plan']) if row['plan'] else []
+            row['mean_ms'] = row['total_ms'] / row['count']
+        return rows
+
+    def clear(self):
+        try:
+            with self._connection() as conn:
+                conn.execute('DELETE FROM slow_queries')
+        except sqlite3.Error as e:
+            print(f"Error clearing slow query log: {e}")
+
+
+class SlowQueryDatabase(SqliteDatabase):
+    # Times every statement; those slower than the threshold are explained
+    # on the same connection and recorded in the store. Off until
+    # log_slow_queries is called (see create_app). For a SELECT the time is
+    # the first step of the statement, where SQLite sorts, groups and finds
+    # the first row; rows read afterwards are not counted.
+    slow_query_store = None
+    slow_query_threshold = None
+
+    def log_slow_queries(self, store, threshold_ms):
+        self.slow_query_store = store
+        self.slow_query_threshold = threshold_ms / 1000
+
+    def execute_sql(self, sql, params=None):
+        if self.slow_query_store is None:
+            return super().execute_sql(sql, params)
+        start = time.perf_counter()
+        cursor = super().execute_sql(sql, params)
+        elapsed = time.perf_counter() - start
+        if elapsed >= self.slow_query_threshold:
+            self._record_slow_query(sql, params, elapsed)
+        return cursor
+
+    def _explain(self, sql, params):
+        if not sql.lstrip().upper().startswith(EXPLAINED_STATEMENTS):
+            return []
+        try:
+            return [row[-1] for row in self.cursor().execute('EXPLAIN QUERY PLAN ' + sql, params or ())]
+        except sqlite3.Error:
+            return []
+
+    def _record_slow_query(self, sql, params, elapsed):
+        plan = self._explain(sql, params)
+        full_scans, temp_btree = plan_flags(plan, sql)
+        route = None
+        if has_request_context():
+            route = f'{request.method} {request.endpoint or request.path}'
+        self.slow_query_store.record({
+            'statement': normalize_statement(sql),
+            'ms': elapsed * 1000,
+            'full_scans': json.dumps(full_scans),
+            'temp_btree': int(temp_btree),
+            'time': time.time(),
+            'sql': sql,
+            'route': route,
+            'caller': _caller(),
+            'plan': json.dumps(plan, ensure_ascii=False),
+        })
@@ -0,0 +1,213 @@
+import datetime
+from collections import namedtuple
+
+from app.models import db, Event, EventException
+from config import Config
+
+
+FREQUENCIES = ('daily', 'weekly', 'monthly')
+# Widest range calendar_api expands at once.
+MAX_WINDOW = datetime.timedelta(days=366)
+# Events cannot be longer than this, so anything overlapping a range starts
+# at most this long before it: the lower bound of every interval query.
+MAX_EVENT_DURATION = datetime.timedelta(days=Config.EVENT_MAX_DURATION_DAYS)
+
+# original_start is None for events that do not repeat.
+Occurrence = namedtuple('Occurrence', 'event original_start start_time end_time title description')
+
+
+def parse_weekdays(value):
+    if not value:
+        return []
+    return sorted({int(day) for day in value.split(',') if day.strip().isdigit()})
+
+
+def format_weekdays(days):
+    return ','.join(str(day) for day in sorted(set(days))) or None
+
+
+def recurrence_fields(recurrence, interval=None, weekdays=None, until=None):
+    if recurrence not in FREQUENCIES:
+        return {'recurrence': None, 'recurrence_interval': None, 'recurrence_weekdays': None, 'recurrence_until': None}
+    return {
+        'recurrence': recurrence,
+        'recurrence_interval': interval or 1,
+        'recurrence_weekdays': format_weekdays(weekdays or []) if recurrence == 'weekly' else None,
+        'recurrence_until': until,
+    }
+
+
+def recurrence_key(event):
+    return (event.start_time, event.recurrence, event.recurrence_interval,
+            event.recurrence_weekdays, event.recurrence_until)
+
+
+def parse_client_datetime(value):
+    # The calendar sends wall-clock times with the browser's offset; they are
+    # stored as naive local times.
+    try:
+        return datetime.datetime.fromisoformat(value).replace(tzinfo=None)
+    except (TypeError, ValueError):
+        return None
+
+
+def calendar_window(start, end, today=None):
+    window_start, window_end = parse_client_datetime(start), parse_client_datetime(end)
+    if window_start is None or window_end is None or window_end <= window_start:
+        today = today or datetime.date.today()
+        month_start = datetime.datetime(today.year, today.month, 1)
+        window_start = month_start - datetime.timedelta(days=7)
+        window_end = month_start + datetime.timedelta(weeks=6)
+    return window_start, min(window_end, window_start + MAX_WINDOW)
+
+
+def occurrence_starts(event, lower, upper):
+    # Start times of the series in [lower, upper). The first candidate is
+    # computed from lower rather than walked to from the start of the
+    # series, so the cost depends on the length of the range only.
+    start = event.start_time
+    interval = max(event.recurrence_interval or 1, 1)
+    if event.recurrence_until is not None:
+        until = datetime.datetime.combine(event.recurrence_until + datetime.timedelta(days=1), datetime.time())
+        upper = min(upper, until)
+    lower = max(lower, start)
+
+    if event.recurrence == 'daily':
+        step = datetime.timedelta(days=interval)
+        current = start + datetime.timedelta(days=(lower - start).days // interval * interval)
+        while current < upper:
+            if current >= lower:
+                yield current
+            current += step
+    elif event.recurrence == 'weekly':
+        weekdays = parse_weekdays(event.recurrence_weekdays) or [start.weekday()]
+        week_start = start - datetime.timedelta(days=start.weekday())
+        week = (lower - week_start).days // 7 // interval * interval
+        while True:
+            first_day = week_start + datetime.timedelta(weeks=week)
+            if first_day >= upper:
+                break
+            for weekday in weekdays:
+                current = first_day + datetime.timedelta(days=weekday)
+                if lower <= current < upper:
+                    yield current
+            week += interval
+    elif event.recurrence == 'monthly':
+        month = ((lower.year - start.year) * 12 + lower.month - start.month) // interval * interval
+        while True:
+            year, month_index = divmod(start.month - 1 + month, 12)
+            if datetime.datetime(start.year + year, month_index + 1, 1) >= upper:
+                break
+            try:
+                current = start.replace(year=start.year + year, month=month_index + 1)
+            except ValueError:
+                # Months without that day (e.g. the 31st) are skipped.
+                current = None
+            if current is not None and lower <= current < upper:
+                yield current
+            month += interval
+    elif lower <= start < upper:
+        yield start
+
+
+def is_occurrence(event, start):
+    return start in occurrence_starts(event, start, start + datetime.timedelta(microseconds=1))
+
+
+def _overlaps(start, end, window_start, window_end):
+    return start < window_end and (end > window_start or start >= window_start)
+
+
+def _occurrence(event, original_start, duration, exception):
+    if exception is None:
+        return Occurrence(event, original_start, original_start, original_start + duration,
+                          event.title, event.description)
+    if exception.cancelled:
+        return None
+    start_time = exception.start_time or original_start
+    end_time = exception.end_time or start_time + duration
+    return Occurrence(event, original_start, start_time, end_time,
+                      exception.title or event.title,
+                      exception.description if exception.description is not None else event.description)
+
+
+def active_series(window_start, window_end):
+    # Ids of the series that may repeat into the window, read from the
+    # partial (recurrence_until, start_time) index on series: the open-ended
+    # ones that started before the window ends, and the bounded ones that
+    # end on or after its first day. Single events and series that ended
+    # before the window are not read. The two halves are separate selects
+    # so each is an index range of its own, whatever else the caller
+    # filters on.
+    open_ended = Event.select(Event.id).where(
+        Event.recurrence.is_null(False) & Event.recurrence_until.is_null() & (Event.start_time < window_end)
+    )
+    bounded = Event.select(Event.id).where(
+        Event.recurrence.is_null(False) & (Event.recurrence_until >= window_start.date()) &
+        (Event.start_time < window_end)
+    )
+    return open_ended + bounded
+
+
+def expand(query, window_start, window_end):
+    # Occurrences of the recurring events in `query` that overlap the
+    # window, with their exceptions applied. Occurrences moved into the
+    # window from outside it are found through the exception's own times.
+    series = list(query.where(Event.id.in_(active_series(window_start, window_end))))
+    if not series:
+        return []
+
+    longest = max(event.end_time - event.start_time for event in series)
+    exceptions = {}
+    for exception in EventException.select().where(
+        EventException.event.in_([event.id for event in series]) &
+        (((EventException.original_start >= window_start - longest) & (EventException.original_start < window_end)) |
+         ((EventException.start_time < window_end) & (EventException.end_time > window_start)))
+    ):
+        exceptions.setdefault(exception.event_id, {})[exception.original_start] = exception
+
+    occurrences = []
+    for event in series:
+        duration = event.end_time - event.start_time
+        event_exceptions = exceptions.get(event.id, {})
+        starts = set(occurrence_starts(event, window_start - duration, window_end))
+        starts.update(start for start in event_exceptions if start not in starts and is_occurrence(event, start))
+        for original_start in sorted(starts):
+            occurrence = _occurrence(event, original_start, duration, event_exceptions.get(original_start))
+            if occurrence and _overlaps(occurrence.start_time, occurrence.end_time, window_start, window_end):
+                occurrences.append(occurrence)
+    return occurrences
+
+
+def events_in_window(query, window_start, window_end):
+    single = query.where(
+        Event.recurrence.is_null() &
+        (Event.start_time >= window_start - MAX_EVENT_DURATION) &
+        (Event.start_time < window_end) &
+        ((Event.end_time > window_start) | (Event.start_time >= window_start))
+    )
+    occurrences = [
+        Occurrence(event, None, event.start_time, event.end_time, event.title, event.description)
+        for event in single
+    ]
+    return occurrences + expand(query, window_start, window_end)
+
+
+def save_exception(event, original_start, **fields):
+    with db.atomic():
+        exception = EventException.get_or_none(
+            (EventException.event == event) & (EventException.original_start == original_start)
+        )
+        if exception is None:
+            exception = EventException(event=event, original_start=original_start)
+        for name, value in fields.items():
+            setattr(exception, name, value)
+        exception.save()
+        # Saving the series bumps the Event version (and so the calendar's
+        # ETag) and puts the change in the change feed.
+        event.save()
+    return exception
+
+
+def clear_exceptions(event):
+    return EventException.delete().where(EventException.event == event).execute()
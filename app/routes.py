@@ -1,19 +1,57 @@
-from flask import Blueprint, render_template, redirect, url_for, flash, request, Response, jsonify, send_from_directory
+from flask import (
+    Blueprint, render_template, redirect, url_for, flash, request, Response, jsonify, send_from_directory,
+    current_app
+)
 from flask_login import login_user, logout_user, current_user, login_required
 from app import bcrypt
-from app.models import User, Student, Observation, Event, Attendance, DailyReport, GeneralReport, Notification
+from app.models import (
+    db, SHIFTS, ActivityType, User, Student, Observation, Event, EventException, Attendance, AttendanceBitmap, DailyReport,
+    GeneralReport, Notification, ArchivedAttendance, ArchivedDailyReport
+)
 import peewee
 from app.forms import (
     LoginForm, StudentForm, UserForm, UpdateUserForm, ObservationForm,
-    EventForm, ProfileForm, AttendanceForm, DailyReportForm, GeneralReportForm,
-    ChangePasswordForm, AdminSetPasswordForm
+    EventForm, ProfileForm, AttendanceForm, DailyReportForm, GroupDailyReportForm, GeneralReportForm,
+    ChangePasswordForm, AdminSetPasswordForm, AnnouncementForm, OccurrenceForm, StudentImportForm,
+    event_interval_error, ARCHIVED_ATTENDANCE_MESSAGE
+)
+from app.scoping import scoped, scoped_students_query, owns, can_access_student
+from app.auth_utils import (
+    login_retry_after, record_failed_login, record_successful_login, password_needs_rehash
+)
+from app.attendance_stats import (
+    PERIOD_TYPES, default_since, grade_attendance_stats, student_attendance_stats
+)
+from app.attendance_bitmaps import student_year, month_grid, absence_counts
+from app.analytics import (
+    GROUP_FIELDS, RATE_BIN_COUNT, attendance_rate_distribution, activity_type_frequency, pedagogue_workload
+)
+from app.backup import reporting_database
+from app.fragment_cache import cached
+from app.http_cache import conditional_get, list_validators, row_validators
+from app.change_feed import parse_since, changes_since
+from app.sync import sync
+from app.archive import (
+    reaches_archive, is_archived, archived_attendance, archived_daily_reports, archived_notifications
+)
+from app.recurrence import (
+    calendar_window, events_in_window, recurrence_fields, recurrence_key, parse_weekdays, is_occurrence,
+    save_exception, clear_exceptions, parse_client_datetime
 )
+from app.availability import event_conflicts, interval_conflicts, describe_conflicts, free_slots
+from app.projections import (
+    student_rows, student_options, user_rows, attendance_rows, general_report_rows, daily_report_rows
+)
+from app.student_import import import_students
+from app.group_reports import OVERRIDABLE_FIELDS, create_group_reports, session_reports
+from app.timeline import TIMELINE_SOURCES, TIMELINE_MODELS, decode_cursor, timeline_page, timeline_counts
 from app.notification_utils import (
     get_unread_notifications, get_all_notifications,
-    mark_notification_as_read, mark_all_notifications_as_read
+    mark_notification_as_read, mark_all_notifications_as_read, notify_all_users, notify_role
 )
 from functools import wraps
 import datetime
+import io
 import os
 from PIL import Image
 from config import Config
@@ -26,7 +64,24 @@ def list_notifications():
     page = request.args.get('page', 1, type=int)
     per_page = Config.PAGINATION_PER_PAGE
 
+    selected_date_str = request.args.get('date', '')
+
     notifications_query = get_all_notifications(current_user.id)
+
+    archived_notification_list = []
+    if selected_date_str:
+        try:
+            selected_date = datetime.date.fromisoformat(selected_date_str)
+            day_start = datetime.datetime.combine(selected_date, datetime.time())
+            notifications_query = notifications_query.where(
+                (Notification.timestamp >= day_start) &
+                (Notification.timestamp < day_start + datetime.timedelta(days=1))
+            )
+            if reaches_archive(selected_date):
+                archived_notification_list = archived_notifications(current_user.id, selected_date)
+        except ValueError:
+            flash('Formato de data inválido. Use AAAA-MM-DD.', 'warning')
+            selected_date_str = ''
     
     total_notifications = notifications_query.count()
     total_pages = (total_notifications + per_page - 1) // per_page
@@ -37,13 +92,15 @@ def list_notifications():
         'page': page,
         'total_pages': total_pages,
         'route': 'main.list_notifications',
-        'args': {}
+        'args': {'date': selected_date_str} if selected_date_str else {}
     }
     
     return render_template(
         'notifications/list_notifications.html',
         title='Notificações',
         notifications=notifications,
+        archived_notifications=archived_notification_list,
+        selected_date=selected_date_str,
         paginator=paginator
     )
 
@@ -83,6 +140,8 @@ def service_worker():
 def offline():
     return render_template('offline.html')
 
+bp.add_app_template_global(owns, 'owns')
+
 @bp.app_template_filter('format_cpf')
 def format_cpf_filter(cpf_raw):
     if not cpf_raw:
@@ -142,12 +201,25 @@ def login():
     if form.validate_on_submit():
         identifier = form.login_id.data
         user = User.get_or_none((User.email == identifier) | (User.username == identifier))
-        
+        retry_after = login_retry_after(request.remote_addr, user, identifier)
+        if retry_after:
+            minutes = (retry_after + 59) // 60
+            flash(f'Muitas tentativas de login. Tente novamente em {minutes} minuto(s).', 'danger')
+            response = Response(render_template('login.html', title='Login', form=form), status=429)
+            response.headers['Retry-After'] = str(retry_after)
+            return response
+
         if user and bcrypt.check_password_hash(user.password, form.password.data):
+            record_successful_login(user)
+            rounds = current_app.config['BCRYPT_LOG_ROUNDS']
+            if password_needs_rehash(user.password, rounds):
+                user.password = bcrypt.generate_password_hash(form.password.data, rounds).decode('utf-8')
+                user.save()
             login_user(user, remember=form.remember.data)
             next_page = request.args.get('next')
             return redirect(next_page or url_for('main.dashboard'))
         else:
+            record_failed_login(request.remote_addr, user, identifier)
             flash('Login falhou. Verifique suas credenciais.', 'danger')
             
     return render_template('login.html', title='Login', form=form)
@@ -162,32 +234,29 @@ def logout():
 @login_required
 def dashboard():
     today = datetime.date.today()
-    if current_user.role == 'admin':
-        students = Student.select().limit(6)
-        upcoming_events = Event.select().where(Event.start_time >= datetime.datetime.now())
-        recent_observations = Observation.select().where(Observation.date >= today - datetime.timedelta(days=7))
-    else:
-        students = Student.select().where(Student.pedagogue == current_user).limit(6)
-        upcoming_events = Event.select().where(
-            (Event.pedagogue == current_user) and 
-            (Event.start_time >= datetime.datetime.now())
-        )
-        recent_observations = Observation.select().where(
-            (Observation.pedagogue == current_user) and 
-            (Observation.date >= today - datetime.timedelta(days=7))
-        )
-    
-    student_count = students.count()
-    upcoming_events_count = upcoming_events.count()
-    recent_observations_count = recent_observations.count()
+    students_query = scoped(Student.select(), Student, current_user)
+    students = students_query.order_by(Student.name).limit(6)
+    upcoming_events = scoped(Event.select(), Event, current_user).where(Event.start_time >= datetime.datetime.now())
+    recent_observations = scoped(Observation.select(), Observation, current_user).where(
+        Observation.date >= today - datetime.timedelta(days=7)
+    )
 
-    students_per_course = (
-        Student.select(Student.course, peewee.fn.COUNT(Student.id).alias('count'))
-        .group_by(Student.course)
-        .order_by(Student.course)
+    student_count = cached('dashboard:student_count', ['Student'], (), students_query.count)
+    upcoming_events_count = upcoming_events.count()
+    recent_observations_count = cached(
+        'dashboard:recent_observations_count', ['Observation'], (today,), recent_observations.count
     )
-    chart_labels = [s.course for s in students_per_course]
-    chart_data = [s.count for s in students_per_course]
+
+    def students_per_course():
+        query = (
+            Student.select(Student.course, peewee.fn.COUNT(Student.id).alias('count'))
+            .group_by(Student.course)
+            .order_by(Student.course)
+        )
+        return [[s.course, s.count] for s in query]
+    chart_rows = cached('dashboard:students_per_course', ['Student'], (), students_per_course)
+    chart_labels = [course for course, _ in chart_rows]
+    chart_data = [count for _, count in chart_rows]
     
     return render_template(
         'dashboard.html', 
@@ -251,26 +320,24 @@ def change_password():
     
 @bp.route('/students')
 @login_required
+@conditional_get(lambda: list_validators('Student', 'User'))
 def list_students():
     page = request.args.get('page', 1, type=int)
     per_page = Config.PAGINATION_PER_PAGE
     search_query = request.args.get('search', '')
 
-    if current_user.role == 'admin':
-        students_query = Student.select()
-    else:
-        students_query = Student.select().where(Student.pedagogue == current_user)
-    
+    students_query = scoped(Student.select(), Student, current_user)
+
     if search_query:
         students_query = students_query.where(
             (Student.name.contains(search_query)) |
             (Student.matricula.contains(search_query))
         )
     
-    total_students = students_query.count()
+    total_students = cached('list_students:count', ['Student'], (search_query,), students_query.count)
     total_pages = (total_students + per_page - 1) // per_page
     
-    students = students_query.order_by(Student.name).paginate(page, per_page)
+    students = student_rows(students_query.order_by(Student.name).paginate(page, per_page))
 
     paginator_args = {}
     if search_query:
@@ -290,6 +357,28 @@ def list_students():
         paginator=paginator
     )
 
+@bp.route('/students/search')
+@login_required
+def search_students():
+    search_query = request.args.get('q', '').strip()
+    if len(search_query) < 2:
+        return jsonify([])
+
+    students = (
+        scoped_students_query(current_user, Student.id, Student.name, Student.matricula)
+        .where(
+            (Student.name.contains(search_query)) |
+            (Student.matricula.startswith(search_query))
+        )
+        .order_by(Student.name)
+        .limit(20)
+        .tuples()
+    )
+    return jsonify([
+        {'id': student_id, 'name': name, 'matricula': matricula}
+        for student_id, name, matricula in students
+    ])
+
 @bp.route('/students/new', methods=['GET', 'POST'])
 @login_required
 @pedagogue_or_admin_required
@@ -322,11 +411,40 @@ def add_student():
             flash(f'Erro ao adicionar aluno: {e}', 'danger')
     return render_template('students/add_student.html', title='Adicionar Aluno', form=form)
 
+
+@bp.route('/admin/students/import', methods=['GET', 'POST'])
+@login_required
+@admin_required
+def import_students_csv():
+    form = StudentImportForm()
+    form.pedagogue_id.choices = [(0, 'Nenhum')] + list(
+        User.select(User.id, User.name).order_by(User.name).tuples()
+    )
+    result, errors = None, []
+    if form.validate_on_submit():
+        def collect(error):
+            if len(errors) < Config.STUDENT_IMPORT_MAX_REPORTED_ERRORS:
+                errors.append(error)
+
+        stream = io.TextIOWrapper(form.csv_file.data.stream, encoding=form.encoding.data, newline='')
+        try:
+            result = import_students(stream, form.pedagogue_id.data or None, on_error=collect)
+        except UnicodeDecodeError:
+            flash('Não foi possível ler o arquivo com a codificação escolhida. As linhas anteriores ao erro foram importadas.', 'danger')
+        except ValueError as e:
+            flash(str(e), 'danger')
+        else:
+            flash(f'{result["inserted"]} alunos adicionados e {result["updated"]} atualizados.', 'success')
+            if result['errors']:
+                flash(f'{result["errors"]} linhas não foram importadas.', 'warning')
+    return render_template('students/import_students.html', title='Importar Alunos', form=form,
+                           result=result, errors=errors)
+
 @bp.route('/students/<int:student_id>/edit', methods=['GET', 'POST'])
 @login_required
 def edit_student(student_id):
     student = Student.get_or_none(Student.id == student_id)
-    if not student or (student.pedagogue != current_user and current_user.role != 'admin'):
+    if not student or not owns(current_user, student.pedagogue_id):
         flash('Aluno não encontrado ou você não tem permissão para editá-lo.', 'danger')
         return redirect(url_for('main.list_students'))
 
@@ -371,7 +489,7 @@ def edit_student(student_id):
 @pedagogue_or_admin_required
 def delete_student(student_id):
     student = Student.get_or_none(Student.id == student_id)
-    if not student or (student.pedagogue != current_user and current_user.role != 'admin'):
+    if not student or not owns(current_user, student.pedagogue_id):
         flash('Aluno não encontrado ou você não tem permissão para excluí-lo.', 'danger')
     else:
         try:
@@ -383,31 +501,48 @@ def delete_student(student_id):
 
 @bp.route('/students/<int:student_id>')
 @login_required
+@conditional_get(lambda student_id: row_validators(Student, student_id, 'User', *TIMELINE_MODELS))
 def student_detail(student_id):
     student = Student.get_or_none(Student.id == student_id)
-    if not student or (student.pedagogue != current_user and current_user.role != 'admin'):
+    if not student or not owns(current_user, student.pedagogue_id):
         flash('Aluno não encontrado ou você não tem permissão para visualizá-lo.', 'danger')
         return redirect(url_for('main.list_students'))
-    observations = Observation.select().where(
-        Observation.student == student
-    ).order_by(Observation.date.desc())
-    attendance_records = Attendance.select().where(
-        Attendance.student == student
-    ).order_by(Attendance.date.desc())
     return render_template(
         'students/student_detail.html',
         title=student.name,
         student=student,
-        observations=observations,
-        attendance_records=attendance_records
+        timeline_counts=cached(
+            'student_detail:timeline_counts', TIMELINE_MODELS, (student.id,), lambda: timeline_counts(student.id)
+        )
     )
 
+@bp.route('/students/<int:student_id>/timeline')
+@login_required
+def student_timeline(student_id):
+    student = Student.get_or_none(Student.id == student_id)
+    if not student or not owns(current_user, student.pedagogue_id):
+        return jsonify({'error': 'Aluno não encontrado.'}), 404
+
+    kinds = [kind for kind in request.args.get('kinds', '').split(',') if kind in TIMELINE_SOURCES]
+    cursor = decode_cursor(request.args.get('cursor'))
+    limit = min(max(request.args.get('limit', Config.PAGINATION_PER_PAGE * 2, type=int), 1), 100)
+    items, next_cursor = timeline_page(student.id, cursor=cursor, kinds=kinds, limit=limit)
+
+    activity_choices_map = ActivityType.labels()
+    html = render_template(
+        'students/timeline_items.html',
+        student=student,
+        items=items,
+        activity_choices_map=activity_choices_map
+    )
+    return jsonify({'html': html, 'next_cursor': next_cursor})
+
 @bp.route('/students/<int:student_id>/observations/new', methods=['GET', 'POST'])
 @login_required
 @pedagogue_or_admin_required
 def add_observation(student_id):
     student = Student.get_or_none(Student.id == student_id)
-    if not student or (student.pedagogue != current_user and current_user.role != 'admin'):
+    if not student or not owns(current_user, student.pedagogue_id):
         flash('Aluno não encontrado ou você não tem permissão para adicionar observações a ele.', 'danger')
         return redirect(url_for('main.list_students'))
 
@@ -433,12 +568,12 @@ def add_observation(student_id):
 @pedagogue_or_admin_required
 def edit_observation(student_id, observation_id):
     student = Student.get_or_none(Student.id == student_id)
-    if not student or (student.pedagogue != current_user and current_user.role != 'admin'):
+    if not student or not owns(current_user, student.pedagogue_id):
         flash('Aluno não encontrado.', 'danger')
         return redirect(url_for('main.list_students'))
 
     observation = Observation.get_or_none(Observation.id == observation_id, Observation.student == student)
-    if not observation or (observation.pedagogue != current_user and current_user.role != 'admin'):
+    if not observation or not owns(current_user, observation.pedagogue_id):
         flash('Observação não encontrada ou você não tem permissão para editá-la.', 'danger')
         return redirect(url_for('main.student_detail', student_id=student.id))
 
@@ -471,34 +606,45 @@ def edit_observation(student_id, observation_id):
 
 @bp.route('/attendance')
 @login_required
+@conditional_get(lambda: list_validators('Attendance', 'Student'))
 def list_attendance():
     page = request.args.get('page', 1, type=int)
     per_page = Config.PAGINATION_PER_PAGE
 
-    if current_user.role == 'admin':
-        attendance_query = Attendance.select().order_by(Attendance.date.desc())
-    else:
-        pedagogue_students = Student.select().where(Student.pedagogue == current_user)
-        attendance_query = Attendance.select().where(
-            Attendance.student.in_(pedagogue_students)
-        ).order_by(Attendance.date.desc())
-    
-    total_attendance_records = attendance_query.count()
+    selected_date_str = request.args.get('date', '')
+
+    attendance_query = Attendance.select()
+
+    archived_records = []
+    if selected_date_str:
+        try:
+            selected_date = datetime.date.fromisoformat(selected_date_str)
+            attendance_query = attendance_query.where(Attendance.date == selected_date)
+            if reaches_archive(selected_date):
+                archived_records = archived_attendance(current_user, selected_date)
+        except ValueError:
+            flash('Formato de data inválido. Use AAAA-MM-DD.', 'warning')
+            selected_date_str = ''
+
+    total_attendance_records = scoped(attendance_query, Attendance, current_user).count()
     total_pages = (total_attendance_records + per_page - 1) // per_page
 
-    attendance_records = attendance_query.paginate(page, per_page)
+    page_query = scoped(attendance_query, Attendance, current_user, ordered=True).order_by(Attendance.date.desc())
+    attendance_records = attendance_rows(page_query.paginate(page, per_page))
 
     paginator = {
         'page': page,
         'total_pages': total_pages,
         'route': 'main.list_attendance',
-        'args': {}
+        'args': {'date': selected_date_str} if selected_date_str else {}
     }
     
     return render_template(
         'attendance/list_attendance.html',
         title='Registros de Frequência',
         attendance_records=attendance_records,
+        archived_records=archived_records,
+        selected_date=selected_date_str,
         paginator=paginator
     )
 
@@ -507,15 +653,10 @@ def list_attendance():
 @pedagogue_or_admin_required
 def add_attendance():
     form = AttendanceForm()
-    if current_user.role != 'admin':
-        form.student_id.choices = [
-            (s.id, s.name) for s in Student.select().where(Student.pedagogue == current_user)
-        ]
-    
     if form.validate_on_submit():
         try:
             student = Student.get_by_id(form.student_id.data)
-            if student.pedagogue != current_user and current_user.role != 'admin':
+            if not owns(current_user, student.pedagogue_id):
                 flash('Você não tem permissão para registrar frequência para este aluno.', 'danger')
                 return redirect(url_for('main.list_attendance'))
 
@@ -539,22 +680,16 @@ def edit_attendance(attendance_id):
         flash('Registro de frequência não encontrado.', 'danger')
         return redirect(url_for('main.list_attendance'))
     
-    if attendance.student.pedagogue != current_user and current_user.role != 'admin':
+    if not can_access_student(current_user, attendance.student_id):
         flash('Você não tem permissão para editar este registro de frequência.', 'danger')
         return redirect(url_for('main.list_attendance'))
 
     form = AttendanceForm(obj=attendance)
-    if current_user.role != 'admin':
-        form.student_id.choices = [
-            (s.id, s.name) for s in Student.select().where(Student.pedagogue == current_user)
-        ]
-    else:
-        form.student_id.choices = [(s.id, s.name) for s in Student.select()]
-    
+
     if form.validate_on_submit():
         try:
             student = Student.get_by_id(form.student_id.data)
-            if student.pedagogue != current_user and current_user.role != 'admin':
+            if not owns(current_user, student.pedagogue_id):
                 flash(
                     'Você não tem permissão para registrar frequência para este aluno.',
                     'danger'
@@ -571,7 +706,7 @@ def edit_attendance(attendance_id):
             flash(f'Erro ao atualizar registro de frequência: {e}', 'danger')
     
     if request.method == 'GET' and not form.student_id.data:
-        form.student_id.data = attendance.student.id
+        form.student_id.data = attendance.student_id
 
     return render_template('attendance/edit_attendance.html', title='Editar Frequência', form=form, attendance=attendance)
 
@@ -584,7 +719,7 @@ def delete_attendance(attendance_id):
         flash('Registro de frequência não encontrado.', 'danger')
         return redirect(url_for('main.list_attendance'))
     
-    if attendance.student.pedagogue != current_user and current_user.role != 'admin':
+    if not can_access_student(current_user, attendance.student_id):
         flash('Você não tem permissão para excluir este registro de frequência.', 'danger')
         return redirect(url_for('main.list_attendance'))
     
@@ -601,12 +736,10 @@ def delete_attendance(attendance_id):
 @login_required
 @pedagogue_or_admin_required
 def mark_attendance():
-    if current_user.role == 'admin':
-        students_query = Student.select()
-    else:
-        students_query = Student.select().where(Student.pedagogue == current_user)
+    students_query = scoped(Student.select(), Student, current_user)
 
-    all_grades = sorted(list(set([s.grade for s in students_query if s.grade])))
+    all_grades = [grade for grade, in students_query.select(Student.grade).distinct().order_by(Student.grade).tuples()
+                  if grade]
 
     selected_grade = request.args.get('grade', '')
     selected_date_str = request.args.get('date', datetime.date.today().isoformat())
@@ -623,6 +756,11 @@ def mark_attendance():
         selected_date = datetime.date.today()
         selected_date_str = selected_date.isoformat()
 
+    archived = is_archived(selected_date)
+    if request.method == 'POST' and archived:
+        flash(ARCHIVED_ATTENDANCE_MESSAGE, 'danger')
+        return redirect(url_for('main.mark_attendance', date=selected_date_str, grade=selected_grade))
+
     if request.method == 'POST':
         successful_updates = 0
         failed_updates = 0
@@ -650,10 +788,13 @@ def mark_attendance():
         
         return redirect(url_for('main.mark_attendance', date=selected_date_str, grade=selected_grade))
 
-    existing_attendance = {
-        att.student.id: att.status 
-        for att in Attendance.select().where(Attendance.date == selected_date, Attendance.student.in_(students))
-    }
+    # An archived day is in the archive only.
+    model = ArchivedAttendance if archived else Attendance
+    existing_attendance = dict(
+        model.select(model.student, model.status)
+        .where(model.date == selected_date, model.student.in_(students_query.select(Student.id)))
+        .tuples()
+    )
 
     return render_template(
         'attendance/mark_attendance.html',
@@ -662,14 +803,125 @@ def mark_attendance():
         selected_date=selected_date,
         selected_date_str=selected_date_str,
         existing_attendance=existing_attendance,
+        archived=archived,
         all_grades=all_grades,
         selected_grade=selected_grade
     )
 
 
+def _attendance_stats_filters():
+    period_type = request.args.get('period', 'week')
+    if period_type not in PERIOD_TYPES:
+        period_type = 'week'
+    periods = min(max(request.args.get('periods', Config.ATTENDANCE_STATS_PERIODS, type=int), 1), 104)
+    grade = request.args.get('grade', '')
+    student_id = request.args.get('student_id', type=int)
+    since = default_since(period_type, periods)
+    return period_type, periods, since, grade, student_id
+
+
+def _pivot_attendance_stats(rows, key):
+    table = {}
+    for row in rows:
+        table.setdefault(row[key], {})[row['period_start']] = row
+    return table
+
+
+@bp.route('/attendance/stats')
+@login_required
+def attendance_stats():
+    period_type, periods, since, grade, student_id = _attendance_stats_filters()
+
+    grade_stats = grade_attendance_stats(current_user, period_type, since)
+    student_stats = []
+    if grade or student_id:
+        student_stats = student_attendance_stats(current_user, period_type, since, grade=grade, student_id=student_id)
+
+    period_starts = sorted({row['period_start'] for row in grade_stats})
+    student_names = {row['student_id']: row['student_name'] for row in student_stats}
+    all_grades = [
+        g for (g,) in scoped_students_query(current_user, Student.grade)
+        .where(Student.grade.is_null(False)).distinct().order_by(Student.grade).tuples()
+    ]
+
+    return render_template(
+        'attendance/attendance_stats.html',
+        title='Estatísticas de Frequência',
+        period_type=period_type,
+        periods=periods,
+        period_starts=period_starts,
+        grade_table=_pivot_attendance_stats(grade_stats, 'grade'),
+        student_table=_pivot_attendance_stats(student_stats, 'student_id'),
+        student_names=student_names,
+        all_grades=all_grades,
+        selected_grade=grade
+    )
+
+
+@bp.route('/attendance/stats/data')
+@login_required
+def attendance_stats_data():
+    period_type, periods, since, grade, student_id = _attendance_stats_filters()
+    data = {
+        'period': period_type,
+        'since': since.isoformat(),
+        'grades': grade_attendance_stats(current_user, period_type, since),
+    }
+    if grade or student_id:
+        data['students'] = student_attendance_stats(
+            current_user, period_type, since, grade=grade, student_id=student_id
+        )
+    return jsonify(data)
+
+
+@bp.route('/students/<int:student_id>/attendance/year')
+@login_required
+@conditional_get(lambda student_id: list_validators('Attendance', 'Student'))
+def student_attendance_year(student_id):
+    if not can_access_student(current_user, student_id):
+        return jsonify({'error': 'Aluno não encontrado.'}), 404
+    school_year = request.args.get('school_year', type=int) or AttendanceBitmap.locate(datetime.date.today())[0]
+    if not 1900 <= school_year <= 2999:
+        return jsonify({'error': 'Parâmetro school_year inválido.'}), 400
+    return jsonify(student_year(student_id, school_year))
+
+
+@bp.route('/attendance/grid/data')
+@login_required
+@conditional_get(lambda: list_validators('Attendance', 'Student'))
+def attendance_month_grid():
+    try:
+        month = datetime.datetime.strptime(request.args['month'], '%Y-%m') if request.args.get('month') else datetime.date.today()
+    except ValueError:
+        return jsonify({'error': 'Parâmetro month inválido (use AAAA-MM).'}), 400
+    return jsonify(month_grid(current_user, month.year, month.month, grade=request.args.get('grade') or None))
+
+
+@bp.route('/attendance/absences/data')
+@login_required
+@conditional_get(lambda: list_validators('Attendance', 'Student'))
+def attendance_absences():
+    try:
+        until = datetime.date.fromisoformat(request.args['until']) if request.args.get('until') else datetime.date.today()
+        since = datetime.date.fromisoformat(request.args['since']) if request.args.get('since') else None
+    except ValueError:
+        return jsonify({'error': 'Parâmetros since/until inválidos.'}), 400
+    since = since or datetime.date(AttendanceBitmap.locate(until)[0], Config.SCHOOL_YEAR_START_MONTH, 1)
+    if since > until:
+        return jsonify({'error': 'O parâmetro since deve ser anterior a until.'}), 400
+    min_absences = max(request.args.get('min', 1, type=int), 0)
+    return jsonify({
+        'since': since.isoformat(),
+        'until': until.isoformat(),
+        'students': absence_counts(current_user, since, until, grade=request.args.get('grade') or None,
+                                   min_absences=min_absences),
+    })
+
+
 @bp.route('/admin/users')
 @login_required
 @admin_required
+@conditional_get(lambda: list_validators('User'))
 def list_users():
     page = request.args.get('page', 1, type=int)
     per_page = Config.PAGINATION_PER_PAGE
@@ -679,7 +931,7 @@ def list_users():
     total_users = users_query.count()
     total_pages = (total_users + per_page - 1) // per_page
 
-    users = users_query.paginate(page, per_page)
+    users = user_rows(users_query.paginate(page, per_page))
 
     paginator = {
         'page': page,
@@ -777,8 +1029,89 @@ def delete_user(user_id):
     return redirect(url_for('main.list_users'))
 
 
+@bp.route('/admin/announcements', methods=['GET', 'POST'])
+@login_required
+@admin_required
+def send_announcement():
+    form = AnnouncementForm()
+    if form.validate_on_submit():
+        link = form.link.data or None
+        if form.audience.data == 'all':
+            sent = notify_all_users(form.message.data, link)
+        else:
+            sent = notify_role(form.audience.data, form.message.data, link)
+        flash(f'Aviso enviado para {sent} profissional(is).', 'success')
+        return redirect(url_for('main.send_announcement'))
+    return render_template('notifications/send_announcement.html', title='Enviar Aviso', form=form)
+
+
+@bp.route('/admin/analytics')
+@login_required
+@admin_required
+def analytics():
+    group_by = request.args.get('group_by', 'course')
+    if group_by not in GROUP_FIELDS:
+        group_by = 'course'
+
+    dates = {}
+    for name in ('since', 'until'):
+        value = request.args.get(name, '')
+        dates[name] = None
+        if value:
+            try:
+                dates[name] = datetime.datetime.strptime(value, '%Y-%m-%d').date()
+            except ValueError:
+                flash('Formato de data inválido. Use AAAA-MM-DD.', 'warning')
+
+    with reporting_database() as database:
+        attendance_rates = attendance_rate_distribution(group_by, dates['since'], dates['until'], database)
+        activity_types = activity_type_frequency(dates['since'], dates['until'], database)
+        workload = pedagogue_workload(dates['since'], dates['until'], database)
+
+    return render_template(
+        'analytics/analytics.html',
+        title='Análises',
+        group_by=group_by,
+        since=request.args.get('since', ''),
+        until=request.args.get('until', ''),
+        rate_bins=[f'{i * 100 // RATE_BIN_COUNT}-{(i + 1) * 100 // RATE_BIN_COUNT}%' for i in range(RATE_BIN_COUNT)],
+        attendance_rates=attendance_rates,
+        activity_types=activity_types,
+        workload=workload
+    )
+
+
+@bp.route('/admin/slow-queries')
+@login_required
+@admin_required
+def slow_queries():
+    order_by = request.args.get('order', 'total_ms')
+    if order_by not in ('total_ms', 'max_ms', 'count'):
+        order_by = 'total_ms'
+    store = db.slow_query_store
+    return render_template(
+        'analytics/slow_queries.html',
+        title='Consultas Lentas',
+        enabled=store is not None,
+        threshold_ms=Config.SLOW_QUERY_THRESHOLD_MS,
+        order_by=order_by,
+        queries=store.top(order_by) if store else []
+    )
+
+
+@bp.route('/admin/slow-queries/clear', methods=['POST'])
+@login_required
+@admin_required
+def clear_slow_queries():
+    if db.slow_query_store:
+        db.slow_query_store.clear()
+    flash('Registro de consultas lentas limpo.', 'success')
+    return redirect(url_for('main.slow_queries'))
+
+
 @bp.route('/general-reports')
 @login_required
+@conditional_get(lambda: list_validators('GeneralReport', 'Student', 'User'))
 def list_general_reports():
     page = request.args.get('page', 1, type=int)
     per_page = Config.PAGINATION_PER_PAGE
@@ -786,15 +1119,11 @@ def list_general_reports():
     selected_student_id = request.args.get('student_id', type=int)
     selected_date_str = request.args.get('date', '')
 
-    if current_user.role == 'admin':
-        reports_query = GeneralReport.select().order_by(GeneralReport.date.desc())
-        students = Student.select().order_by(Student.name)
-    else:
-        reports_query = GeneralReport.select().where(GeneralReport.pedagogue == current_user).order_by(GeneralReport.date.desc())
-        students = Student.select().where(Student.pedagogue == current_user).order_by(Student.name)
+    reports_query = scoped(GeneralReport.select(), GeneralReport, current_user).order_by(GeneralReport.date.desc())
+    students = student_options(scoped(Student.select(), Student, current_user))
 
     if selected_student_id:
-        reports_query = reports_query.where(GeneralReport.student.id == selected_student_id)
+        reports_query = reports_query.where(GeneralReport.student == selected_student_id)
     
     if selected_date_str:
         try:
@@ -806,7 +1135,7 @@ def list_general_reports():
     total_reports = reports_query.count()
     total_pages = (total_reports + per_page - 1) // per_page
     
-    reports = reports_query.paginate(page, per_page)
+    reports = general_report_rows(reports_query.paginate(page, per_page))
 
     paginator_args = {}
     if selected_student_id:
@@ -839,7 +1168,7 @@ def add_general_report():
     if form.validate_on_submit():
         try:
             student = Student.get_by_id(form.student_id.data)
-            if student.pedagogue != current_user and current_user.role != 'admin':
+            if not owns(current_user, student.pedagogue_id):
                 flash('Você não tem permissão para criar um relatório para este aluno.', 'danger')
                 return redirect(url_for('main.list_general_reports'))
 
@@ -867,9 +1196,10 @@ def add_general_report():
 
 @bp.route('/general-reports/<int:report_id>')
 @login_required
+@conditional_get(lambda report_id: row_validators(GeneralReport, report_id, 'Student', 'User'))
 def view_general_report(report_id):
     report = GeneralReport.get_or_none(GeneralReport.id == report_id)
-    if not report or (report.pedagogue != current_user and current_user.role != 'admin'):
+    if not report or not owns(current_user, report.pedagogue_id):
         flash('Relatório geral não encontrado ou você não tem permissão para visualizá-lo.', 'danger')
         return redirect(url_for('main.list_general_reports'))
 
@@ -889,7 +1219,7 @@ def edit_general_report(report_id):
         flash('Relatório geral não encontrado.', 'danger')
         return redirect(url_for('main.list_general_reports'))
 
-    if report.pedagogue != current_user and current_user.role != 'admin':
+    if not owns(current_user, report.pedagogue_id):
         flash('Você não tem permissão para editar este relatório.', 'danger')
         return redirect(url_for('main.list_general_reports'))
 
@@ -929,7 +1259,7 @@ def delete_general_report(report_id):
         flash('Relatório geral não encontrado.', 'danger')
         return redirect(url_for('main.list_general_reports'))
 
-    if report.pedagogue != current_user and current_user.role != 'admin':
+    if not owns(current_user, report.pedagogue_id):
         flash('Você não tem permissão para excluir este relatório.', 'danger')
         return redirect(url_for('main.list_general_reports'))
 
@@ -944,40 +1274,56 @@ def delete_general_report(report_id):
 
 @bp.route('/daily-reports')
 @login_required
+@conditional_get(lambda: list_validators('DailyReport', 'Student', 'User'))
 def list_daily_reports():
     page = request.args.get('page', 1, type=int)
     per_page = Config.PAGINATION_PER_PAGE
     
     selected_student_id = request.args.get('student_id', type=int)
     selected_date_str = request.args.get('date', '')
+    activity_choices_map = ActivityType.labels()
+    selected_activity = request.args.get('activity_type', '')
+    if selected_activity not in activity_choices_map:
+        selected_activity = ''
+    selected_shift = request.args.get('shift', '')
+    if selected_shift not in SHIFTS:
+        selected_shift = ''
 
-    if current_user.role == 'admin':
-        reports_query = DailyReport.select().order_by(DailyReport.date.desc())
-        students = Student.select().order_by(Student.name)
-    else:
-        reports_query = DailyReport.select().where(DailyReport.pedagogue == current_user).order_by(DailyReport.date.desc())
-        students = Student.select().where(Student.pedagogue == current_user).order_by(Student.name)
+    reports_query = scoped(DailyReport.select(), DailyReport, current_user).order_by(DailyReport.date.desc())
+    students = student_options(scoped(Student.select(), Student, current_user))
 
     if selected_student_id:
         reports_query = reports_query.where(DailyReport.student == selected_student_id)
+    if selected_activity:
+        reports_query = reports_query.where(DailyReport.activity_type == selected_activity)
+    if selected_shift:
+        reports_query = reports_query.where(DailyReport.shift.includes(selected_shift))
     
+    archived_reports = []
     if selected_date_str:
         try:
             selected_date = datetime.datetime.strptime(selected_date_str, '%Y-%m-%d').date()
             reports_query = reports_query.where(DailyReport.date == selected_date)
+            if reaches_archive(selected_date):
+                archived_reports = archived_daily_reports(current_user, selected_date, selected_student_id,
+                                                          selected_activity, selected_shift)
         except ValueError:
             flash('Formato de data inválido. Use AAAA-MM-DD.', 'warning')
 
     total_reports = reports_query.count()
     total_pages = (total_reports + per_page - 1) // per_page
     
-    reports = reports_query.paginate(page, per_page)
+    reports = daily_report_rows(reports_query.paginate(page, per_page))
 
     paginator_args = {}
     if selected_student_id:
         paginator_args['student_id'] = selected_student_id
     if selected_date_str:
         paginator_args['date'] = selected_date_str
+    if selected_activity:
+        paginator_args['activity_type'] = selected_activity
+    if selected_shift:
+        paginator_args['shift'] = selected_shift
 
     paginator = {
         'page': page,
@@ -985,8 +1331,6 @@ def list_daily_reports():
         'route': 'main.list_daily_reports',
         'args': paginator_args
     }
-    
-    activity_choices_map = {choice[0]: choice[1] for choice in Config.DAILY_LOG_ACTIVITY_CHOICES}
 
     return render_template(
         'daily_reports/list_daily_reports.html',
@@ -996,7 +1340,12 @@ def list_daily_reports():
         students=students,
         selected_student_id=selected_student_id,
         selected_date=selected_date_str,
-        activity_choices_map=activity_choices_map
+        activity_choices_map=activity_choices_map,
+        activity_choices=Config.DAILY_LOG_ACTIVITY_CHOICES,
+        shifts=SHIFTS,
+        selected_activity=selected_activity,
+        selected_shift=selected_shift,
+        archived_reports=archived_reports
     )
 
 @bp.route('/daily-reports/new', methods=['GET', 'POST'])
@@ -1007,7 +1356,7 @@ def add_daily_report():
     if form.validate_on_submit():
         try:
             student = Student.get_by_id(form.student_id.data)
-            if student.pedagogue != current_user and current_user.role != 'admin':
+            if not owns(current_user, student.pedagogue_id):
                 flash('Você não tem permissão para criar um diário para este aluno.', 'danger')
                 return redirect(url_for('main.list_daily_reports'))
 
@@ -1029,21 +1378,66 @@ def add_daily_report():
             flash(f'Erro ao adicionar relatório diário: {e}', 'danger')
     return render_template('daily_reports/add_daily_report.html', title='Novo Relatório Diário', form=form)
 
+
+@bp.route('/daily-reports/group/new', methods=['GET', 'POST'])
+@login_required
+@pedagogue_or_admin_required
+def add_group_daily_report():
+    form = GroupDailyReportForm()
+    student_names = dict(form.student_ids.choices)
+    if form.validate_on_submit():
+        student_ids = set(form.student_ids.data)
+        allowed = scoped_students_query(current_user, Student.id).where(Student.id.in_(list(student_ids))).count()
+        if allowed != len(student_ids):
+            flash('Você não tem permissão para criar um diário para um dos alunos selecionados.', 'danger')
+            return redirect(url_for('main.list_daily_reports'))
+
+        shared = {
+            'date': form.date.data,
+            'professional_role': form.professional_role.data,
+            'shift': ', '.join(form.shift.data),
+            'activity_type': form.activity_type.data,
+            'difficulties': form.difficulties.data,
+            'actions_taken': form.actions_taken.data,
+            'participants': form.participants.data,
+            'observations': form.observations.data,
+        }
+        overrides = {}
+        for entry in form.overrides:
+            fields = {name: entry[name].data for name in OVERRIDABLE_FIELDS if entry[name].data}
+            if entry.student_id.data in student_ids and fields:
+                overrides[entry.student_id.data] = fields
+        try:
+            _, report_ids = create_group_reports(
+                current_user, form.student_ids.data, shared, overrides, form.link_session.data
+            )
+            flash(f'{len(report_ids)} relatórios diários adicionados com sucesso!', 'success')
+            return redirect(url_for('main.list_daily_reports'))
+        except Exception as e:
+            flash(f'Erro ao adicionar relatórios diários: {e}', 'danger')
+    return render_template('daily_reports/add_group_daily_report.html', title='Atendimento em Grupo', form=form,
+                           student_names=student_names)
+
 @bp.route('/daily-reports/<int:report_id>')
 @login_required
+@conditional_get(lambda report_id: row_validators(DailyReport, report_id, 'Student', 'User'))
 def view_daily_report(report_id):
-    report = DailyReport.get_or_none(DailyReport.id == report_id)
-    if not report or (report.pedagogue != current_user and current_user.role != 'admin'):
+    archived = request.args.get('archived', 0, type=int) == 1
+    model = ArchivedDailyReport if archived else DailyReport
+    report = model.get_or_none(model.id == report_id)
+    if not report or not owns(current_user, report.pedagogue_id):
         flash('Relatório diário não encontrado ou você não tem permissão para visualizá-lo.', 'danger')
         return redirect(url_for('main.list_daily_reports'))
     
-    activity_choices_map = {choice[0]: choice[1] for choice in Config.DAILY_LOG_ACTIVITY_CHOICES}
+    activity_choices_map = ActivityType.labels()
 
     return render_template(
         'daily_reports/view_daily_report.html',
         title='Detalhes do Relatório Diário',
         report=report,
-        activity_choices_map=activity_choices_map
+        activity_choices_map=activity_choices_map,
+        archived=archived,
+        session_reports=session_reports(model, report)
     )
 
 
@@ -1055,7 +1449,7 @@ def edit_daily_report(report_id):
         flash('Relatório diário não encontrado.', 'danger')
         return redirect(url_for('main.list_daily_reports'))
 
-    if report.pedagogue != current_user and current_user.role != 'admin':
+    if not owns(current_user, report.pedagogue_id):
         flash('Você não tem permissão para editar este relatório.', 'danger')
         return redirect(url_for('main.list_daily_reports'))
 
@@ -1093,7 +1487,7 @@ def delete_daily_report(report_id):
         flash('Relatório diário não encontrado.', 'danger')
         return redirect(url_for('main.list_daily_reports'))
 
-    if report.pedagogue != current_user and current_user.role != 'admin':
+    if not owns(current_user, report.pedagogue_id):
         flash('Você não tem permissão para excluir este relatório.', 'danger')
         return redirect(url_for('main.list_daily_reports'))
 
@@ -1114,23 +1508,63 @@ def calendar():
 
 @bp.route('/calendar_api')
 @login_required
+@conditional_get(lambda: list_validators('Event'))
 def calendar_api():
-    events_query = Event.select()
-    if current_user.role != 'admin':
-        events_query = events_query.where(Event.pedagogue == current_user)
-    
+    events_query = scoped(Event.select(), Event, current_user)
+
+    window_start, window_end = calendar_window(request.args.get('start'), request.args.get('end'))
     events_data = []
-    for event in events_query:
+    for occurrence in events_in_window(events_query, window_start, window_end):
+        event = occurrence.event
+        if occurrence.original_start is None:
+            event_id = event.id
+            edit_url = url_for('main.edit_event', event_id=event.id)
+        else:
+            original_start = occurrence.original_start.isoformat()
+            event_id = f'{event.id}:{original_start}'
+            edit_url = url_for('main.edit_occurrence', event_id=event.id, original_start=original_start)
         events_data.append({
-            'id': event.id,
-            'title': event.title,
-            'start': event.start_time.isoformat(),
-            'end': event.end_time.isoformat(),
-            'description': event.description,
-            'allDay': False
+            'id': event_id,
+            'title': occurrence.title,
+            'start': occurrence.start_time.isoformat(),
+            'end': occurrence.end_time.isoformat(),
+            'description': occurrence.description,
+            'allDay': False,
+            'recurring': occurrence.original_start is not None,
+            'editUrl': edit_url
         })
     return jsonify(events_data)
 
+@bp.route('/calendar/free_slots')
+@login_required
+@conditional_get(lambda: list_validators('Event'))
+def calendar_free_slots():
+    pedagogue_id = request.args.get('pedagogue_id', type=int)
+    student_id = request.args.get('student_id', type=int)
+    if not pedagogue_id and not student_id:
+        pedagogue_id = current_user.id
+    if (pedagogue_id and not owns(current_user, pedagogue_id)) or (student_id and not can_access_student(current_user, student_id)):
+        return jsonify({'error': 'Você não tem permissão para consultar esta agenda.'}), 403
+
+    try:
+        start = datetime.date.fromisoformat(request.args['start']) if request.args.get('start') else datetime.date.today()
+        end = datetime.date.fromisoformat(request.args['end']) if request.args.get('end') else start + datetime.timedelta(days=6)
+    except ValueError:
+        return jsonify({'error': 'Parâmetros start/end inválidos.'}), 400
+    duration = request.args.get('duration', 60, type=int)
+    if end < start or (end - start).days >= Config.FREE_SLOTS_MAX_DAYS:
+        return jsonify({'error': f'O período deve ter entre 1 e {Config.FREE_SLOTS_MAX_DAYS} dias.'}), 400
+    if not 5 <= duration <= 24 * 60:
+        return jsonify({'error': 'Parâmetro duration inválido.'}), 400
+
+    slots = free_slots(start, end, datetime.timedelta(minutes=duration), pedagogue_id, student_id)
+    return jsonify({
+        'start': start.isoformat(),
+        'end': end.isoformat(),
+        'duration': duration,
+        'slots': [{'start': slot_start.isoformat(), 'end': slot_end.isoformat()} for slot_start, slot_end in slots]
+    })
+
 @bp.route('/calendar/new', methods=['GET', 'POST'])
 @login_required
 def add_event():
@@ -1155,7 +1589,7 @@ def add_event():
             student = None
             if form.student_id.data != 0:
                 student = Student.get_or_none(Student.id == form.student_id.data)
-                if not student or (student.pedagogue != current_user and current_user.role != 'admin'):
+                if not student or not owns(current_user, student.pedagogue_id):
                     flash(
                         'Aluno selecionado inválido ou você não tem permissão para'
                         ' relacionar o evento a este aluno.',
@@ -1163,14 +1597,23 @@ def add_event():
                     )
                     return render_template('calendar/add_event.html', title='Adicionar Evento', form=form)
 
-            Event.create(
+            event = Event(
                 title=form.title.data,
                 description=form.description.data,
                 start_time=form.start_time.data,
                 end_time=form.end_time.data,
                 student=student,
-                pedagogue=current_user
+                pedagogue=current_user,
+                **recurrence_fields(
+                    form.recurrence.data, form.recurrence_interval.data,
+                    form.recurrence_weekdays.data, form.recurrence_until.data
+                )
             )
+            conflicts = [] if form.allow_conflicts.data else event_conflicts(event)
+            if conflicts:
+                flash(describe_conflicts(conflicts), 'warning')
+                return render_template('calendar/add_event.html', title='Adicionar Evento', form=form, conflicts=conflicts)
+            event.save()
             flash('Evento adicionado com sucesso!', 'success')
             return redirect(url_for('main.calendar'))
         except Exception as e:
@@ -1181,21 +1624,29 @@ def add_event():
 @login_required
 def edit_event(event_id):
     event = Event.get_or_none(Event.id == event_id)
-    if not event or (event.pedagogue != current_user and current_user.role != 'admin'):
+    if not event or not owns(current_user, event.pedagogue_id):
         flash('Evento não encontrado ou você não tem permissão para editá-lo.', 'danger')
         return redirect(url_for('main.calendar'))
 
     form = EventForm(obj=event)
+    if request.method == 'GET':
+        form.recurrence.data = event.recurrence or ''
+        form.recurrence_weekdays.data = parse_weekdays(event.recurrence_weekdays)
+    previous_rule = recurrence_key(event)
     if request.is_json:
         data = request.get_json()
+        event.start_time = parse_client_datetime(data.get('start_time'))
+        event.end_time = parse_client_datetime(data.get('end_time'))
+        error = event_interval_error(event.start_time, event.end_time)
+        if error:
+            return jsonify({'status': 'error', 'message': error}), 400
+        conflicts = [] if data.get('allow_conflicts') else event_conflicts(event)
+        if conflicts:
+            return _conflict_response(conflicts)
         try:
-            event.start_time = datetime.datetime.fromisoformat(
-                data['start_time'].replace('Z', '+00:00')
-            )
-            event.end_time = datetime.datetime.fromisoformat(
-                data['end_time'].replace('Z', '+00:00')
-            )
             event.save()
+            if recurrence_key(event) != previous_rule:
+                clear_exceptions(event)
             return jsonify({'status': 'success'})
         except Exception as e:
             return jsonify({'status': 'error', 'message': str(e)}), 500
@@ -1205,20 +1656,33 @@ def edit_event(event_id):
             student = None
             if form.student_id.data != 0:
                 student = Student.get_or_none(Student.id == form.student_id.data)
-                if not student or (student.pedagogue != current_user and current_user.role != 'admin'):
+                if not student or not owns(current_user, student.pedagogue_id):
                     flash(
                         'Aluno selecionado inválido ou você não tem permissão para'
                         ' relacionar o evento a este aluno.',
                         'danger'
                     )
                     return render_template('calendar/edit_event.html', title='Editar Evento', form=form, event=event)
-            
+
             event.title = form.title.data
             event.description = form.description.data
             event.start_time = form.start_time.data
             event.end_time = form.end_time.data
             event.student = student
+            for name, value in recurrence_fields(
+                form.recurrence.data, form.recurrence_interval.data,
+                form.recurrence_weekdays.data, form.recurrence_until.data
+            ).items():
+                setattr(event, name, value)
+            conflicts = [] if form.allow_conflicts.data else event_conflicts(event)
+            if conflicts:
+                flash(describe_conflicts(conflicts), 'warning')
+                return render_template('calendar/edit_event.html', title='Editar Evento', form=form, event=event,
+                                       conflicts=conflicts)
             event.save()
+            # Exceptions refer to occurrences of the old rule.
+            if recurrence_key(event) != previous_rule:
+                clear_exceptions(event)
             flash('Evento atualizado com sucesso!', 'success')
             return redirect(url_for('main.calendar'))
         except Exception as e:
@@ -1229,12 +1693,132 @@ def edit_event(event_id):
 @login_required
 def delete_event(event_id):
     event = Event.get_or_none(Event.id == event_id)
-    if not event or (event.pedagogue != current_user and current_user.role != 'admin'):
+    if not event or not owns(current_user, event.pedagogue_id):
         flash('Evento não encontrado ou você não tem permissão para excluí-lo.', 'danger')
     else:
         try:
-            event.delete_instance()
+            event.delete_instance(recursive=True)
             flash('Evento excluído com sucesso!', 'success')
         except Exception as e:
             flash(f'Erro ao excluir evento: {e}', 'danger')
     return redirect(url_for('main.calendar'))
+
+
+def _conflict_response(conflicts):
+    return jsonify({
+        'status': 'conflict',
+        'message': describe_conflicts(conflicts),
+        'conflicts': [{
+            'event_id': occurrence.event.id,
+            'title': occurrence.title,
+            'start': occurrence.start_time.isoformat(),
+            'end': occurrence.end_time.isoformat()
+        } for occurrence in conflicts]
+    }), 409
+
+
+def _get_occurrence(event_id, original_start):
+    event = Event.get_or_none(Event.id == event_id)
+    if not event or not owns(current_user, event.pedagogue_id) or not event.recurrence:
+        return None, None
+    try:
+        original_start = datetime.datetime.fromisoformat(original_start)
+    except ValueError:
+        return None, None
+    if not is_occurrence(event, original_start):
+        return None, None
+    return event, original_start
+
+
+@bp.route('/calendar/<int:event_id>/occurrences/<original_start>/edit', methods=['GET', 'POST'])
+@login_required
+def edit_occurrence(event_id, original_start):
+    event, original_start = _get_occurrence(event_id, original_start)
+    if not event:
+        if request.is_json:
+            return jsonify({'status': 'error', 'message': 'Ocorrência não encontrada.'}), 404
+        flash('Ocorrência não encontrada ou você não tem permissão para editá-la.', 'danger')
+        return redirect(url_for('main.calendar'))
+
+    if request.is_json:
+        data = request.get_json()
+        start_time = parse_client_datetime(data.get('start_time'))
+        end_time = parse_client_datetime(data.get('end_time'))
+        error = event_interval_error(start_time, end_time)
+        if error:
+            return jsonify({'status': 'error', 'message': error}), 400
+        conflicts = [] if data.get('allow_conflicts') else interval_conflicts(
+            start_time, end_time, event.pedagogue_id, event.student_id, exclude_event_id=event.id
+        )
+        if conflicts:
+            return _conflict_response(conflicts)
+        try:
+            save_exception(event, original_start, start_time=start_time, end_time=end_time)
+            return jsonify({'status': 'success'})
+        except Exception as e:
+            return jsonify({'status': 'error', 'message': str(e)}), 500
+
+    exception = event.exceptions.where(EventException.original_start == original_start).first()
+    form = OccurrenceForm()
+    if request.method == 'GET':
+        form.title.data = (exception and exception.title) or event.title
+        form.description.data = exception.description if exception and exception.description is not None else event.description
+        form.start_time.data = (exception and exception.start_time) or original_start
+        form.end_time.data = (exception and exception.end_time) or original_start + (event.end_time - event.start_time)
+
+    conflicts = []
+    if form.validate_on_submit():
+        if not form.allow_conflicts.data:
+            conflicts = interval_conflicts(
+                form.start_time.data, form.end_time.data, event.pedagogue_id, event.student_id, exclude_event_id=event.id
+            )
+        if conflicts:
+            flash(describe_conflicts(conflicts), 'warning')
+        else:
+            try:
+                save_exception(
+                    event, original_start,
+                    cancelled=False,
+                    title=form.title.data,
+                    description=form.description.data,
+                    start_time=form.start_time.data,
+                    end_time=form.end_time.data
+                )
+                flash('Ocorrência atualizada com sucesso!', 'success')
+                return redirect(url_for('main.calendar'))
+            except Exception as e:
+                flash(f'Erro ao atualizar ocorrência: {e}', 'danger')
+    return render_template('calendar/edit_occurrence.html', title='Editar Ocorrência', form=form,
+                           event=event, original_start=original_start, conflicts=conflicts)
+
+
+@bp.route('/calendar/<int:event_id>/occurrences/<original_start>/cancel', methods=['POST'])
+@login_required
+def cancel_occurrence(event_id, original_start):
+    event, original_start = _get_occurrence(event_id, original_start)
+    if not event:
+        flash('Ocorrência não encontrada ou você não tem permissão para cancelá-la.', 'danger')
+    else:
+        try:
+            save_exception(event, original_start, cancelled=True)
+            flash('Ocorrência cancelada com sucesso!', 'success')
+        except Exception as e:
+            flash(f'Erro ao cancelar ocorrência: {e}', 'danger')
+    return redirect(url_for('main.calendar'))
+
+
+@bp.route('/changes')
+@login_required
+def list_changes():
+    since = parse_since(request.args.get('since', '').strip())
+    if since is None:
+        return jsonify({'error': 'Parâmetro since inválido.'}), 400
+    limit = min(max(request.args.get('limit', 500, type=int), 1), 1000)
+    changes, next_since, has_more = changes_since(current_user, *since, limit=limit)
+    return jsonify({'changes': changes, 'next_since': next_since, 'has_more': has_more})
+
+
+@bp.route('/sync')
+@login_required
+def sync_replica():
+    return jsonify(sync(current_user, request.args.get('token')))
@@ -0,0 +1,256 @@
+import datetime
+
+from peewee import chunked, fn
+
+from app.models import db, Attendance, ChangeLog, DailyReport, Event, Notification, SchedulerState, Student
+from app.notification_utils import purge_read_notifications
+from app.backup import refresh_reporting_snapshot
+from app.maintenance import run_maintenance
+from app.recurrence import expand
+from config import Config
+
+
+NOTIFICATION_BATCH_SIZE = 500
+
+
+def _job_state(job):
+    state, _ = SchedulerState.get_or_create(job=job)
+    return state
+
+
+def _insert_notifications(rows):
+    for batch in chunked(rows, NOTIFICATION_BATCH_SIZE):
+        Notification.insert_many(batch).execute()
+    return len(rows)
+
+
+def _last_change_id():
+    return ChangeLog.select(fn.MAX(ChangeLog.id)).scalar() or 0
+
+
+def send_event_reminders(now=None):
+    # Each run covers the start times between the end of the previous
+    # window and now + lead, plus events created or changed inside a window
+    # that was already covered. The state is updated in the same write
+    # transaction, so running twice never sends a reminder twice. Recurring
+    # events are expanded over the new window only.
+    now = now or datetime.datetime.now()
+    until = now + datetime.timedelta(minutes=Config.EVENT_REMINDER_LEAD_MINUTES)
+    with db.atomic('IMMEDIATE'):
+        state = _job_state('event_reminders')
+        covered_until = max(state.covered_until or now, now)
+        last_change_id = _last_change_id()
+
+        condition = (Event.start_time > covered_until) & (Event.start_time <= until)
+        if state.last_change_id is not None and last_change_id > state.last_change_id:
+            changed = ChangeLog.select(ChangeLog.row_id).where(
+                (ChangeLog.model == 'Event') &
+                (ChangeLog.id > state.last_change_id) &
+                (ChangeLog.operation != 'delete')
+            )
+            condition |= (
+                (Event.start_time > now) & (Event.start_time <= covered_until) & Event.id.in_(changed)
+            )
+        events = (Event
+                  .select(Event.id, Event.title, Event.start_time, Event.pedagogue)
+                  .where(condition & Event.pedagogue.is_null(False) & Event.recurrence.is_null())
+                  .order_by(Event.start_time))
+        reminders = [(event.pedagogue_id, event.title, event.start_time) for event in events]
+        for occurrence in expand(Event.select().where(Event.pedagogue.is_null(False)),
+                                 covered_until, until + datetime.timedelta(microseconds=1)):
+            if covered_until < occurrence.start_time <= until:
+                reminders.append((occurrence.event.pedagogue_id, occurrence.title, occurrence.start_time))
+        rows = [{
+            'recipient': pedagogue_id,
+            'message': f'Lembrete: "{title}" começa às {start_time:%H:%M} de {start_time:%d/%m/%Y}.',
+            'link': '/calendar',
+            'timestamp': now,
+        } for pedagogue_id, title, start_time in reminders]
+        sent = _insert_notifications(rows)
+
+        state.covered_until = max(until, covered_until)
+        state.last_change_id = last_change_id
+        state.last_run_at = now
+        state.save()
+    return sent
+
+
+def previous_school_day(date):
+    date -= datetime.timedelta(days=1)
+    while date.weekday() >= 5:
+        date -= datetime.timedelta(days=1)
+    return date
+
+
+def _counts_by_pedagogue(query):
+    return dict(query.tuples())
+
+
+def _count_occurrences(counts, occurrences):
+    for occurrence in occurrences:
+        pedagogue_id = occurrence.event.pedagogue_id
+        counts[pedagogue_id] = counts.get(pedagogue_id, 0) + 1
+
+
+def send_daily_digests(now=None):
+    # One notification per pedagogue on school days, after DAILY_DIGEST_HOUR:
+    # students with no attendance mark on the previous school day, events
+    # on that day whose student has no daily report, and today's events.
+    now = now or datetime.datetime.now()
+    today = now.date()
+    if today.weekday() >= 5 or now.hour < Config.DAILY_DIGEST_HOUR:
+        return 0
+    day = previous_school_day(today)
+    day_start = datetime.datetime.combine(day, datetime.time())
+    today_start = datetime.datetime.combine(today, datetime.time())
+
+    with db.atomic('IMMEDIATE'):
+        state = _job_state('daily_digest')
+        if state.covered_until is not None and state.covered_until >= today_start:
+            return 0
+
+        missing_attendance = _counts_by_pedagogue(
+            Student.select(Student.pedagogue, fn.COUNT(Student.id))
+            .where(Student.pedagogue.is_null(False) & ~fn.EXISTS(
+                Attendance.select(Attendance.id).where((Attendance.student == Student.id) & (Attendance.date == day))
+            ))
+            .group_by(Student.pedagogue)
+        )
+        pending_reports = _counts_by_pedagogue(
+            Event.select(Event.pedagogue, fn.COUNT(Event.id))
+            .where(
+                (Event.start_time >= day_start) & (Event.start_time < today_start) &
+                Event.pedagogue.is_null(False) & Event.student.is_null(False) & Event.recurrence.is_null() &
+                ~fn.EXISTS(
+                    DailyReport.select(DailyReport.id)
+                    .where((DailyReport.student == Event.student) & (DailyReport.date == day))
+                )
+            )
+            .group_by(Event.pedagogue)
+        )
+        events_today = _counts_by_pedagogue(
+            Event.select(Event.pedagogue, fn.COUNT(Event.id))
+            .where(
+                (Event.start_time >= today_start) &
+                (Event.start_time < today_start + datetime.timedelta(days=1)) &
+                Event.pedagogue.is_null(False) & Event.recurrence.is_null()
+            )
+            .group_by(Event.pedagogue)
+        )
+
+        recurring = Event.select().where(Event.pedagogue.is_null(False))
+        occurrences = [
+            occurrence for occurrence in expand(recurring.where(Event.student.is_null(False)), day_start, today_start)
+            if occurrence.start_time >= day_start
+        ]
+        reported = {
+            student_id for student_id, in DailyReport.select(DailyReport.student)
+            .where(DailyReport.student.in_({occurrence.event.student_id for occurrence in occurrences}) &
+                   (DailyReport.date == day))
+            .tuples()
+        } if occurrences else set()
+        _count_occurrences(pending_reports, [
+            occurrence for occurrence in occurrences if occurrence.event.student_id not in reported
+        ])
+        _count_occurrences(events_today, [
+            occurrence for occurrence in expand(recurring, today_start, today_start + datetime.timedelta(days=1))
+            if occurrence.start_time >= today_start
+        ])
+
+        rows = []
+        for pedagogue_id in sorted(set(missing_attendance) | set(pending_reports) | set(events_today)):
+            parts = []
+            if missing_attendance.get(pedagogue_id):
+                parts.append(f'{missing_attendance[pedagogue_id]} aluno(s) sem frequência em {day:%d/%m}')
+            if pending_reports.get(pedagogue_id):
+                parts.append(f'{pending_reports[pedagogue_id]} relatório(s) diário(s) pendente(s)')
+            if events_today.get(pedagogue_id):
+                parts.append(f'{events_today[pedagogue_id]} evento(s) hoje')
+            rows.append({
+                'recipient': pedagogue_id,
+                'message': 'Resumo do dia: ' + ', '.join(parts) + '.',
+                'link': '/attendance/mark' if missing_attendance.get(pedagogue_id) else '/calendar',
+                'timestamp': now,
+            })
+        sent = _insert_notifications(rows)
+
+        state.covered_until = today_start
+        state.last_run_at = now
+        state.save()
+    return sent
+
+
+def purge_notifications_daily(now=None):
+    now = now or datetime.datetime.now()
+    today_start = datetime.datetime.combine(now.date(), datetime.time())
+    with db.atomic('IMMEDIATE'):
+        state = _job_state('notification_purge')
+        if state.covered_until is not None and state.covered_until >= today_start:
+            return 0
+        purged = purge_read_notifications()
+        state.covered_until = today_start
+        state.last_run_at = now
+        state.save()
+    return purged
+
+
+def refresh_reporting_snapshot_periodically(now=None):
+    # The run is claimed in a write transaction, so two schedulers do not
+    # both copy the database; the copy itself runs outside of it.
+    if not Config.REPORTING_USE_SNAPSHOT:
+        return 0
+    now = now or datetime.datetime.now()
+    with db.atomic('IMMEDIATE'):
+        state = _job_state('reporting_snapshot')
+        interval = datetime.timedelta(seconds=Config.REPORTING_SNAPSHOT_INTERVAL)
+        if state.last_run_at is not None and state.last_run_at + interval > now:
+            return 0
+        state.last_run_at = now
+        state.save()
+    refresh_reporting_snapshot()
+    return 1
+
+
+def in_maintenance_window(now):
+    start, end = Config.MAINTENANCE_WINDOW_START_HOUR, Config.MAINTENANCE_WINDOW_END_HOUR
+    if start <= end:
+        return start <= now.hour < end
+    return now.hour >= start or now.hour < end
+
+
+def run_maintenance_daily(now=None):
+    # Once a day, inside the maintenance window. Returns the pages given
+    # back to the file system.
+    now = now or datetime.datetime.now()
+    if not in_maintenance_window(now):
+        return 0
+    today_start = datetime.datetime.combine(now.date(), datetime.time())
+    with db.atomic('IMMEDIATE'):
+        state = _job_state('db_maintenance')
+        if state.covered_until is not None and state.covered_until >= today_start:
+            return 0
+        state.covered_until = today_start
+        state.last_run_at = now
+        state.save()
+    results = run_maintenance(Config.MAINTENANCE_VACUUM_PAGES)
+    return sum(result['freed_pages'] for result in results.values())
+
+
+SCHEDULED_JOBS = (
+    ('event_reminders', send_event_reminders),
+    ('daily_digest', send_daily_digests),
+    ('notification_purge', purge_notifications_daily),
+    ('reporting_snapshot', refresh_reporting_snapshot_periodically),
+    ('db_maintenance', run_maintenance_daily),
+)
+
+
+def run_due_jobs(now=None):
+    results = {}
+    for name, job in SCHEDULED_JOBS:
+        try:
+            results[name] = job(now)
+        except Exception as e:
+            print(f"Error running scheduled job {name}: {e}")
+            results[name] = None
+    return results
@@ -0,0 +1,66 @@
+from flask import g, has_app_context
+from peewee import JOIN
+
+from app.models import Student, Attendance, ArchivedAttendance
+
+
+# Admins see every row; everyone else sees the rows they own: their students,
+# the attendance of those students, and the reports, observations and
+# events they wrote. Ownership is decided on the raw pedagogue_id/student_id
+# columns, so no related row is loaded to check it.
+
+def is_admin(user):
+    return user.role == 'admin'
+
+
+def student_scope(user):
+    return None if is_admin(user) else user.id
+
+
+def scoped_students_query(user, *fields):
+    query = Student.select(*fields)
+    scope = student_scope(user)
+    if scope is not None:
+        query = query.where(Student.pedagogue == scope)
+    return query
+
+
+def student_ids(user):
+    # Ids of the user's students, loaded at most once per request. Saving or
+    # deleting a student drops it (see invalidate_student_choices).
+    if not has_app_context():
+        return frozenset(student_id for student_id, in scoped_students_query(user, Student.id).tuples())
+    cache = g.setdefault('scoped_student_ids', {})
+    if user.id not in cache:
+        cache[user.id] = frozenset(student_id for student_id, in scoped_students_query(user, Student.id).tuples())
+    return cache[user.id]
+
+
+def scoped(query, model, user, ordered=False):
+    # Restricts a query on `model` to the rows `user` can see. Attendance has
+    # no pedagogue column and is joined to its student, whose pedagogue_id
+    # is compared. SQLite is free to start from the user's students unless
+    # `ordered` is set: a page read in the order of an attendance index
+    # (the date list) then CROSS JOINs the student, which keeps attendance
+    # as the outer loop, so the page comes off the index without sorting
+    # every row of the user's students.
+    if is_admin(user):
+        return query
+    if model is Student:
+        return query.where(Student.pedagogue == user.id)
+    if model in (Attendance, ArchivedAttendance):
+        owner = Student.alias('owner')
+        if ordered:
+            query = query.join(owner, JOIN.CROSS).where(model.student == owner.id)
+        else:
+            query = query.join(owner, on=(model.student == owner.id))
+        return query.switch(model).where(owner.pedagogue == user.id)
+    return query.where(model.pedagogue == user.id)
+
+
+def owns(user, pedagogue_id):
+    return is_admin(user) or pedagogue_id == user.id
+
+
+def can_access_student(user, student_id):
+    return is_admin(user) or student_id in student_ids(user)
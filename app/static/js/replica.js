@@ -0,0 +1,128 @@
+// Local IndexedDB copy of the user's students, events and recent reports.
+// It is filled from a snapshot of /sync and then kept up to date with the
+// deltas that follow the stored sync token. Loaded by the service worker
+// (which runs the sync) and by the offline page (which reads it).
+const REPLICA_DB_NAME = 'clai-replica';
+const REPLICA_STORES = ['Student', 'Event', 'DailyReport', 'GeneralReport'];
+const REPLICA_REPORT_STORES = ['DailyReport', 'GeneralReport'];
+const SYNC_URL = '/sync';
+
+function openReplica() {
+  return new Promise((resolve, reject) => {
+    const request = indexedDB.open(REPLICA_DB_NAME, 1);
+    request.onupgradeneeded = () => {
+      const db = request.result;
+      REPLICA_STORES.forEach(name => {
+        const store = db.createObjectStore(name, { keyPath: 'id' });
+        if (REPLICA_REPORT_STORES.includes(name)) {
+          store.createIndex('date', 'date');
+        }
+      });
+      db.createObjectStore('meta');
+    };
+    request.onsuccess = () => resolve(request.result);
+    request.onerror = () => reject(request.error);
+  });
+}
+
+function replicaRequest(request) {
+  return new Promise((resolve, reject) => {
+    request.onsuccess = () => resolve(request.result);
+    request.onerror = () => reject(request.error);
+  });
+}
+
+function replicaTransactionDone(tx) {
+  return new Promise((resolve, reject) => {
+    tx.oncomplete = () => resolve();
+    tx.onerror = tx.onabort = () => reject(tx.error);
+  });
+}
+
+function applySyncPayload(db, payload) {
+  const tx = db.transaction([...REPLICA_STORES, 'meta'], 'readwrite');
+  if (payload.reset) {
+    REPLICA_STORES.forEach(name => tx.objectStore(name).clear());
+  }
+  Object.entries(payload.upserts).forEach(([name, table]) => {
+    const store = tx.objectStore(name);
+    table.rows.forEach(row => {
+      const record = {};
+      table.fields.forEach((field, i) => { record[field] = row[i]; });
+      store.put(record);
+    });
+  });
+  Object.entries(payload.deletes).forEach(([name, ids]) => {
+    const store = tx.objectStore(name);
+    ids.forEach(id => store.delete(id));
+  });
+  // Reports drop out of the synced window as days go by without changing.
+  REPLICA_REPORT_STORES.forEach(name => {
+    tx.objectStore(name).index('date').openCursor(IDBKeyRange.upperBound(payload.reports_since, true))
+      .onsuccess = (event) => {
+        const cursor = event.target.result;
+        if (cursor) {
+          cursor.delete();
+          cursor.continue();
+        }
+      };
+  });
+  tx.objectStore('meta').put(payload.token, 'token');
+  tx.objectStore('meta').put(new Date().toISOString(), 'synced_at');
+  return replicaTransactionDone(tx);
+}
+
+async function runReplicaSync() {
+  const db = await openReplica();
+  try {
+    let payload;
+    do {
+      const token = await replicaRequest(db.transaction('meta').objectStore('meta').get('token'));
+      const url = token ? `${SYNC_URL}?token=${encodeURIComponent(token)}` : SYNC_URL;
+      const response = await fetch(url, { credentials: 'same-origin', headers: { 'Accept': 'application/json' } });
+      // Logged out requests are redirected to the login page.
+      if (!response.ok || response.redirected) {
+        return;
+      }
+      payload = await response.json();
+      await applySyncPayload(db, payload);
+    } while (payload.has_more);
+  } finally {
+    db.close();
+  }
+}
+
+let replicaSyncInFlight = null;
+
+function syncReplica() {
+  if (!replicaSyncInFlight) {
+    replicaSyncInFlight = runReplicaSync().finally(() => { replicaSyncInFlight = null; });
+  }
+  return replicaSyncInFlight;
+}
+
+async function clearReplica() {
+  const db = await openReplica();
+  try {
+    const tx = db.transaction([...REPLICA_STORES, 'meta'], 'readwrite');
+    [...REPLICA_STORES, 'meta'].forEach(name => tx.objectStore(name).clear());
+    await replicaTransactionDone(tx);
+  } finally {
+    db.close();
+  }
+}
+
+async function readReplica() {
+  const db = await openReplica();
+  try {
+    const tx = db.transaction([...REPLICA_STORES, 'meta']);
+    const data = {};
+    for (const name of REPLICA_STORES) {
+      data[name] = await replicaRequest(tx.objectStore(name).getAll());
+    }
+    data.syncedAt = await replicaRequest(tx.objectStore('meta').get('synced_at'));
+    return data;
+  } finally {
+    db.close();
+  }
+}
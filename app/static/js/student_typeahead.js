@@ -0,0 +1,51 @@
+function setupStudentTypeahead(container) {
+    const searchUrl = container.dataset.searchUrl;
+    const emptyValue = container.dataset.emptyValue || '';
+    const textInput = container.querySelector('[data-typeahead-input]');
+    const hiddenInput = container.querySelector('input[type="hidden"]');
+    const dataList = container.querySelector('datalist');
+    const optionIds = new Map();
+    let debounceTimer;
+
+    function optionLabel(student) {
+        return `${student.name} (${student.matricula})`;
+    }
+
+    async function search(query) {
+        try {
+            const response = await fetch(`${searchUrl}?q=${encodeURIComponent(query)}`);
+            if (!response.ok) {
+                console.error('Failed to search students:', response.statusText);
+                return;
+            }
+            const students = await response.json();
+            dataList.innerHTML = '';
+            optionIds.clear();
+            students.forEach(student => {
+                const option = document.createElement('option');
+                option.value = optionLabel(student);
+                dataList.appendChild(option);
+                optionIds.set(option.value, student.id);
+            });
+        } catch (error) {
+            console.error('Error searching students:', error);
+        }
+    }
+
+    textInput.addEventListener('input', () => {
+        const value = textInput.value.trim();
+        if (optionIds.has(textInput.value)) {
+            hiddenInput.value = optionIds.get(textInput.value);
+            return;
+        }
+        hiddenInput.value = emptyValue;
+        clearTimeout(debounceTimer);
+        if (value.length >= 2) {
+            debounceTimer = setTimeout(() => search(value), 250);
+        }
+    });
+}
+
+document.addEventListener('DOMContentLoaded', () => {
+    document.querySelectorAll('[data-student-typeahead]').forEach(setupStudentTypeahead);
+});
@@ -1,10 +1,16 @@
-const CACHE_NAME = 'clai-app-cache-v2'; // Bump version
+importScripts('/static/js/replica.js');
+
+const CACHE_NAME = 'clai-app-cache-v4'; // Bump version
 const OFFLINE_URL = '/offline';
+const LOGOUT_URL = '/logout';
+const REPLICA_SYNC_TAG = 'clai-replica';
+const REPLICA_SYNC_INTERVAL = 60 * 1000;
 const ASSETS_TO_CACHE = [
   '/',
   '/login',
   OFFLINE_URL,
   '/static/css/style.css',
+  '/static/js/replica.js',
   '/static/img/logo-clai.jpeg',
   '/static/img/favicon.ico',
   '/static/img/android-chrome-192x192.png',
@@ -41,9 +47,49 @@ self.addEventListener('activate', (event) => {
   );
 });
 
+let lastReplicaSync = 0;
+
+function syncReplicaIfStale(force) {
+  if (!force && Date.now() - lastReplicaSync < REPLICA_SYNC_INTERVAL) {
+    return Promise.resolve();
+  }
+  lastReplicaSync = Date.now();
+  return syncReplica().catch(err => console.warn('Replica sync failed:', err));
+}
+
+// Pages ask for a sync when they load; the browser may also wake the
+// worker for a background or periodic sync.
+self.addEventListener('message', (event) => {
+  if (event.data && event.data.type === 'sync-replica') {
+    event.waitUntil(syncReplicaIfStale(event.data.force));
+  }
+});
+
+self.addEventListener('sync', (event) => {
+  if (event.tag === REPLICA_SYNC_TAG) {
+    event.waitUntil(syncReplicaIfStale(true));
+  }
+});
+
+self.addEventListener('periodicsync', (event) => {
+  if (event.tag === REPLICA_SYNC_TAG) {
+    event.waitUntil(syncReplicaIfStale(true));
+  }
+});
+
 self.addEventListener('fetch', (event) => {
+  const url = new URL(event.request.url);
+  // Writes and sync pulls always go to the network untouched.
+  if (event.request.method !== 'GET' || url.pathname === SYNC_URL) {
+    return;
+  }
+
   // Handle navigation requests
   if (event.request.mode === 'navigate') {
+    if (url.pathname === LOGOUT_URL) {
+      // The replica belongs to the user who is leaving.
+      event.waitUntil(clearReplica().catch(err => console.warn('Failed to clear replica:', err)));
+    }
     event.respondWith(
       fetch(event.request)
         .catch(() => {
@@ -0,0 +1,231 @@
+import csv
+import datetime
+import re
+import unicodedata
+from collections import namedtuple
+
+from peewee import EXCLUDED, fn
+
+from app.models import db, User, Student
+from app.forms import MATRICULA_PATTERN, validate_cpf_number, validate_email_address
+from app.cache_utils import invalidate_student_choices, bump_model_version
+from config import Config
+
+
+# Header of the roster export (compared without accents, case or
+# punctuation, see normalize_header) -> Student field.
+COLUMNS = {
+    'matricula': 'matricula',
+    'nome': 'name',
+    'nome_do_aluno': 'name',
+    'data_nascimento': 'dob',
+    'data_de_nascimento': 'dob',
+    'nascimento': 'dob',
+    'cid': 'cid',
+    'email': 'email',
+    'e_mail': 'email',
+    'email_academico': 'email',
+    'telefone': 'phone',
+    'turma': 'grade',
+    'curso': 'course',
+    'responsavel': 'responsible_name',
+    'nome_responsavel': 'responsible_name',
+    'nome_do_responsavel': 'responsible_name',
+    'telefone_responsavel': 'responsible_phone',
+    'telefone_do_responsavel': 'responsible_phone',
+    'email_responsavel': 'responsible_email',
+    'email_do_responsavel': 'responsible_email',
+    'cpf_responsavel': 'responsible_cpf',
+    'cpf_do_responsavel': 'responsible_cpf',
+    'necessidades_especificas': 'specific_needs_description',
+    'pedagogo': 'pedagogue',
+}
+REQUIRED_FIELDS = ('matricula', 'name', 'dob')
+LABELS = {'matricula': 'Matrícula', 'name': 'Nome', 'dob': 'Data de Nascimento'}
+# Same limits as StudentForm.
+MAX_LENGTHS = {
+    'email': ('E-mail', 120),
+    'cid': ('CID', 50),
+    'phone': ('Telefone', 20),
+    'grade': ('Turma', 20),
+    'course': ('Curso', 50),
+    'responsible_name': ('Nome do Responsável', 100),
+    'responsible_phone': ('Contato do Responsável', 20),
+}
+DATE_FORMATS = ('%Y-%m-%d', '%d/%m/%Y')
+MATRICULA_RE = re.compile(MATRICULA_PATTERN)
+
+RowError = namedtuple('RowError', 'line matricula message')
+
+
+def normalize_header(header):
+    text = unicodedata.normalize('NFKD', header or '').encode('ascii', 'ignore').decode('ascii')
+    return re.sub(r'[^a-z0-9]+', '_', text.lower()).strip('_')
+
+
+def _parse_date(value):
+    for date_format in DATE_FORMATS:
+        try:
+            return datetime.datetime.strptime(value, date_format).date()
+        except ValueError:
+            pass
+    return None
+
+
+def _pedagogue_lookup():
+    # The pedagogo column holds the e-mail or the CPF (username) of a user.
+    lookup = {}
+    for user_id, username, email in User.select(User.id, User.username, User.email).tuples():
+        lookup[email.lower()] = user_id
+        lookup[username] = user_id
+        lookup[''.join(filter(str.isdigit, username))] = user_id
+    return lookup
+
+
+def _validate(record, pedagogues):
+    errors = []
+    if not record.get('matricula') or not MATRICULA_RE.match(record['matricula']):
+        errors.append('Matrícula inválida. Deve ter 12 dígitos e iniciar com o ano.')
+    if not record.get('name') or not 2 <= len(record['name']) <= 100:
+        errors.append('Nome é obrigatório (2 a 100 caracteres).')
+    dob = _parse_date(record['dob']) if record.get('dob') else None
+    if dob is None:
+        errors.append('Data de nascimento inválida (use AAAA-MM-DD ou DD/MM/AAAA).')
+    record['dob'] = dob
+    for name, (label, limit) in MAX_LENGTHS.items():
+        if record.get(name) and len(record[name]) > limit:
+            errors.append(f'{label} deve ter no máximo {limit} caracteres.')
+    if record.get('email') and not validate_email_address(record['email']):
+        errors.append('Email inválido.')
+    if record.get('responsible_email') and not validate_email_address(record['responsible_email']):
+        errors.append('E-mail do Responsável inválido.')
+    cpf = record.get('responsible_cpf')
+    if cpf and (not 11 <= len(cpf) <= 14 or not validate_cpf_number(cpf)):
+        errors.append('CPF do Responsável inválido.')
+    if record.get('pedagogue'):
+        pedagogue = record['pedagogue']
+        record['pedagogue'] = pedagogues.get(pedagogue.lower()) or pedagogues.get(pedagogue)
+        if record['pedagogue'] is None:
+            errors.append(f'Pedagogo "{pedagogue}" não encontrado.')
+    return errors
+
+
+def _upsert(records, fields, default_pedagogue_id):
+    # One transaction per batch: the rows are inserted, or update the student
+    # with the same matricula. Empty cells keep the stored value.
+    now = datetime.datetime.now()
+    with db.atomic():
+        existing = {
+            matricula: pedagogue_id
+            for matricula, pedagogue_id in Student
+            .select(Student.matricula, Student.pedagogue)
+            .where(Student.matricula.in_(list(records)))
+            .tuples()
+        }
+        columns = [Student._meta.fields[name] for name in fields + ['pedagogue']]
+        rows = [
+            tuple(record.get(name) for name in fields) + (
+                record.get('pedagogue') or (None if matricula in existing else default_pedagogue_id), now, now
+            )
+            for matricula, record in records.items()
+        ]
+
+        update = {Student.updated_at: EXCLUDED.updated_at}
+        for field in columns:
+            if field is not Student.matricula:
+                update[field] = fn.COALESCE(getattr(EXCLUDED, field.column_name), field)
+        (Student
+         .insert_many(rows, fields=columns + [Student.created_at, Student.updated_at])
+         .on_conflict(conflict_target=[Student.matricula], update=update)
+         .execute())
+
+        changes = []
+        for matricula, student_id, pedagogue_id in (Student
+                                                    .select(Student.matricula, Student.id, Student.pedagogue)
+                                                    .where(Student.matricula.in_(list(records)))
+                                                    .tuples()):
+            if matricula not in existing:
+                changes.append((student_id, 'insert', pedagogue_id))
+                continue
+            changes.append((student_id, 'update', pedagogue_id))
+            previous = existing[matricula]
+            if previous is not None and previous != pedagogue_id:
+                changes.append((student_id, 'update', previous))
+        Student.log_changes(changes, now)
+    inserted = sum(1 for matricula in records if matricula not in existing)
+    return inserted, len(records) - inserted
+
+
+def import_students(stream, default_pedagogue_id=None, on_error=None, batch_size=None):
+    # Reads the roster CSV from a text stream one row at a time and writes
+    # it in batches of batch_size, so memory does not grow with the file.
+    # Rejected rows are passed to on_error as RowError; the rest of the file
+    # is still imported. Exports use ',' or ';', the header line decides.
+    batch_size = batch_size or Config.STUDENT_IMPORT_BATCH_SIZE
+    header_line = stream.readline()
+    delimiter = ';' if header_line.count(';') > header_line.count(',') else ','
+    header = next(csv.reader([header_line], delimiter=delimiter), [])
+    columns = {}
+    for index, name in enumerate(header):
+        field = COLUMNS.get(normalize_header(name))
+        if field:
+            columns[field] = index
+    missing = [LABELS[name] for name in REQUIRED_FIELDS if name not in columns]
+    if missing:
+        raise ValueError('Colunas obrigatórias ausentes no arquivo: ' + ', '.join(missing) + '.')
+    fields = [name for name in columns if name != 'pedagogue']
+    pedagogues = _pedagogue_lookup() if 'pedagogue' in columns else {}
+
+    result = {'inserted': 0, 'updated': 0, 'errors': 0}
+
+    def reject(line, matricula, message):
+        result['errors'] += 1
+        if on_error:
+            on_error(RowError(line, matricula, message))
+
+    def flush(batch):
+        inserted, updated = _upsert({matricula: record for matricula, (_, record) in batch.items()},
+                                    fields, default_pedagogue_id)
+        result['inserted'] += inserted
+        result['updated'] += updated
+
+    reader = csv.reader(stream, delimiter=delimiter)
+    batch = {}
+    try:
+        for values in reader:
+            # The header was read before the reader started counting.
+            line = reader.line_num + 1
+            if not any(value.strip() for value in values):
+                continue
+            record = {
+                name: (values[index].strip() if index < len(values) else '') or None
+                for name, index in columns.items()
+            }
+            errors = _validate(record, pedagogues)
+            if errors:
+                reject(line, record.get('matricula'), ' '.join(errors))
+                continue
+            if record['matricula'] in batch:
+                reject(batch.pop(record['matricula'])[0], record['matricula'],
+                       f'Matrícula repetida no arquivo; vale a linha {line}.')
+            batch[record['matricula']] = (line, record)
+            if len(batch) >= batch_size:
+                flush(batch)
+                batch = {}
+        if batch:
+            flush(batch)
+    finally:
+        # Batches already committed stay, even if a later one fails.
+        if result['inserted'] or result['updated']:
+            bump_model_version('Student')
+            invalidate_student_choices()
+    return result
+
+
+def error_report_writer(stream):
+    writer = csv.writer(stream)
+    writer.writerow(['linha', 'matricula', 'erro'])
+
+    def write(error):
+        writer.writerow([error.line, error.matricula or '', error.message])
+    return write
@@ -0,0 +1,154 @@
+import datetime
+
+from app.models import ChangeLog, Student, Event, EventException, DailyReport, GeneralReport
+from app.change_feed import changes_since
+from app.scoping import scoped
+from config import Config
+
+
+# Bump when the synced fields change, so every client starts from a new snapshot.
+SYNC_VERSION = 2
+
+SYNC_FIELDS = {
+    'Student': (Student, [
+        Student.id, Student.name, Student.matricula, Student.dob, Student.grade, Student.course, Student.cid,
+        Student.email, Student.phone, Student.responsible_name, Student.responsible_phone,
+        Student.responsible_email, Student.specific_needs_description, Student.pedagogue
+    ]),
+    'Event': (Event, [
+        Event.id, Event.title, Event.description, Event.start_time, Event.end_time, Event.student,
+        Event.recurrence, Event.recurrence_interval, Event.recurrence_weekdays, Event.recurrence_until
+    ]),
+    'DailyReport': (DailyReport, [
+        DailyReport.id, DailyReport.student, DailyReport.date, DailyReport.shift, DailyReport.activity_type,
+        DailyReport.professional_role, DailyReport.difficulties, DailyReport.actions_taken,
+        DailyReport.participants, DailyReport.observations
+    ]),
+    'GeneralReport': (GeneralReport, [
+        GeneralReport.id, GeneralReport.student, GeneralReport.date, GeneralReport.location,
+        GeneralReport.initial_conditions, GeneralReport.difficulties_found, GeneralReport.observed_abilities,
+        GeneralReport.activities_performed, GeneralReport.evolutions_observed, GeneralReport.adapted_assessments,
+        GeneralReport.professional_impediments, GeneralReport.solutions, GeneralReport.additional_information
+    ]),
+}
+
+REPORT_MODELS = (DailyReport, GeneralReport)
+
+# Sent inside the row of their series, as an extra "exceptions" column.
+# They have no change log entries of their own, but saving one saves the
+# series (see recurrence.save_exception), so the series row is sent again.
+EXCEPTION_FIELDS = [
+    EventException.original_start, EventException.cancelled, EventException.title, EventException.description,
+    EventException.start_time, EventException.end_time
+]
+
+
+def encode_token(user, change_id):
+    return f'{SYNC_VERSION}.{user.id}.{change_id}'
+
+
+def decode_token(user, token):
+    # A token from another schema version or another user (or one ahead of
+    # the change log, after a restore) means the client starts over.
+    try:
+        version, user_id, change_id = (int(part) for part in (token or '').split('.'))
+    except ValueError:
+        return None
+    if version != SYNC_VERSION or user_id != user.id:
+        return None
+    if change_id > (ChangeLog.select(ChangeLog.id).order_by(ChangeLog.id.desc()).scalar() or 0):
+        return None
+    return change_id
+
+
+def reports_since():
+    return datetime.date.today() - datetime.timedelta(days=Config.SYNC_REPORT_DAYS)
+
+
+def _compact(value):
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        return value.isoformat()
+    return value
+
+
+def _scoped_rows(user, model_name, ids=None):
+    model, fields = SYNC_FIELDS[model_name]
+    query = scoped(model.select(*fields), model, user)
+    if model in REPORT_MODELS:
+        query = query.where(model.date >= reports_since())
+    if ids is not None:
+        query = query.where(model.id.in_(sorted(ids)))
+    rows = [[_compact(value) for value in row] for row in query.order_by(model.id).tuples()]
+    if model is Event:
+        rows = _with_exceptions(rows)
+    return rows
+
+
+def _with_exceptions(rows):
+    recurrence = [field.name for field in SYNC_FIELDS['Event'][1]].index('recurrence')
+    series_ids = [row[0] for row in rows if row[recurrence]]
+    exceptions = {}
+    query = (EventException
+             .select(EventException.event, *EXCEPTION_FIELDS)
+             .where(EventException.event.in_(series_ids))
+             .order_by(EventException.event, EventException.original_start))
+    for event_id, *values in query.tuples():
+        exceptions.setdefault(event_id, []).append(
+            {field.name: _compact(value) for field, value in zip(EXCEPTION_FIELDS, values)}
+        )
+    return [row + [exceptions.get(row[0], [])] for row in rows]
+
+
+def _table(model_name, rows):
+    fields = [field.name for field in SYNC_FIELDS[model_name][1]]
+    if model_name == 'Event':
+        fields.append('exceptions')
+    return {'fields': fields, 'rows': rows}
+
+
+def _payload(user, change_id, reset, upserts, deletes, has_more):
+    return {
+        'token': encode_token(user, change_id),
+        'reset': reset,
+        'has_more': has_more,
+        'reports_since': reports_since().isoformat(),
+        'upserts': upserts,
+        'deletes': deletes,
+    }
+
+
+def sync_snapshot(user):
+    # The high-water mark is read first: anything written while the
+    # snapshot is read comes again in the next delta, and applying it twice
+    # is harmless.
+    change_id = ChangeLog.select(ChangeLog.id).order_by(ChangeLog.id.desc()).scalar() or 0
+    upserts = {name: _table(name, _scoped_rows(user, name)) for name in SYNC_FIELDS}
+    return _payload(user, change_id, True, upserts, {}, False)
+
+
+def sync_delta(user, change_id):
+    changes, next_id, has_more = changes_since(user, change_id, limit=Config.SYNC_MAX_CHANGES)
+    changed_ids = {}
+    for change in changes:
+        if change['model'] in SYNC_FIELDS:
+            changed_ids.setdefault(change['model'], set()).add(change['row_id'])
+
+    # Whatever changed is sent as it is now; rows that no longer exist or
+    # left the user's scope are sent as deletes.
+    upserts = {}
+    deletes = {}
+    for model_name, ids in changed_ids.items():
+        rows = _scoped_rows(user, model_name, ids)
+        if rows:
+            upserts[model_name] = _table(model_name, rows)
+        missing = ids - {row[0] for row in rows}
+        if missing:
+            deletes[model_name] = sorted(missing)
+    return _payload(user, next_id, False, upserts, deletes, has_more)
+
+
+def sync(user, token=None):
+    change_id = decode_token(user, token)
+    if change_id is None:
+        return sync_snapshot(user)
+    return sync_delta(user, change_id)
@@ -0,0 +1,146 @@
+import operator
+from collections import defaultdict
+from functools import reduce
+
+from peewee import JOIN, SQL, Select, Value, fn
+
+from app.models import db, User, Observation, Attendance, AttendanceSummary, Event, DailyReport, GeneralReport
+from app.archive import ARCHIVED_MODELS, archive_boundary
+
+
+# kind -> (model, column the timeline is ordered by)
+TIMELINE_SOURCES = {
+    'attendance': (Attendance, Attendance.date),
+    'daily_report': (DailyReport, DailyReport.date),
+    'event': (Event, Event.start_time),
+    'general_report': (GeneralReport, GeneralReport.date),
+    'observation': (Observation, Observation.date),
+}
+TIMELINE_MODELS = sorted(model.__name__ for model, _ in TIMELINE_SOURCES.values())
+# kind -> (archive model, column) for the kinds that have an archive.
+ARCHIVED_TIMELINE_SOURCES = {
+    kind: (ARCHIVED_MODELS[model][0], getattr(ARCHIVED_MODELS[model][0], field.name))
+    for kind, (model, field) in TIMELINE_SOURCES.items()
+    if model in ARCHIVED_MODELS
+}
+
+
+def encode_cursor(sort_key, kind, record_id):
+    return f'{sort_key}|{kind}|{record_id}'
+
+
+def decode_cursor(cursor):
+    try:
+        sort_key, kind, record_id = cursor.rsplit('|', 2)
+        return sort_key, kind, int(record_id)
+    except (AttributeError, ValueError):
+        return None
+
+
+def _branch(student_id, kind, cursor, limit, archived=False):
+    model, field = (ARCHIVED_TIMELINE_SOURCES if archived else TIMELINE_SOURCES)[kind]
+    query = (
+        model.select(
+            Value(kind).alias('kind'), model.id.alias('id'), field.alias('sort_key'),
+            Value(int(archived)).alias('archived')
+        )
+        .where(model.student == student_id)
+    )
+    if cursor:
+        # Keyset condition for (sort_key, kind, id) < cursor, resolved per
+        # branch so each one stays a range scan on its (student, date) index.
+        sort_key, cursor_kind, cursor_id = cursor
+        key = Value(sort_key, converter=False)
+        if kind < cursor_kind:
+            query = query.where(field <= key)
+        elif kind == cursor_kind:
+            query = query.where((field <= key) & ((field < key) | (model.id < cursor_id)))
+        else:
+            query = query.where(field < key)
+    query = query.order_by(field.desc(), model.id.desc()).limit(limit)
+    return Select([query], [SQL('*')])
+
+
+def _load_records(kind, ids, archived=False):
+    model, _ = (ARCHIVED_TIMELINE_SOURCES if archived else TIMELINE_SOURCES)[kind]
+    query = model.select().where(model.id.in_(ids))
+    if hasattr(model, 'pedagogue'):
+        query = (
+            model.select(model, User)
+            .join(User, JOIN.LEFT_OUTER, on=(model.pedagogue == User.id))
+            .where(model.id.in_(ids))
+        )
+    return {record.id: record for record in query}
+
+
+def _page_rows(student_id, cursor, kinds, limit, archived_kinds):
+    branches = [_branch(student_id, kind, cursor, limit + 1) for kind in kinds]
+    branches += [_branch(student_id, kind, cursor, limit + 1, archived=True) for kind in archived_kinds]
+    query = (
+        reduce(operator.add, branches)
+        .order_by(SQL('sort_key').desc(), SQL('kind').desc(), SQL('id').desc())
+        .limit(limit + 1)
+    )
+    return list(db.execute(query))
+
+
+def timeline_page(student_id, cursor=None, kinds=None, limit=20):
+    kinds = sorted(kinds or TIMELINE_SOURCES)
+    rows = _page_rows(student_id, cursor, kinds, limit, [])
+
+    # The archive is only read once the page reaches back past the archive
+    # boundary, or when the hot tables have nothing more to show.
+    archived_kinds = [kind for kind in kinds if kind in ARCHIVED_TIMELINE_SOURCES]
+    boundary = archive_boundary() if archived_kinds else None
+    if boundary is not None and (len(rows) <= limit or str(rows[-1][2]) < boundary.isoformat()):
+        rows = _page_rows(student_id, cursor, kinds, limit, archived_kinds)
+
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+
+    ids_by_source = defaultdict(list)
+    for kind, record_id, _, archived in rows:
+        ids_by_source[kind, archived].append(record_id)
+    records = {
+        (kind, archived): _load_records(kind, ids, bool(archived))
+        for (kind, archived), ids in ids_by_source.items()
+    }
+
+    items = [
+        {'kind': kind, 'record': records[kind, archived][record_id], 'archived': bool(archived)}
+        for kind, record_id, _, archived in rows
+        if record_id in records[kind, archived]
+    ]
+    next_cursor = None
+    if has_more:
+        kind, record_id, sort_key, _ = rows[-1]
+        next_cursor = encode_cursor(sort_key, kind, record_id)
+    return items, next_cursor
+
+
+def timeline_counts(student_id):
+    # Attendance is counted from the monthly summary rows instead of the
+    # attendance table (they include archived attendance); the other
+    # sections are index-only counts.
+    queries = [
+        model.select(Value(kind), fn.COUNT(model.id)).where(model.student == student_id)
+        for kind, (model, _) in TIMELINE_SOURCES.items()
+        if kind != 'attendance'
+    ]
+    queries += [
+        model.select(Value(kind), fn.COUNT(model.id)).where(model.student == student_id)
+        for kind, (model, _) in ARCHIVED_TIMELINE_SOURCES.items()
+        if kind != 'attendance'
+    ]
+    queries.append(
+        AttendanceSummary.select(
+            Value('attendance'),
+            fn.COALESCE(fn.SUM(
+                AttendanceSummary.present + AttendanceSummary.absent + AttendanceSummary.justified_absent
+            ), 0)
+        ).where((AttendanceSummary.student == student_id) & (AttendanceSummary.period_type == 'month'))
+    )
+    counts = defaultdict(int)
+    for kind, count in db.execute(reduce(operator.add, queries)):
+        counts[kind] += count
+    return dict(counts)
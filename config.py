@@ -8,9 +8,57 @@ load_dotenv()
 class Config:
     SECRET_KEY='SENHA_DO_APP'
     DATABASE = os.path.join(os.getcwd(), 'clai.db')
+    ARCHIVE_DATABASE = os.path.join(os.getcwd(), 'clai_archive.db')
     APP_BASE_NAME = "CLAI"
     APP_SUFFIX = "App"
     PAGINATION_PER_PAGE = 10
+    ATTENDANCE_STATS_PERIODS = 12
+    USER_CACHE_TTL = 60
+    USER_CACHE_STAMP = os.path.join(os.getcwd(), '.user_cache.stamp')
+    STUDENT_CHOICES_CACHE_TTL = 300
+    STUDENT_CACHE_STAMP = os.path.join(os.getcwd(), '.student_cache.stamp')
+    STUDENT_TYPEAHEAD_THRESHOLD = 200
+    MODEL_VERSION_DIR = os.path.join(os.getcwd(), '.model_versions')
+    FRAGMENT_CACHE_SIZE = 512
+    FRAGMENT_CACHE_DB = os.environ.get('FRAGMENT_CACHE_DB')
+    FRAGMENT_CACHE_TTL = 24 * 60 * 60
+    SYNC_REPORT_DAYS = 90
+    SYNC_MAX_CHANGES = 1000
+    SCHOOL_YEAR_START_MONTH = 2
+    ARCHIVE_KEEP_SCHOOL_YEARS = 1
+    ARCHIVE_BATCH_SIZE = 500
+    STUDENT_IMPORT_BATCH_SIZE = 500
+    STUDENT_IMPORT_MAX_REPORTED_ERRORS = 200
+    NOTIFICATION_DEDUP_WINDOW = 10 * 60
+    NOTIFICATION_RETENTION_DAYS = 90
+    SCHEDULER_INTERVAL = 60
+    EVENT_REMINDER_LEAD_MINUTES = 30
+    DAILY_DIGEST_HOUR = 7
+    EVENT_MAX_DURATION_DAYS = 7
+    WORKDAY_START_HOUR = 7
+    WORKDAY_END_HOUR = 22
+    FREE_SLOTS_MAX_DAYS = 31
+    BACKUP_DIR = os.path.join(os.getcwd(), 'backups')
+    BACKUP_PAGES_PER_STEP = 1024
+    BACKUP_STEP_SLEEP = 0.05
+    BACKUP_MAX_RESTARTS = 3
+    SNAPSHOT_KEEP = 14
+    REPORTING_USE_SNAPSHOT = os.environ.get('REPORTING_USE_SNAPSHOT', '') == '1'
+    REPORTING_SNAPSHOT_DIR = os.path.join(os.getcwd(), '.reporting_snapshot')
+    REPORTING_SNAPSHOT_INTERVAL = 60 * 60
+    MAINTENANCE_WINDOW_START_HOUR = 2
+    MAINTENANCE_WINDOW_END_HOUR = 5
+    MAINTENANCE_VACUUM_PAGES = 25000
+    MAINTENANCE_VACUUM_STEP = 200
+    MAINTENANCE_STEP_SLEEP = 0.05
+    MAINTENANCE_ANALYSIS_LIMIT = 1000
+    SLOW_QUERY_LOG_DB = os.environ.get('SLOW_QUERY_LOG_DB', os.path.join(os.getcwd(), 'slow_queries.db'))
+    SLOW_QUERY_THRESHOLD_MS = float(os.environ.get('SLOW_QUERY_THRESHOLD_MS', 100))
+
+    BCRYPT_LOG_ROUNDS = int(os.environ.get('BCRYPT_LOG_ROUNDS', 12))
+    LOGIN_THROTTLE_WINDOW = 15 * 60
+    LOGIN_MAX_FAILURES_PER_IP = 20
+    LOGIN_MAX_FAILURES_PER_ACCOUNT = 5
 
     DAILY_LOG_ACTIVITY_CHOICES = [
         ('adaptacao_braille', 'Adaptação de textos para transcrição Braille'),
@@ -0,0 +1,71 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+# Config resolves its file paths (databases, cache stamps, backups) against
+# the working directory when it is imported, so the tests run from a
+# scratch directory and never touch the files next to the code.
+os.chdir(tempfile.mkdtemp(prefix='clai-tests-'))
+
+from app import create_app  # noqa: E402
+from app.cache_utils import invalidate_user, invalidate_student_choices  # noqa: E402
+from app.fragment_cache import fragment_cache  # noqa: E402
+from app.models import db, ARCHIVE_SCHEMA, create_tables  # noqa: E402
+from config import Config  # noqa: E402
+
+
+class TestConfig(Config):
+    TESTING = True
+    WTF_CSRF_ENABLED = False
+    BCRYPT_LOG_ROUNDS = 4
+    FRAGMENT_CACHE_DB = None
+    SLOW_QUERY_LOG_DB = None
+
+
+def use_database(directory, monkeypatch):
+    # Points db at a fresh pair of database files in `directory`.
+    archive_path = os.path.join(directory, 'clai_archive.db')
+    monkeypatch.setattr(Config, 'ARCHIVE_DATABASE', archive_path)
+    monkeypatch.setattr(Config, 'MODEL_VERSION_DIR', os.path.join(directory, 'model_versions'))
+    db.close()
+    db.detach(ARCHIVE_SCHEMA)
+    db.init(os.path.join(directory, 'clai.db'))
+    db.attach(archive_path, ARCHIVE_SCHEMA)
+    create_tables()
+    fragment_cache.configure(TestConfig.FRAGMENT_CACHE_SIZE)
+    invalidate_user(None)
+    invalidate_student_choices()
+    return db
+
+
+@pytest.fixture
+def database(tmp_path, monkeypatch):
+    yield use_database(str(tmp_path), monkeypatch)
+    db.close()
+
+
+@pytest.fixture
+def app(database):
+    return create_app(TestConfig)
+
+
+class StatementRecorder:
+    # Takes the place of the slow query store with a zero threshold, so
+    # every statement is kept with its plan.
+    def __init__(self):
+        self.samples = []
+
+    def record(self, sample):
+        self.samples.append(sample)
+
+
+@pytest.fixture
+def recorder():
+    recorder = StatementRecorder()
+    db.log_slow_queries(recorder, 0)
+    yield recorder
+    db.slow_query_store = None
@@ -0,0 +1,82 @@
+import datetime
+
+import pytest
+
+from app.archive import archive_records
+from app.models import User, Student, Attendance, ArchivedAttendance, AttendanceSummary, Notification
+
+
+DAY = datetime.date(2025, 11, 10)
+BOUNDARY = datetime.date(2025, 12, 1)
+
+
+@pytest.fixture
+def archived_day(app):
+    pedagogue = User.create(username='ped', email='ped@academico.ifpb.edu.br', password='!', name='Ped',
+                            role='pedagogue')
+    student = Student.create(name='Aluno', matricula='202400000001', dob=datetime.date(2008, 1, 1), grade='1A',
+                             pedagogue=pedagogue)
+    Attendance.create(student=student, date=DAY, status='present')
+    Notification.create(recipient=pedagogue, message='Aviso antigo',
+                        timestamp=datetime.datetime.combine(DAY, datetime.time(9)))
+    archive_records(BOUNDARY)
+
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['_user_id'] = str(pedagogue.id)
+        session['_fresh'] = True
+    return client, student
+
+
+def month_summary(student):
+    return (AttendanceSummary
+            .select(AttendanceSummary.present, AttendanceSummary.absent)
+            .where((AttendanceSummary.student == student) & (AttendanceSummary.period_type == 'month') &
+                   (AttendanceSummary.period_start == DAY.replace(day=1)))
+            .tuples()
+            .first())
+
+
+def test_mark_attendance_shows_archived_day_read_only(archived_day):
+    client, student = archived_day
+    response = client.get(f'/attendance/mark?date={DAY}')
+    assert response.status_code == 200
+    page = response.get_data(as_text=True)
+    assert 'já foi arquivada' in page
+    assert '<option value="present" selected>' in page
+
+
+def test_attendance_writes_before_archive_boundary_are_refused(archived_day):
+    client, student = archived_day
+    summary = month_summary(student)
+
+    response = client.post(f'/attendance/mark?date={DAY}', data={f'status_{student.id}': 'absent'})
+    assert response.status_code == 302
+    response = client.post('/attendance/new', data={'student_id': student.id, 'date': DAY.isoformat(),
+                                                    'status': 'absent'})
+    assert response.status_code == 200
+    assert 'já foi arquivada' in response.get_data(as_text=True)
+
+    assert Attendance.select().count() == 0
+    assert [row.status for row in ArchivedAttendance.select()] == ['present']
+    assert month_summary(student) == summary == (1, 0)
+
+
+def test_attendance_after_archive_boundary_is_saved(archived_day):
+    client, student = archived_day
+    day = BOUNDARY + datetime.timedelta(days=1)
+    response = client.post(f'/attendance/mark?date={day}', data={f'status_{student.id}': 'absent'})
+    assert response.status_code == 302
+    assert [(row.date, row.status) for row in Attendance.select()] == [(day, 'absent')]
+
+
+def test_lists_read_the_archive_for_an_archived_date(archived_day):
+    client, student = archived_day
+
+    page = client.get('/attendance').get_data(as_text=True)
+    assert 'Registros Arquivados' not in page
+    page = client.get(f'/attendance?date={DAY}').get_data(as_text=True)
+    assert 'Registros Arquivados' in page and DAY.strftime('%d/%m/%Y') in page
+
+    assert 'Aviso antigo' not in client.get('/notifications').get_data(as_text=True)
+    assert 'Aviso antigo' in client.get(f'/notifications?date={DAY}').get_data(as_text=True)
@@ -0,0 +1,39 @@
+import sqlite3
+
+from app.models import db, User
+from app.query_log import SlowQueryStore
+
+
+def test_slow_query_log_keeps_no_parameters(database, tmp_path):
+    path = str(tmp_path / 'slow.db')
+    store = SlowQueryStore(path)
+    User.create(username='11144477735', email='ped@academico.ifpb.edu.br', password='$2b$04$secret-hash', name='Ped')
+    db.log_slow_queries(store, 0)
+    try:
+        User.get_or_none((User.email == 'ped@academico.ifpb.edu.br') | (User.username == 'ped@academico.ifpb.edu.br'))
+        User.update(password='$2b$04$another-hash').where(User.username == '11144477735').execute()
+    finally:
+        db.slow_query_store = None
+
+    rows = store.top('count', limit=100)
+    assert any('"users"' in row['sql'] for row in rows)
+    dump = '\n'.join(sqlite3.connect(path).iterdump())
+    for value in ('secret-hash', 'another-hash', 'ped@academico', '11144477735'):
+        assert value not in dump
+
+
+def test_old_logs_are_scrubbed(tmp_path):
+    path = str(tmp_path / 'slow.db')
+    conn = sqlite3.connect(path)
+    conn.execute(
+        'CREATE TABLE slow_queries ('
+        'statement TEXT PRIMARY KEY, count INTEGER NOT NULL, total_ms REAL NOT NULL, max_ms REAL NOT NULL, '
+        'full_scans TEXT NOT NULL, temp_btree INTEGER NOT NULL, last_seen REAL NOT NULL, '
+        'sql TEXT NOT NULL, params TEXT, route TEXT, caller TEXT, plan TEXT)'
+    )
+    conn.execute("INSERT INTO slow_queries VALUES ('s', 1, 1, 1, '[]', 0, 0, 's', '[\"cpf\"]', NULL, NULL, '[]')")
+    conn.commit()
+    conn.close()
+
+    assert [row['statement'] for row in SlowQueryStore(path).top()] == ['s']
+    assert sqlite3.connect(path).execute('SELECT params FROM slow_queries').fetchone() == (None,)
@@ -0,0 +1,182 @@
+import datetime
+import json
+import random
+
+import pytest
+from peewee import chunked
+
+from app import create_app
+from app.attendance_bitmaps import rebuild_attendance_bitmaps
+from app.attendance_stats import rebuild_attendance_summary
+from app.models import (
+    db, SHIFTS, ActivityType, ChangeLog, User, Student, Observation, Attendance, AttendanceSummary, AttendanceBitmap,
+    Event, DailyReport, GeneralReport, Notification
+)
+from config import Config
+
+from conftest import TestConfig, use_database
+
+
+# The statements behind the busiest pages, run against a seeded database
+# and checked on their EXPLAIN QUERY PLAN: no full scan of a table that
+# grows with use, no temporary B-tree to sort for an ORDER BY, and no more
+# statements than the page's budget.
+
+LARGE_TABLES = {
+    model._meta.table_name for model in (
+        ChangeLog, Student, Observation, Attendance, AttendanceSummary, AttendanceBitmap, Event, DailyReport,
+        GeneralReport, Notification
+    )
+}
+
+# Series are looked up on their own partial index, so the calendar reads the
+# series active in the window rather than every event that started before it.
+SERIES_INDEX = 'event_recurrence_until_start_time'
+
+TODAY = datetime.date.today()
+WINDOW = f'start={TODAY - datetime.timedelta(days=7)}&end={TODAY + datetime.timedelta(days=35)}'
+
+# (role, url, most statements the page may run)
+ROUTES = [
+    ('pedagogue', '/dashboard', 8),
+    ('admin', '/dashboard', 8),
+    ('pedagogue', '/students', 3),
+    ('admin', '/students', 3),
+    ('pedagogue', '/attendance', 4),
+    ('admin', '/attendance', 4),
+    ('pedagogue', f'/attendance/mark?date={TODAY}&grade=1A', 4),
+    ('admin', f'/attendance/mark?date={TODAY}&grade=1A', 4),
+    ('pedagogue', '/daily-reports', 4),
+    ('admin', '/daily-reports', 4),
+    ('pedagogue', '/general-reports', 4),
+    ('admin', '/general-reports', 4),
+    ('pedagogue', '/notifications', 5),
+    ('admin', '/admin/users', 3),
+    ('pedagogue', f'/calendar_api?{WINDOW}', 3),
+    ('admin', f'/calendar_api?{WINDOW}', 3),
+    ('pedagogue', '/notifications/unread_count', 2),
+]
+
+PEDAGOGUES = 4
+STUDENTS = 1000
+DAYS = 40
+
+
+def seed():
+    rng = random.Random(0)
+    activity_types = [key for key, _ in Config.DAILY_LOG_ACTIVITY_CHOICES]
+    grades = [f'{year}{group}' for year in range(1, 5) for group in 'ABC']
+    now = datetime.datetime.combine(TODAY, datetime.time(8))
+
+    def insert(model, rows):
+        for batch in chunked(rows, 500):
+            model.insert_many(batch).execute()
+
+    insert(User, [
+        {'username': f'user{i}', 'email': f'user{i}@academico.ifpb.edu.br', 'password': '!', 'name': f'Usuário {i}',
+         'role': 'admin' if i == 0 else 'pedagogue'}
+        for i in range(PEDAGOGUES + 1)
+    ])
+    pedagogue_ids = [user_id for user_id, in User.select(User.id).where(User.role == 'pedagogue').tuples()]
+    insert(Student, [
+        {'name': f'Aluno {i:04d}', 'matricula': f'2024{i:08d}', 'dob': datetime.date(2008, 1, 1),
+         'grade': grades[i % len(grades)], 'course': 'Informática', 'pedagogue': pedagogue_ids[i % len(pedagogue_ids)]}
+        for i in range(STUDENTS)
+    ])
+    owners = dict(Student.select(Student.id, Student.pedagogue).tuples())
+
+    days = [TODAY - datetime.timedelta(days=offset) for offset in range(DAYS)]
+    insert(Attendance, [
+        {'student': student_id, 'date': day, 'status': rng.choice(('present', 'present', 'present', 'absent'))}
+        for student_id in owners for day in days if day.weekday() < 5
+    ])
+    insert(DailyReport, [
+        {'student': student_id, 'pedagogue': owners[student_id], 'date': rng.choice(days),
+         'shift': [rng.choice(SHIFTS)], 'activity_type': rng.choice(activity_types)}
+        for student_id in owners for _ in range(5)
+    ])
+    insert(GeneralReport, [
+        {'student': student_id, 'pedagogue': owners[student_id], 'date': rng.choice(days)} for student_id in owners
+    ])
+    insert(Observation, [
+        {'student': student_id, 'pedagogue': owners[student_id], 'date': rng.choice(days),
+         'observation_text': 'Observação'}
+        for student_id in owners for _ in range(2)
+    ])
+    events = []
+    for student_id in owners:
+        start = now + datetime.timedelta(days=rng.randint(-DAYS, DAYS), hours=rng.randint(0, 8))
+        events.append({'title': 'Atendimento', 'start_time': start, 'end_time': start + datetime.timedelta(hours=1),
+                       'student': student_id, 'pedagogue': owners[student_id]})
+    insert(Event, events)
+    series = []
+    for i, pedagogue_id in enumerate(pedagogue_ids * 25):
+        start = now - datetime.timedelta(days=rng.randint(3 * DAYS, 4 * DAYS), hours=rng.randint(0, 8))
+        # Half of the series ended before the checked windows.
+        until = TODAY - datetime.timedelta(days=2 * DAYS) if i % 2 else None
+        series.append({'title': 'Acompanhamento', 'start_time': start, 'end_time': start + datetime.timedelta(hours=1),
+                       'pedagogue': pedagogue_id, 'recurrence': 'weekly', 'recurrence_interval': 1,
+                       'recurrence_until': until})
+    insert(Event, series)
+    insert(Notification, [
+        {'recipient': pedagogue_id, 'message': 'Aviso', 'is_read': i % 3 != 0,
+         'timestamp': now - datetime.timedelta(hours=i)}
+        for pedagogue_id in pedagogue_ids for i in range(1000)
+    ])
+    rebuild_attendance_summary()
+    rebuild_attendance_bitmaps()
+    ActivityType.load()
+    db.execute_sql('ANALYZE')
+
+
+@pytest.fixture(scope='module')
+def seeded(tmp_path_factory):
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        use_database(str(tmp_path_factory.mktemp('plans')), monkeypatch)
+        with db:
+            seed()
+        users = {role: user_id for role, user_id in User.select(User.role, User.id).order_by(User.id.desc()).tuples()}
+        yield create_app(TestConfig), users
+        db.close()
+
+
+@pytest.mark.parametrize('role, url, budget', ROUTES)
+def test_query_plans(seeded, recorder, role, url, budget):
+    app, users = seeded
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['_user_id'] = str(users[role])
+        session['_fresh'] = True
+
+    response = client.get(url)
+
+    assert response.status_code == 200
+    statements = [sample['statement'] for sample in recorder.samples]
+    for sample in recorder.samples:
+        scans = [table for table in json.loads(sample['full_scans']) if table in LARGE_TABLES]
+        assert not scans, f"SCAN {', '.join(scans)}: {sample['statement']}"
+        plan = json.loads(sample['plan'])
+        assert not any('USE TEMP B-TREE FOR ORDER BY' in detail for detail in plan), sample['statement']
+    assert len(statements) <= budget, statements
+
+
+@pytest.mark.parametrize('role', ['pedagogue', 'admin'])
+def test_calendar_reads_series_through_their_index(seeded, recorder, role):
+    app, users = seeded
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['_user_id'] = str(users[role])
+        session['_fresh'] = True
+
+    response = client.get(f'/calendar_api?{WINDOW}')
+
+    assert response.status_code == 200
+    assert any(event['title'] == 'Acompanhamento' for event in response.get_json())
+    series_lookups = [sample for sample in recorder.samples
+                      if sample['sql'].startswith('SELECT') and '"recurrence" IS NOT NULL' in sample['sql']]
+    assert series_lookups
+    for sample in series_lookups:
+        plan = json.loads(sample['plan'])
+        assert any(SERIES_INDEX in detail for detail in plan), plan
+        # No range that is open towards the past, like start_time < window end.
+        assert not any('start_time<?' in detail and SERIES_INDEX not in detail for detail in plan), plan
@@ -0,0 +1,47 @@
+import datetime
+import json
+
+from app.models import User, Event
+from app.recurrence import expand
+from app.scheduler import send_event_reminders, send_daily_digests
+
+
+NOW = datetime.datetime(2026, 10, 19, 8, 0)  # a Monday
+SERIES_INDEX = 'event_recurrence_until_start_time'
+
+
+def create_events():
+    pedagogue = User.create(username='ped', email='ped@academico.ifpb.edu.br', password='!', name='Ped',
+                            role='pedagogue')
+    start = NOW.replace(hour=8, minute=15) - datetime.timedelta(weeks=20)
+    common = {'pedagogue': pedagogue, 'end_time': start + datetime.timedelta(hours=1)}
+    Event.create(title='Semanal', start_time=start, recurrence='weekly', recurrence_interval=1, **common)
+    Event.create(title='Até dezembro', start_time=start, recurrence='daily', recurrence_interval=1,
+                 recurrence_until=datetime.date(2026, 12, 1), **common)
+    Event.create(title='Encerrado', start_time=start, recurrence='daily', recurrence_interval=1,
+                 recurrence_until=datetime.date(2026, 9, 1), **common)
+    for days in range(200):
+        day = start - datetime.timedelta(days=days)
+        Event.create(title='Antigo', start_time=day, end_time=day + datetime.timedelta(hours=1), pedagogue=pedagogue)
+
+
+def test_expand_reads_only_series_active_in_the_window(database):
+    create_events()
+    window_start = NOW.replace(hour=0)
+    occurrences = expand(Event.select(), window_start, window_start + datetime.timedelta(days=1))
+    assert sorted(occurrence.title for occurrence in occurrences) == ['Até dezembro', 'Semanal']
+
+
+def test_scheduler_reads_series_through_their_index(database, recorder):
+    create_events()
+    send_event_reminders(NOW)
+    send_daily_digests(NOW)
+
+    series_lookups = [sample for sample in recorder.samples
+                      if sample['sql'].startswith('SELECT') and '"recurrence" IS NOT NULL' in sample['sql']]
+    assert series_lookups
+    for sample in series_lookups:
+        plan = json.loads(sample['plan'])
+        assert any(SERIES_INDEX in detail for detail in plan), plan
+        # No range that is open towards the past, like start_time < window end.
+        assert not any('start_time<?' in detail and SERIES_INDEX not in detail for detail in plan), plan
@@ -0,0 +1,54 @@
+import pytest
+
+import app.student_import as student_import
+from app.models import Student
+from config import Config
+
+
+HEADER = 'matricula;nome;data_nascimento\n'
+
+
+def write_roster(path, count):
+    with open(path, 'w', encoding='utf-8') as roster:
+        roster.write(HEADER)
+        for i in range(count):
+            roster.write(f'2024000000{i:02d};Aluno {i:02d};2008-01-01\n')
+    return str(path)
+
+
+def test_import_students_inserts_every_row(app, tmp_path):
+    result = app.test_cli_runner().invoke(args=['import_students', write_roster(tmp_path / 'roster.csv', 5)])
+    assert result.exit_code == 0, result.output
+    assert '5 students added' in result.output
+    assert Student.select().count() == 5
+
+
+def test_failed_batch_keeps_earlier_batches(app, tmp_path, monkeypatch):
+    monkeypatch.setattr(Config, 'STUDENT_IMPORT_BATCH_SIZE', 2)
+    upsert = student_import._upsert
+    calls = []
+
+    def fail_third_batch(records, fields, default_pedagogue_id):
+        calls.append(list(records))
+        if len(calls) == 3:
+            raise RuntimeError('batch failed')
+        return upsert(records, fields, default_pedagogue_id)
+    monkeypatch.setattr(student_import, '_upsert', fail_third_batch)
+
+    result = app.test_cli_runner().invoke(args=['import_students', write_roster(tmp_path / 'roster.csv', 8)])
+
+    assert isinstance(result.exception, RuntimeError)
+    assert len(calls) == 3
+    kept = {matricula for matricula, in Student.select(Student.matricula).tuples()}
+    assert kept == set(calls[0] + calls[1])
+
+
+@pytest.mark.parametrize('delimiter', [',', ';'])
+def test_rejected_rows_are_reported(app, tmp_path, delimiter):
+    path = tmp_path / 'roster.csv'
+    path.write_text(delimiter.join(['matricula', 'nome', 'data_nascimento']) + '\n'
+                    + delimiter.join(['202400000001', 'Aluno Um', '2008-01-01']) + '\n'
+                    + delimiter.join(['123', 'Aluno Dois', '2008-01-01']) + '\n', encoding='utf-8')
+    result = app.test_cli_runner().invoke(args=['import_students', str(path)])
+    assert result.exit_code == 0, result.output
+    assert '1 students added, 0 updated, 1 rows rejected.' in result.output